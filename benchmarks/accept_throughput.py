@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Compare the accept throughput of the PythonMTA's listener modes:
+
+- token: all workers share one socket, an accept token is passed around via
+  a multiprocessing.Queue (default)
+- reuseport: every worker has its own SO_REUSEPORT socket
+
+--clients concurrent clients open a connection, wait for the greeting and
+send QUIT for --duration seconds. The script reports sessions per second.
+
+Usage: python benchmarks/accept_throughput.py [--clients 8] [--duration 5]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import functools
+import os
+import socket
+import sys
+import threading
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchutil import run_server
+from pymta import PythonMTA
+from pymta.test_util import NullDeliverer, SMTPClient, free_port
+
+
+def measure_sessions_per_second(port, nr_clients, duration):
+    counter = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client_loop():
+        while time.time() < deadline:
+            client = SMTPClient('127.0.0.1', port)
+            client.quit()
+            with lock:
+                counter[0] += 1
+
+    threads = [threading.Thread(target=client_loop) for i in range(nr_clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counter[0] / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0)
+    args = parser.parse_args()
+
+    modes = [('token', False)]
+    if hasattr(socket, 'SO_REUSEPORT'):
+        modes.append(('reuseport', True))
+    print('%-12s %14s' % ('listener', 'sessions/sec'))
+    for mode_name, reuse_port in modes:
+        port = free_port()
+        factory = functools.partial(PythonMTA, '127.0.0.1', port, NullDeliverer,
+                                    reuse_port=reuse_port)
+        with run_server(factory, port):
+            sessions_per_second = measure_sessions_per_second(port, args.clients, args.duration)
+        print('%-12s %14.1f' % (mode_name, sessions_per_second))
+
+
+if __name__ == '__main__':
+    main()
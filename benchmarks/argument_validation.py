@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Measure how many SMTP command arguments per second can be validated for
+each command:
+ - fast: pymta.validation.validate_arguments() (default)
+ - cached: pycerberus only, but with a shared schema instance
+ - pycerberus: a new schema instance for every command (pymta 0.8)
+
+Usage: python benchmarks/argument_validation.py [--iterations 20000]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymta.validation import (
+    HeloSchema,
+    MailFromSchema,
+    RcptToSchema,
+    SMTPCommandArgumentsSchema,
+    validate_arguments,
+)
+
+
+COMMANDS = (
+    ('HELO', HeloSchema, 'client.example.com'),
+    ('MAIL FROM', MailFromSchema, '<sender@example.com> SIZE=12345'),
+    ('RCPT TO', RcptToSchema, '<recipient@example.com>'),
+    ('DATA', SMTPCommandArgumentsSchema, ''),
+)
+
+
+def measure(validate, iterations):
+    start = time.time()
+    for i in range(iterations):
+        validate()
+    return iterations / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    context = dict(esmtp=True)
+    print('%-10s %12s %12s %12s' % ('command', 'fast/s', 'cached/s', 'pycerberus/s'))
+    for command, schema_class, value in COMMANDS:
+        fast = measure(lambda: validate_arguments(schema_class, value, context),
+                       args.iterations)
+        cached = measure(lambda: validate_arguments(schema_class, value, context,
+                                                    use_fast_path=False),
+                         args.iterations)
+        uncached = measure(lambda: schema_class().process(value, context=context),
+                           args.iterations)
+        print('%-10s %12.0f %12.0f %12.0f' % (command, fast, cached, uncached))
+
+
+if __name__ == '__main__':
+    main()
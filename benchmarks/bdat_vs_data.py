@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Compare the time needed to receive big messages via DATA and via BDAT
+(CHUNKING, RFC 3030). The message is fed into the SMTPCommandParser in
+64 KiB packets (no sockets involved), the deliverer just counts the bytes.
+
+With BDAT the message is sent in chunks of --chunk-size MB.
+
+Usage: python benchmarks/bdat_vs_data.py [--sizes 1,10,50] [--chunk-size 1]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymta.api import IStreamingMessageDeliverer
+from pymta.command_parser import SMTPCommandParser
+from pymta.test_util import MockChannel
+
+
+PACKET_SIZE = 64 * 1024
+LINE = b'x' * 76 + b'\r\n'
+
+
+class CountingDeliverer(IStreamingMessageDeliverer):
+    def begin_message(self, msg):
+        self.size = 0
+
+    def write_chunk(self, msg, chunk):
+        self.size += len(chunk)
+
+    def commit_message(self, msg):
+        pass
+
+    def abort_message(self, msg):
+        pass
+
+
+def build_message(size_mb):
+    return LINE * ((size_mb * 1024 * 1024) // len(LINE))
+
+
+def split_packets(data):
+    return [data[i:i+PACKET_SIZE] for i in range(0, len(data), PACKET_SIZE)]
+
+
+def data_packets(message):
+    return [b'DATA\r\n'] + split_packets(message + b'.\r\n')
+
+
+def bdat_packets(message, chunk_size):
+    stream = []
+    for offset in range(0, len(message), chunk_size):
+        chunk = message[offset:offset+chunk_size]
+        is_last = (offset + chunk_size >= len(message))
+        stream.append(('BDAT %d%s\r\n' % (len(chunk), ' LAST' if is_last else '')).encode('ascii'))
+        stream.append(chunk)
+    return split_packets(b''.join(stream))
+
+
+def receive_message(packets):
+    parser = SMTPCommandParser(MockChannel(), '127.0.0.1', 4567, CountingDeliverer())
+    parser.process_new_data(b'EHLO foo\r\nMAIL FROM:<foo@example.com>\r\n')
+    parser.process_new_data(b'RCPT TO:<bar@example.com>\r\n')
+    start = time.time()
+    for packet in packets:
+        parser.process_new_data(packet)
+    duration = time.time() - start
+    assert parser._channel.replies[-1] == '250 OK\r\n'
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1,10,50',
+                        help='message sizes in MB (comma-separated)')
+    parser.add_argument('--chunk-size', type=float, default=1, help='BDAT chunk size in MB')
+    args = parser.parse_args()
+
+    chunk_size = int(args.chunk_size * 1024 * 1024)
+    print('%8s %12s %12s' % ('size MB', 'DATA MB/s', 'BDAT MB/s'))
+    for size_mb in [int(size) for size in args.sizes.split(',')]:
+        message = build_message(size_mb)
+        data_duration = receive_message(data_packets(message))
+        bdat_duration = receive_message(bdat_packets(message, chunk_size))
+        print('%8d %12.1f %12.1f' % (size_mb, size_mb / data_duration, size_mb / bdat_duration))
+
+
+if __name__ == '__main__':
+    main()
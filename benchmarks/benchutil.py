@@ -0,0 +1,14 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Shared helpers for the benchmark scripts in this directory: run_server()
+runs a server in a separate process (see pymta.test_util for the
+NullDeliverer and the SMTPClient)."""
+
+from __future__ import print_function, unicode_literals
+
+from pymta.test_util import MTAProcess
+
+
+__all__ = ['run_server']
+
+run_server = MTAProcess
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Compare the prefork PythonMTA with the AsyncPythonMTA:
+
+- concurrency: how many connections (out of --connections) receive the SMTP
+  greeting within --greeting-timeout seconds while all of them stay open.
+- throughput: messages per second sent by --clients concurrent clients (one
+  message per connection) for --duration seconds.
+
+Usage: python benchmarks/connection_concurrency.py [--connections 500]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import functools
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchutil import run_server
+from pymta import PythonMTA
+from pymta.async_mta import AsyncPythonMTA
+from pymta.test_util import NullDeliverer, SMTPClient, free_port
+
+
+ENGINES = (
+    ('multiprocessing', PythonMTA),
+    ('asyncio', AsyncPythonMTA),
+)
+
+MESSAGE = b'Subject: benchmark\r\n\r\n' + b'x' * 70 + b'\r\n'
+
+
+def count_greeted_connections(port, nr_connections, timeout):
+    selector = selectors.DefaultSelector()
+    sockets = []
+    for i in range(nr_connections):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.connect_ex(('127.0.0.1', port))
+        selector.register(sock, selectors.EVENT_READ)
+        sockets.append(sock)
+
+    greeted = 0
+    deadline = time.time() + timeout
+    while (greeted < nr_connections) and (time.time() < deadline):
+        for key, events in selector.select(timeout=max(deadline - time.time(), 0)):
+            try:
+                data = key.fileobj.recv(1024)
+            except socket.error:
+                data = b''
+            if data.startswith(b'220'):
+                greeted += 1
+            selector.unregister(key.fileobj)
+    for sock in sockets:
+        sock.close()
+    selector.close()
+    return greeted
+
+
+def measure_throughput(port, nr_clients, duration):
+    counter = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client_loop():
+        while time.time() < deadline:
+            client = SMTPClient('127.0.0.1', port)
+            client.command('HELO benchmark')
+            code = client.send_message('from@example.com', ['to@example.com'], MESSAGE)
+            client.quit()
+            assert code == 250
+            with lock:
+                counter[0] += 1
+
+    threads = [threading.Thread(target=client_loop) for i in range(nr_clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counter[0] / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--greeting-timeout', type=float, default=3.0)
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print('%-16s %22s %14s' % ('engine', 'greeted connections', 'msgs/sec'))
+    for engine_name, mta_class in ENGINES:
+        port = free_port()
+        factory = functools.partial(mta_class, '127.0.0.1', port, NullDeliverer)
+        with run_server(factory, port):
+            greeted = count_greeted_connections(port, args.connections, args.greeting_timeout)
+            # let the server notice the closed connections
+            time.sleep(1)
+            msgs_per_second = measure_throughput(port, args.clients, args.duration)
+        greeted_str = '%d/%d' % (greeted, args.connections)
+        print('%-16s %22s %14.1f' % (engine_name, greeted_str, msgs_per_second))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Show how the time to receive a message (DATA) scales with its size. The
+message is fed into the SMTPCommandParser in 4 KiB packets (no sockets
+involved).
+
+For comparison the 'legacy' column shows the framing strategy used in pymta
+0.8 (append every packet to a str and search the whole buffer for the
+terminator), which is quadratic in the message size.
+
+Usage: python benchmarks/framing_scaling.py [--sizes 1,2,4,8,16,32]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymta.command_parser import SMTPCommandParser
+from pymta.test_util import MockChannel, NullDeliverer
+
+
+PACKET_SIZE = 4096
+LINE = b'x' * 76 + b'\r\n'
+
+
+def build_packets(size_mb):
+    nr_lines = (size_mb * 1024 * 1024) // len(LINE)
+    data = LINE * nr_lines + b'.\r\n'
+    return [data[i:i+PACKET_SIZE] for i in range(0, len(data), PACKET_SIZE)]
+
+
+def receive_message(packets):
+    parser = SMTPCommandParser(MockChannel(), '127.0.0.1', 4567, NullDeliverer())
+    for command in (b'HELO foo\r\n', b'MAIL FROM:<foo@example.com>\r\n',
+                    b'RCPT TO:<bar@example.com>\r\n', b'DATA\r\n'):
+        parser.process_new_data(command)
+    start = time.time()
+    for packet in packets:
+        parser.process_new_data(packet)
+    duration = time.time() - start
+    assert parser.is_in_command_mode()
+    return duration
+
+
+def legacy_framing(packets):
+    terminator = '\r\n.\r\n'
+    start = time.time()
+    data = ''
+    for packet in packets:
+        data += packet.decode('ascii')
+        if terminator in data:
+            break
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1,2,4,8,16,32',
+                        help='message sizes in MB (comma-separated)')
+    parser.add_argument('--legacy-max-size', type=int, default=8,
+                        help='skip the legacy framing for bigger messages (MB)')
+    args = parser.parse_args()
+
+    print('%8s %12s %12s %14s' % ('size MB', 'seconds', 'MB/s', 'legacy secs'))
+    for size_mb in [int(size) for size in args.sizes.split(',')]:
+        packets = build_packets(size_mb)
+        duration = receive_message(packets)
+        legacy_str = '-'
+        if size_mb <= args.legacy_max_size:
+            legacy_str = '%.3f' % legacy_framing(packets)
+        print('%8d %12.3f %12.1f %14s' % (size_mb, duration, size_mb / duration, legacy_str))
+
+
+if __name__ == '__main__':
+    main()
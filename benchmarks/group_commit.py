@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Measure the message throughput with concurrent clients and a deliverer
+which needs --delay ms per call (e.g. for an fsync or a database commit).
+All deliverers of a worker share the same "disk" so their commits are
+serialized.
+
+Columns:
+ - single: IMessageDeliverer, every message is delivered separately
+ - batch: IBatchMessageDeliverer, messages of concurrent sessions are
+   delivered together (group commit)
+
+Usage: python benchmarks/group_commit.py [--delay 10] [--clients 16] [--messages 50]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import functools
+import os
+import sys
+import threading
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchutil import run_server
+from pymta import IMessageDeliverer, PythonMTA
+from pymta.api import IBatchMessageDeliverer
+from pymta.test_util import SMTPClient, free_port
+
+
+_disk = threading.Lock()
+
+
+def commit(delay):
+    with _disk:
+        time.sleep(delay)
+
+
+class SlowDeliverer(IMessageDeliverer):
+    delay = 0.01
+
+    def new_message_accepted(self, msg):
+        commit(self.delay)
+
+
+class SlowBatchDeliverer(IBatchMessageDeliverer):
+    delay = 0.01
+
+    def new_messages_accepted(self, batch):
+        commit(self.delay)
+
+
+def send_messages(port, nr_messages):
+    client = SMTPClient('127.0.0.1', port)
+    client.command('EHLO client.example.com')
+    body = b'Subject: test\r\n\r\n' + b'x' * 1000
+    for i in range(nr_messages):
+        client.send_message('foo@example.com', ['bar@example.com'], body)
+    client.quit()
+
+
+def measure_throughput(port, nr_clients, nr_messages):
+    threads = [threading.Thread(target=send_messages, args=(port, nr_messages))
+               for i in range(nr_clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (nr_clients * nr_messages) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--delay', type=float, default=10, help='deliverer delay in ms')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=50, help='messages per client')
+    args = parser.parse_args()
+    SlowDeliverer.delay = SlowBatchDeliverer.delay = args.delay / 1000.0
+
+    print('%-8s %10s' % ('mode', 'msgs/s'))
+    for mode_name, deliverer_class in (('single', SlowDeliverer), ('batch', SlowBatchDeliverer)):
+        port = free_port()
+        factory = functools.partial(PythonMTA, '127.0.0.1', port, deliverer_class,
+                                    initial_workers=1, threads_per_worker=args.clients)
+        with run_server(factory, port):
+            throughput = measure_throughput(port, args.clients, args.messages)
+        print('%-8s %10.1f' % (mode_name, throughput))
+
+
+if __name__ == '__main__':
+    main()
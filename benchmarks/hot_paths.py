@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Microbenchmarks for the pure-Python hot paths (no sockets): every
+scenario is run through each layer separately.
+
+Layers:
+- parse: ParserImplementation.parse() for all command lines
+- statemachine: StateMachine.execute() for all commands (no handlers)
+- session: SMTPSession.handle_input() with a MockCommandParser
+- command_parser: SMTPCommandParser.process_new_data() with a MockChannel
+  (including the SMTPSession), the message is received in 64 KiB chunks
+
+Scenarios: small (1 KiB message), large (1 MiB message), many_recipients
+(100 RCPT TO) and auth (AUTH PLAIN before MAIL FROM). Every operation is a
+complete session of the scenario (EHLO ... QUIT).
+
+Each benchmark is repeated until it ran for at least --min-time seconds
+and the best of --repeat runs is reported (us/op). Use --json to save the
+results and --compare to show the change against a saved result (e.g. from
+a previous commit).
+
+Usage: python benchmarks/hot_paths.py [--repeat 5] [--min-time 0.2]
+           [--filter session] [--json results.json] [--compare old.json]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import gc
+import json
+import os
+import sys
+from collections import OrderedDict
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymta.command_parser import ParserImplementation, SMTPCommandParser
+from pymta.compat import b64encode
+from pymta.config import ServerConfig
+from pymta.metrics import timer
+from pymta.session import SMTPSession
+from pymta.test_util import DummyAuthenticator, MockChannel, MockCommandParser, NullDeliverer
+
+
+RECV_SIZE = 65536
+
+
+class Scenario(object):
+    def __init__(self, message_size, nr_recipients=1, use_auth=False):
+        self.commands = [('EHLO', 'client.example.com')]
+        if use_auth:
+            self.commands.append(('AUTH PLAIN', b64encode('\x00user\x00user')))
+        self.commands.append(('MAIL FROM', '<sender@example.com>'))
+        self.commands.extend([('RCPT TO', '<rcpt%d@example.com>' % i)
+                              for i in range(nr_recipients)])
+        self.commands.append(('DATA', None))
+
+        line = b'x' * 76
+        header = b'Subject: Benchmark\n\n'
+        nr_lines = max(message_size - len(header), 0) // (len(line) + 1) + 1
+        # the session gets '\n' line endings, the client sends '\r\n'
+        self.message = header + b'\n'.join([line] * nr_lines)
+        self.message_data = self.message.replace(b'\n', b'\r\n') + b'\r\n.\r\n'
+
+        self.lines = [self._command_line(command, argument)
+                      for command, argument in self.commands + [('QUIT', None)]]
+        self.actions = ['GREET'] + [command for command, argument in self.commands] + \
+            ['MSGDATA', 'QUIT']
+
+    def _command_line(self, command, argument):
+        if argument is None:
+            return command
+        separator = ':' if command in ('MAIL FROM', 'RCPT TO') else ' '
+        return command + separator + argument
+
+    def client_writes(self):
+        """Return the data sent by a (non-pipelining) client, every item is
+        passed to process_new_data() separately."""
+        writes = [(line + '\r\n').encode('ascii') for line in self.lines]
+        data = self.message_data
+        message_writes = [data[i:i + RECV_SIZE] for i in range(0, len(data), RECV_SIZE)]
+        return writes[:-1] + message_writes + writes[-1:]
+
+
+SCENARIOS = OrderedDict([
+    ('small', Scenario(1024)),
+    ('large', Scenario(1024 * 1024)),
+    ('many_recipients', Scenario(1024, nr_recipients=100)),
+    ('auth', Scenario(1024, use_auth=True)),
+])
+
+
+def bench_parse(scenario):
+    allowed_commands = SMTPSession._get_state_machine_definition()[2]
+    parse = ParserImplementation(allowed_commands).parse
+    lines = scenario.lines
+
+    def run():
+        for line in lines:
+            parse(line)
+    return run
+
+
+def bench_statemachine(scenario):
+    definition = SMTPSession._get_state_machine_definition()[0]
+    actions = scenario.actions
+
+    def run():
+        execute = definition.copy().execute
+        for action in actions:
+            execute(action)
+    return run
+
+
+def bench_session(scenario):
+    deliverer = NullDeliverer()
+    authenticator = DummyAuthenticator()
+    commands = scenario.commands
+    message = scenario.message
+
+    def run():
+        session = SMTPSession(MockCommandParser(), deliverer, authenticator=authenticator)
+        session.new_connection('127.0.0.1', 4567)
+        handle_input = session.handle_input
+        for command, argument in commands:
+            handle_input(command, argument)
+        handle_input('MSGDATA', message)
+        handle_input('QUIT')
+    return run
+
+
+def bench_command_parser(scenario):
+    deliverer = NullDeliverer()
+    authenticator = DummyAuthenticator()
+    config = ServerConfig(hostname='localhost')
+    writes = scenario.client_writes()
+
+    def run():
+        parser = SMTPCommandParser(MockChannel(), '127.0.0.1', 4567, deliverer,
+                                   authenticator=authenticator, config=config)
+        for data in writes:
+            parser.process_new_data(data)
+        parser.connection_closed()
+    return run
+
+
+LAYERS = OrderedDict([
+    ('parse', bench_parse),
+    ('statemachine', bench_statemachine),
+    ('session', bench_session),
+    ('command_parser', bench_command_parser),
+])
+
+
+def _run_loops(function, loops):
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = timer()
+        for i in range(loops):
+            function()
+        return timer() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def measure(function, min_time, repeat):
+    """Return the best time per call (seconds)."""
+    loops = 1
+    while True:
+        duration = _run_loops(function, loops)
+        if duration >= min_time:
+            break
+        loops *= 2
+    durations = [duration] + [_run_loops(function, loops) for i in range(repeat - 1)]
+    return min(durations) / loops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--filter', default=None,
+                        help='only run benchmarks whose name contains this string')
+    parser.add_argument('--json', default=None, help='save the results to this file')
+    parser.add_argument('--compare', default=None,
+                        help='compare with results saved previously via --json')
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as fp:
+            previous = json.load(fp)['results']
+
+    results = OrderedDict()
+    print('%-32s %12s %12s %8s' % ('benchmark', 'us/op', 'previous', 'change'))
+    for layer_name, build_benchmark in LAYERS.items():
+        for scenario_name, scenario in SCENARIOS.items():
+            name = '%s.%s' % (layer_name, scenario_name)
+            if args.filter and (args.filter not in name):
+                continue
+            us_per_op = measure(build_benchmark(scenario), args.min_time, args.repeat) * 1e6
+            results[name] = round(us_per_op, 2)
+            old_value = previous.get(name)
+            if old_value:
+                change = '%+7.1f%%' % ((us_per_op - old_value) / old_value * 100)
+                print('%-32s %12.2f %12.2f %8s' % (name, us_per_op, old_value, change))
+            else:
+                print('%-32s %12.2f' % (name, us_per_op))
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'python': sys.version.split()[0], 'results': results}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
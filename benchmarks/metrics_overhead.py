@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Measure the overhead of collecting metrics and session traces: Complete
+SMTP sessions (HELO, MAIL FROM, RCPT TO, DATA, QUIT) are fed into a
+SMTPCommandParser (no network I/O) with and without a MetricsRegistry/
+SessionTracer. The best of --repeat runs is reported.
+
+Usage: python benchmarks/metrics_overhead.py [--sessions 5000] [--repeat 5]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymta.api import IMTAPolicy
+from pymta.command_parser import SMTPCommandParser
+from pymta.config import ServerConfig
+from pymta.test_util import MockChannel, NullDeliverer
+
+
+SESSION = (b'HELO client.example.com\r\n', b'MAIL FROM:<foo@example.com>\r\n',
+           b'RCPT TO:<bar@example.com>\r\n', b'DATA\r\n',
+           b'Subject: Test\r\n\r\n' + b'x' * 1000 + b'\r\n.\r\n', b'QUIT\r\n')
+
+
+def run_sessions(nr_sessions, config):
+    deliverer = NullDeliverer()
+    policy = IMTAPolicy()
+    start = time.time()
+    for i in range(nr_sessions):
+        parser = SMTPCommandParser(MockChannel(), '127.0.0.1', 4567, deliverer,
+                                   policy=policy, config=config)
+        for data in SESSION:
+            parser.process_new_data(data)
+        parser.connection_closed()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sessions', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    configs = [('disabled', ServerConfig(hostname='localhost'))]
+    try:
+        from pymta.metrics import MetricsRegistry
+    except ImportError:
+        # allows comparing with older versions of pymta
+        pass
+    else:
+        configs.append(('metrics', ServerConfig(hostname='localhost', metrics=MetricsRegistry())))
+    try:
+        from pymta.tracing import SessionTracer
+    except ImportError:
+        pass
+    else:
+        tracer = SessionTracer(lambda trace: None)
+        configs.append(('tracing', ServerConfig(hostname='localhost', tracer=tracer)))
+
+    print('%-10s %12s' % ('config', 'us/session'))
+    for name, config in configs:
+        run_sessions(100, config)
+        duration = min(run_sessions(args.sessions, config) for i in range(args.repeat))
+        print('%-10s %12.1f' % (name, duration / args.sessions * 1e6))
+
+
+if __name__ == '__main__':
+    main()
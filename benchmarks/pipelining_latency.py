@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Measure the time needed to send a message over a high-latency link with
+and without PIPELINING (RFC 2920).
+
+The client connects to the server via a local proxy which delays all data
+by half the round trip time (--rtt) in each direction. Every message has
+--recipients recipients. The script reports the average time per message
+(the connection setup is not included).
+
+Usage: python benchmarks/pipelining_latency.py [--rtt 100] [--recipients 3]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import functools
+import os
+import socket
+import sys
+import threading
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchutil import run_server
+from pymta import PythonMTA
+from pymta.compat import queue
+from pymta.test_util import NullDeliverer, SMTPClient, free_port
+
+
+class DelayProxy(object):
+    """Forwards all connections to the target port, data is delivered 'delay'
+    seconds after it was received."""
+
+    def __init__(self, target_port, delay):
+        self.target_port = target_port
+        self.delay = delay
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(5)
+        self.port = self._listener.getsockname()[1]
+        self._start_thread(self._accept_loop)
+
+    def _start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _accept_loop(self):
+        while True:
+            client, address = self._listener.accept()
+            server = socket.create_connection(('127.0.0.1', self.target_port))
+            for source, destination in ((client, server), (server, client)):
+                pending = queue.Queue()
+                self._start_thread(self._receive, source, pending)
+                self._start_thread(self._deliver, destination, pending)
+
+    def _receive(self, source, pending):
+        while True:
+            try:
+                data = source.recv(65536)
+            except socket.error:
+                data = b''
+            pending.put((time.time() + self.delay, data))
+            if not data:
+                return
+
+    def _deliver(self, destination, pending):
+        while True:
+            deliver_at, data = pending.get()
+            time.sleep(max(0, deliver_at - time.time()))
+            if not data:
+                destination.close()
+                return
+            destination.sendall(data)
+
+
+def measure_seconds_per_message(port, nr_messages, recipients, pipelining):
+    client = SMTPClient('127.0.0.1', port)
+    client.command('EHLO client.example.com')
+    body = b'Subject: test\r\n\r\n' + b'x' * 1000
+    start = time.time()
+    for i in range(nr_messages):
+        code = client.send_message('foo@example.com', recipients, body, pipelining=pipelining)
+        assert code == 250
+    duration = time.time() - start
+    client.quit()
+    return duration / nr_messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rtt', type=float, default=100, help='round trip time in ms')
+    parser.add_argument('--recipients', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=10)
+    args = parser.parse_args()
+
+    recipients = ['user%d@example.com' % i for i in range(args.recipients)]
+    port = free_port()
+    factory = functools.partial(PythonMTA, '127.0.0.1', port, NullDeliverer)
+    with run_server(factory, port):
+        proxy = DelayProxy(port, delay=args.rtt / 2000.0)
+        print('%-12s %16s' % ('mode', 'ms per message'))
+        for mode_name, pipelining in (('sequential', False), ('pipelining', True)):
+            seconds = measure_seconds_per_message(proxy.port, args.messages, recipients, pipelining)
+            print('%-12s %16.1f' % (mode_name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Count the socket system calls (send/sendall and recv/recv_into) a
+WorkerProcess needs per message. The worker serves one end of a socketpair
+in a thread, the other end is used by a simple client which sends EHLO
+followed by --messages messages (each to --recipients recipients) and QUIT.
+
+The client either waits for every reply ('sequential') or uses PIPELINING.
+
+Usage: python benchmarks/reply_syscalls.py [--messages 100] [--recipients 3]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import socket
+import sys
+import threading
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymta.command_parser import WorkerProcess
+from pymta.config import ServerConfig
+from pymta.test_util import NullDeliverer, SMTPClient
+
+
+class CountingSocket(object):
+    """Wraps a socket and counts the calls of send/recv methods."""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.sends = 0
+        self.receives = 0
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def send(self, data):
+        self.sends += 1
+        return self._sock.send(data)
+
+    def sendall(self, data):
+        self.sends += 1
+        return self._sock.sendall(data)
+
+    def recv(self, *args):
+        self.receives += 1
+        return self._sock.recv(*args)
+
+    def recv_into(self, *args):
+        self.receives += 1
+        return self._sock.recv_into(*args)
+
+
+class SocketPairClient(SMTPClient):
+    def __init__(self, sock):
+        self._sock = sock
+        self._buffer = b''
+        self.greeting = self.read_reply()
+
+
+def count_syscalls(nr_messages, recipients, pipelining):
+    server_sock, client_sock = socket.socketpair()
+    counting_sock = CountingSocket(server_sock)
+    worker = WorkerProcess(None, None, NullDeliverer,
+                           config=ServerConfig(hostname='localhost'))
+    thread = threading.Thread(target=worker.handle_connection,
+                              args=((counting_sock, ('127.0.0.1', 4567)),))
+    thread.start()
+
+    client = SocketPairClient(client_sock)
+    client.command('EHLO client.example.com')
+    body = b'Subject: test\r\n\r\n' + b'x' * 1000
+    for i in range(nr_messages):
+        client.send_message('foo@example.com', recipients, body, pipelining=pipelining)
+    client.quit()
+    thread.join()
+    return counting_sock.sends, counting_sock.receives
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--recipients', type=int, default=3)
+    args = parser.parse_args()
+
+    recipients = ['user%d@example.com' % i for i in range(args.recipients)]
+    print('%-12s %16s %16s' % ('mode', 'sends/message', 'recvs/message'))
+    for mode_name, pipelining in (('sequential', False), ('pipelining', True)):
+        sends, receives = count_syscalls(args.messages, recipients, pipelining)
+        print('%-12s %16.2f %16.2f' % (mode_name, float(sends) / args.messages,
+                                       float(receives) / args.messages))
+
+
+if __name__ == '__main__':
+    main()
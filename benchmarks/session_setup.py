@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Measure the cost of setting up a new SMTP connection without any network
+I/O: create a SMTPCommandParser (which creates the SMTPSession and sends the
+greeting) and report connections/second plus the memory allocated per
+connection (via tracemalloc).
+
+Usage: python benchmarks/session_setup.py [--connections 20000]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymta.command_parser import SMTPCommandParser
+from pymta.config import ServerConfig
+from pymta.test_util import MockChannel, NullDeliverer
+
+
+def setup_connection(deliverer, config):
+    return SMTPCommandParser(MockChannel(), '127.0.0.1', 4567, deliverer, config=config)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--connections', type=int, default=20000)
+    args = parser.parse_args()
+
+    deliverer = NullDeliverer()
+    config = ServerConfig(hostname='localhost')
+    # warm up (builds the shared state machine/regex)
+    setup_connection(deliverer, config)
+
+    start = time.time()
+    for i in range(args.connections):
+        setup_connection(deliverer, config)
+    duration = time.time() - start
+
+    tracemalloc.start()
+    parsers = [setup_connection(deliverer, config) for i in range(1000)]
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del parsers
+
+    print('connections/s:       %10.0f' % (args.connections / duration))
+    print('bytes per connection: %9.0f' % (allocated / 1000.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Measure the latency of the final '250 OK' reply (after the client sent the
+message data) with a slow deliverer (--delay ms per message).
+
+Columns:
+ - direct: the deliverer is called before the server replies
+ - spool: the message is written to a MessageSpool (fsync'd) and delivered
+   by background delivery workers
+
+Usage: python benchmarks/spool_latency.py [--delay 50] [--messages 100]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchutil import run_server
+from pymta import IMessageDeliverer, PythonMTA
+from pymta.spool import MessageSpool
+from pymta.test_util import SMTPClient, free_port
+
+
+class SlowDeliverer(IMessageDeliverer):
+    delay = 0.05
+
+    def new_message_accepted(self, msg):
+        time.sleep(self.delay)
+
+
+def measure_reply_latencies(port, nr_messages):
+    client = SMTPClient('127.0.0.1', port)
+    client.command('EHLO client.example.com')
+    body = b'Subject: test\r\n\r\n' + b'x' * 1000
+    latencies = []
+    for i in range(nr_messages):
+        for command in ('MAIL FROM:<foo@example.com>', 'RCPT TO:<bar@example.com>', 'DATA'):
+            client.command(command)
+        start = time.time()
+        client._sock.sendall(body + b'\r\n.\r\n')
+        assert client.read_reply() == 250
+        latencies.append(time.time() - start)
+    client.quit()
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--delay', type=float, default=50, help='deliverer delay in ms')
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--delivery-workers', type=int, default=2)
+    args = parser.parse_args()
+    SlowDeliverer.delay = args.delay / 1000.0
+
+    spool_dir = tempfile.mkdtemp()
+    try:
+        print('%-8s %10s %10s' % ('mode', 'p50 ms', 'p99 ms'))
+        for mode_name, spool in (('direct', None), ('spool', MessageSpool(spool_dir))):
+            port = free_port()
+            factory = functools.partial(PythonMTA, '127.0.0.1', port, SlowDeliverer,
+                                        initial_workers=1, spool=spool,
+                                        delivery_workers=args.delivery_workers)
+            with run_server(factory, port):
+                latencies = measure_reply_latencies(port, args.messages)
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+            print('%-8s %10.2f %10.2f' % (mode_name, p50 * 1000, p99 * 1000))
+    finally:
+        shutil.rmtree(spool_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Measure how many StateMachine transitions per second can be executed
+using the SMTP session state machine (without any handlers so only the
+state machine itself is measured).
+
+After EHLO every round executes a typical ESMTP transaction:
+AUTH PLAIN, MAIL FROM, RCPT TO, DATA, MSGDATA, RSET.
+
+Usage: python benchmarks/statemachine_transitions.py [--rounds 100000]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import time
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymta.session import SMTPSession
+
+
+COMMANDS = ('AUTH PLAIN', 'MAIL FROM', 'RCPT TO', 'DATA', 'MSGDATA', 'RSET')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rounds', type=int, default=100000)
+    args = parser.parse_args()
+
+    state = SMTPSession._build_state_machine()
+    state.execute('GREET')
+    # sets the 'esmtp' flag so AUTH PLAIN is allowed
+    state.execute('EHLO')
+    execute = state.execute
+    is_impossible_state = state.is_impossible_state
+    start = time.time()
+    for i in range(args.rounds):
+        for command in COMMANDS:
+            execute(command)
+            is_impossible_state()
+    duration = time.time() - start
+
+    nr_transitions = args.rounds * len(COMMANDS)
+    print('transitions/s: %12.0f' % (nr_transitions / duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Measure the peak memory (Python allocations, via tracemalloc) needed to
+receive a message of a given size. The message is fed into the
+SMTPCommandParser in 64 KiB packets (no sockets involved).
+
+Columns:
+ - streaming: IStreamingMessageDeliverer which just counts the bytes
+ - legacy: plain IMessageDeliverer, the message is spooled to disk while
+   receiving (above 1 MiB) but 'msg.msg_data' is loaded into memory before
+   new_message_accepted() is called
+
+Usage: python benchmarks/streaming_memory.py [--sizes 1,10,50]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymta.api import IMessageDeliverer, IStreamingMessageDeliverer
+from pymta.command_parser import SMTPCommandParser
+from pymta.test_util import MockChannel
+
+
+PACKET_SIZE = 64 * 1024
+LINE = b'x' * 76 + b'\r\n'
+
+
+class CountingDeliverer(IStreamingMessageDeliverer):
+    def begin_message(self, msg):
+        self.size = 0
+
+    def write_chunk(self, msg, chunk):
+        self.size += len(chunk)
+
+    def commit_message(self, msg):
+        pass
+
+    def abort_message(self, msg):
+        pass
+
+
+class IgnoringDeliverer(IMessageDeliverer):
+    def new_message_accepted(self, msg):
+        pass
+
+
+def iter_packets(size_mb):
+    packet = LINE * (PACKET_SIZE // len(LINE))
+    nr_packets = (size_mb * 1024 * 1024) // len(packet)
+    for i in range(nr_packets):
+        yield packet
+    yield b'.\r\n'
+
+
+def peak_memory(deliverer, size_mb):
+    parser = SMTPCommandParser(MockChannel(), '127.0.0.1', 4567, deliverer)
+    for command in (b'HELO foo\r\n', b'MAIL FROM:<foo@example.com>\r\n',
+                    b'RCPT TO:<bar@example.com>\r\n', b'DATA\r\n'):
+        parser.process_new_data(command)
+    tracemalloc.start()
+    for packet in iter_packets(size_mb):
+        parser.process_new_data(packet)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert parser.is_in_command_mode()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1,10,50',
+                        help='message sizes in MB (comma-separated)')
+    args = parser.parse_args()
+
+    print('%8s %16s %16s' % ('size MB', 'streaming MB', 'legacy MB'))
+    for size_mb in [int(size) for size in args.sizes.split(',')]:
+        streaming = peak_memory(CountingDeliverer(), size_mb)
+        legacy = peak_memory(IgnoringDeliverer(), size_mb)
+        mb = float(1024 * 1024)
+        print('%8d %16.2f %16.2f' % (size_mb, streaming / mb, legacy / mb))
+
+
+if __name__ == '__main__':
+    main()
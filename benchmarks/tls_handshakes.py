@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Measure the number of STARTTLS handshakes per second with and without TLS
+session resumption. The server uses a self-signed certificate (the one from
+the test suite), every connection sends EHLO, STARTTLS, EHLO and QUIT.
+
+Columns:
+ - full: every connection performs a full handshake
+ - resumed: the client offers the TLS session (ticket) of the previous
+   connection so the server can skip the certificate exchange/key agreement
+
+Usage: python benchmarks/tls_handshakes.py [--connections 200] [--workers 2]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import functools
+import os
+import ssl
+import sys
+import time
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchutil import run_server  # noqa: E402
+from pymta import PythonMTA  # noqa: E402
+from pymta.config import ServerConfig, build_tls_context  # noqa: E402
+from pymta.test_util import NullDeliverer, SMTPClient, free_port  # noqa: E402
+
+
+CERTFILE = os.path.join(ROOT_DIR, 'tests', 'tls_cert.pem')
+
+
+def build_mta(port, workers):
+    # The context is created once and shared by all (forked) workers.
+    config = ServerConfig(hostname='localhost', tls_context=build_tls_context(CERTFILE))
+    return PythonMTA('127.0.0.1', port, NullDeliverer, initial_workers=workers,
+                     config=config)
+
+
+def run_connections(port, nr_connections, resume):
+    client_context = ssl.create_default_context(cafile=CERTFILE)
+    session = None
+    nr_resumed = 0
+    start = time.time()
+    for i in range(nr_connections):
+        client = SMTPClient('127.0.0.1', port)
+        client.command('EHLO client.example.com')
+        tls_socket = client.starttls(client_context, session=session if resume else None)
+        # TLS 1.3 session tickets are sent after the handshake so we need to
+        # receive some data before the session can be reused.
+        client.command('EHLO client.example.com')
+        if tls_socket.session_reused:
+            nr_resumed += 1
+        session = tls_socket.session
+        client.quit()
+    duration = time.time() - start
+    return nr_connections / duration, nr_resumed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    port = free_port()
+    with run_server(functools.partial(build_mta, port, args.workers), port):
+        print('%-8s %16s %10s' % ('mode', 'handshakes/s', 'resumed'))
+        for mode_name, resume in (('full', False), ('resumed', True)):
+            rate, nr_resumed = run_connections(port, args.connections, resume)
+            print('%-8s %16.1f %10d' % (mode_name, rate, nr_resumed))
+
+
+if __name__ == '__main__':
+    main()
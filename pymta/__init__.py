@@ -2,6 +2,7 @@
 
 from pymta.api import *
 from pymta.command_parser import *
+from pymta.config import *
 from pymta.model import *
 from pymta.mta import *
 from pymta.session import *
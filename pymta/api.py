@@ -7,7 +7,8 @@ considered part of the public API which should be as stable as possible."""
 from __future__ import print_function, unicode_literals
 
 
-__all__ = ['IAuthenticator', 'IMessageDeliverer', 'IMTAPolicy', 'PolicyDecision',
+__all__ = ['IAuthenticator', 'IBatchMessageDeliverer', 'IMessageDeliverer',
+           'IMTAPolicy', 'IStreamingMessageDeliverer', 'PolicyDecision',
            'PyMTAException']
 
 
@@ -18,7 +19,10 @@ class IAuthenticator(object):
 
     def authenticate(self, username, password, peer):
         """This method is called after the client issued an AUTH PLAIN command
-        and must return a boolean value (True/False)."""
+        and must return a boolean value (True/False).
+
+        The method may also be a coroutine (async def) so the AsyncPythonMTA
+        can serve other connections while waiting for the result."""
         raise NotImplementedError
 
 
@@ -38,9 +42,96 @@ class IMessageDeliverer(object):
         There will be one deliverer instance per client connection so
         this method may does not have to be thread-safe. However this method
         may get called multiple times when the client transmits more than one
-        message for the same connection."""
+        message for the same connection.
+
+        The method may also be a coroutine (async def), the client gets the
+        '250 OK' after it finished."""
+        raise NotImplementedError
+
+
+class IBatchMessageDeliverer(IMessageDeliverer):
+    """Batch deliverers get several accepted messages at once so they can
+    store them with a single transaction/fsync (group commit).
+
+    Messages of concurrent sessions (e.g. PythonMTA(threads_per_worker=N))
+    are collected for up to ServerConfig.max_batch_size messages/
+    ServerConfig.max_batch_delay seconds. A message is only acknowledged
+    ('250 OK') after its batch was delivered. If no batch is being delivered
+    right now, a new batch is delivered immediately (max_batch_delay=0) so
+    there is no additional latency if the server is not busy.
+
+    Batches only contain messages of the same worker process: With
+    threads_per_worker=1 (and with the AsyncPythonMTA which does not wait
+    for more messages) every batch contains a single message and
+    max_batch_delay only adds latency."""
+
+    def new_messages_accepted(self, batch):
+        """Called with a list of accepted messages. Return None if all
+        messages were delivered. Otherwise return a list with one item per
+        message (in the same order): None if the message was delivered, any
+        other value (e.g. an exception) if delivery failed. The client gets a
+        '451' reply for every failed message.
+
+        If this method raises an exception, delivery failed for all messages
+        of the batch.
+
+        This method may be a coroutine when used with the PythonMTA or
+        delivery workers (but not with the AsyncPythonMTA)."""
+        raise NotImplementedError
+
+    def new_message_accepted(self, msg):
+        # pymta.exceptions imports this module
+        from pymta.exceptions import DeliveryError
+        results = self.new_messages_accepted([msg])
+        if (results is not None) and (results[0] is not None):
+            raise DeliveryError('delivery failed: %r' % (results[0],))
+
+
+class IStreamingMessageDeliverer(IMessageDeliverer):
+    """Streaming deliverers receive the message contents piece by piece while
+    the client is still sending so the server does not have to keep the
+    complete message in memory.
+
+    For every message begin_message() is called first (directly after the
+    DATA command was accepted), followed by any number of write_chunk() calls.
+    Afterwards either commit_message() (the message was accepted, the server
+    will respond with '250 OK' afterwards) or abort_message() (e.g. the message
+    was rejected by the policy or the client disconnected) is called.
+
+    new_message_accepted() is not used for streaming deliverers.
+
+    Please note that your policy's accept_msgdata() method won't get the
+    message contents (msgdata and message.msg_data are None) when using a
+    streaming deliverer directly. If your policy overrides accept_msgdata(),
+    pymta will spool the message (see pymta.delivery.SpoolingDeliverer)
+    before passing it to your deliverer."""
+
+    def begin_message(self, msg):
+        """A new message transfer was started. 'msg' contains the envelope
+        data (sender, recipients, ...) but not the message contents."""
+        raise NotImplementedError
+
+    def write_chunk(self, msg, chunk):
+        """Called with the next part of the message contents. 'chunk' is a byte
+        string which already had the SMTP transparency dots removed. Lines are
+        separated by '\\n'. Chunks always end at a line boundary (but a chunk
+        may contain multiple lines, BDAT chunks may end anywhere)."""
         raise NotImplementedError
 
+    def commit_message(self, msg):
+        """The message was accepted, the deliverer is now responsible for
+        delivering it. Please note that you can not reject the message anymore
+        at this stage (see IMessageDeliverer.new_message_accepted())."""
+        raise NotImplementedError
+
+    def abort_message(self, msg):
+        """The message transfer failed or the message was rejected. The
+        deliverer should discard all data written for this message."""
+        raise NotImplementedError
+
+    def new_message_accepted(self, msg):
+        raise NotImplementedError('streaming deliverers use commit_message()')
+
 
 class PolicyDecision(object):
     def __init__(self, decision=True, reply=None):
@@ -108,6 +199,12 @@ class IMTAPolicy(object):
     format as described in the paragraph before. The PolicyDecision can ask the
     server to close the connection unconditionally after or even before sending
     the response to the client (in the latter case no response will be sent).
+
+    The 'accept_*' methods may also be coroutines (async def, Python 3.5+),
+    e.g. for DNS or LDAP lookups. The AsyncPythonMTA serves other connections
+    while a session waits for the decision, the PythonMTA runs the coroutine
+    in a private event loop. max_message_size(), auth_methods() and
+    ehlo_lines() must always be plain methods.
     """
 
     def accept_new_connection(self, peer):
@@ -133,8 +230,9 @@ class IMTAPolicy(object):
     def ehlo_lines(self, peer):
         """Return an iterable for SMTP extensions to advertise after EHLO.
         By default support for SMTP SIZE extension will be announced if you set
-        a max message size."""
-        lines = []
+        a max message size. PIPELINING (RFC 2920), CHUNKING (RFC 3030),
+        8BITMIME (RFC 6152) and SMTPUTF8 (RFC 6531) are always supported."""
+        lines = ['PIPELINING', 'CHUNKING', '8BITMIME', 'SMTPUTF8']
         max_size = self.max_message_size(peer)
         if max_size is not None:
             lines.append('SIZE %d' % max_size)
@@ -0,0 +1,206 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""This module provides an alternative connection engine based on asyncio. A
+single process can serve thousands of (mostly idle or slow) connections at the
+same time because no connection occupies a whole WorkerProcess.
+
+The engine requires Python 3 (asyncio is not available for Python 2)."""
+
+from __future__ import print_function, unicode_literals
+
+import asyncio
+from threading import Event
+
+from pymta.api import IBatchMessageDeliverer
+from pymta.command_parser import SMTPCommandParser, WorkerProcess
+from pymta.delivery import BatchingDeliverer, GroupCommit
+from pymta.mta import PythonMTA
+
+
+__all__ = ['AsyncPythonMTA']
+
+
+class SMTPProtocol(asyncio.Protocol):
+    """The SMTPProtocol connects an asyncio transport with a SMTPCommandParser.
+    It provides the same 'channel' interface as the WorkerProcess (write/close)
+    so the parser does not need to know which engine is used."""
+
+    def __init__(self, deliverer, policy=None, authenticator=None, connections=None,
+                 config=None):
+        self._deliverer = deliverer
+        self._policy = policy
+        self._authenticator = authenticator
+        self._config = config
+        self._connections = connections if (connections is not None) else set()
+
+        self._transport = None
+        self._chatter = None
+        self._is_starting_tls = False
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._connections.add(self)
+        peername = transport.get_extra_info('peername')
+        remote_ip_string, remote_port = peername[:2]
+        self._chatter = SMTPCommandParser(self, remote_ip_string, remote_port,
+                            self._deliverer, self._policy, self._authenticator,
+                            config=self._config)
+
+    def data_received(self, data):
+        if (not self.is_connected()) or self._is_starting_tls:
+            # Data sent before the TLS handshake must be discarded (RFC 3207).
+            return
+        self._chatter.process_new_data(data)
+
+    def connection_lost(self, exc):
+        self._connections.discard(self)
+        self._transport = None
+        if self._chatter is not None:
+            self._chatter.connection_closed()
+        self._chatter = None
+
+    def is_connected(self):
+        return (self._transport is not None) and (not self._transport.is_closing())
+
+    def close(self):
+        """Closes the connection to the client."""
+        if self.is_connected():
+            self._transport.close()
+
+    def start_tls(self, tls_context):
+        """Upgrades the connection to TLS. The handshake is done
+        asynchronously, no data is processed in the meantime."""
+        self._is_starting_tls = True
+        self._transport.pause_reading()
+        asyncio.ensure_future(self._start_tls(tls_context))
+
+    async def _start_tls(self, tls_context):
+        loop = asyncio.get_event_loop()
+        transport = self._transport
+        try:
+            self._transport = await loop.start_tls(transport, self, tls_context,
+                                                   server_side=True)
+        except Exception:
+            transport.close()
+            # the transport might not notify us anymore
+            self.connection_lost(None)
+        finally:
+            self._is_starting_tls = False
+
+    def wait_for(self, awaitable, callback):
+        """Runs the awaitable (e.g. a coroutine returned by the policy) and
+        calls callback(result, error) once it is done. No data is read from
+        the client in the meantime."""
+        self._transport.pause_reading()
+        future = asyncio.ensure_future(awaitable)
+
+        def done(future):
+            if (not self.is_connected()) or future.cancelled():
+                return
+            self._transport.resume_reading()
+            error = future.exception()
+            result = future.result() if (error is None) else None
+            try:
+                callback(result, error)
+            except Exception:
+                self.close()
+                raise
+        future.add_done_callback(done)
+
+    def write(self, data):
+        """Sends some data to the client."""
+        # Just like the WorkerProcess we silently ignore writes after the
+        # connection was closed.
+        if not self.is_connected():
+            return
+        self._transport.write(data)
+
+
+class AsyncPythonMTA(PythonMTA):
+    """AsyncPythonMTA is a drop-in replacement for the PythonMTA which serves
+    all connections from a single asyncio event loop instead of a fixed number
+    of worker processes.
+
+    deliverer_class, policy_class and authenticator_class are instantiated
+    only once per server (just like they are instantiated once per
+    WorkerProcess in the PythonMTA). All sessions run in the same thread so
+    these instances do not have to be thread-safe but they are shared between
+    all concurrent connections.
+
+    The options of the PythonMTA which configure its worker processes
+    (reuse_port, initial_workers, threads_per_worker, ...) are not supported
+    and raise a ValueError."""
+
+    def __init__(self, local_address, bind_port, deliverer_class,
+                 policy_class=None, authenticator_class=None, config=None,
+                 spool=None, delivery_workers=2, **kwargs):
+        if kwargs:
+            raise ValueError('AsyncPythonMTA does not support: %s' % ', '.join(sorted(kwargs)))
+        super(AsyncPythonMTA, self).__init__(local_address, bind_port, deliverer_class,
+            policy_class=policy_class, authenticator_class=authenticator_class,
+            config=config, spool=spool, delivery_workers=delivery_workers)
+        self._loop = None
+        self._is_running = Event()
+        self._connections = set()
+
+    def _build_protocol_factory(self):
+        get_instance = WorkerProcess._get_instance_from_class
+        deliverer = get_instance(self._get_session_deliverer_class())
+        if isinstance(deliverer, IBatchMessageDeliverer):
+            # All sessions run in the event loop thread so waiting for more
+            # messages would only block the loop: every batch contains a
+            # single message.
+            deliverer = BatchingDeliverer(deliverer, GroupCommit(max_batch_size=1))
+        policy = get_instance(self._policy_class)
+        authenticator = get_instance(self._authenticator_class)
+        connections = self._connections
+        config = self._config
+        return lambda: SMTPProtocol(deliverer, policy, authenticator, connections, config)
+
+    def serve_forever(self):
+        self._shutdown_server.clear()
+        self._is_stopped.clear()
+        loop = asyncio.new_event_loop()
+        server_socket = self._build_server_socket()
+        # Delivery workers run in separate processes so slow deliverers do
+        # not block the event loop.
+        self._start_delivery_workers(use_multiprocessing=True)
+        try:
+            server = loop.run_until_complete(
+                loop.create_server(self._build_protocol_factory(), sock=server_socket)
+            )
+            self._loop = loop
+            self._is_running.set()
+            # shutdown_server() might have been called before the loop was
+            # ready (e.g. by a very fast unit test).
+            if not self._shutdown_server.is_set():
+                loop.run_forever()
+            server.close()
+            self._close_all_connections(loop)
+            loop.run_until_complete(server.wait_closed())
+        finally:
+            self._stop_delivery_workers()
+            self._loop = None
+            self._is_running.clear()
+            server_socket.close()
+            loop.close()
+            self._is_stopped.set()
+
+    def _close_all_connections(self, loop):
+        for protocol in tuple(self._connections):
+            protocol.close()
+        # give the transports a chance to call 'connection_lost()'
+        loop.run_until_complete(asyncio.sleep(0))
+
+    def shutdown_server(self, timeout_seconds=None):
+        """This method notifies the server that it should stop listening for
+        new messages and shut down itself. Pending connections will be closed
+        as the event loop stops. If timeout_seconds was given, the method
+        blocks until the server was stopped but for this many seconds at
+        most."""
+        self._shutdown_server.set()
+        loop = self._loop
+        if (loop is not None) and self._is_running.is_set():
+            loop.call_soon_threadsafe(loop.stop)
+        if timeout_seconds is not None:
+            self._is_stopped.wait(timeout_seconds)
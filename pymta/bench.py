@@ -0,0 +1,193 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""A simple load generator to measure the throughput and latency of the
+PythonMTA on a single machine (no external tools required): A PythonMTA
+with a deliverer which discards all messages is started in a separate
+process, then several client threads send messages concurrently. The
+results (messages per second, latency percentiles) are printed as JSON.
+
+Usage: python -m pymta.bench [--concurrency 4] [--connections 200]
+           [--messages 1] [--size 1024] [--recipients 1] [--pipelining]
+
+Every run sends the same (deterministic) messages so results of different
+runs (e.g. before/after a change) can be compared. Only messages after the
+--warmup connections are measured."""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import functools
+import json
+import math
+import multiprocessing
+import platform
+import socket
+import sys
+import threading
+
+from pymta.config import ServerConfig
+from pymta.metrics import timer
+from pymta.mta import PythonMTA
+from pymta.test_util import MTAProcess, NullDeliverer, SMTPClient, free_port
+
+
+__all__ = ['percentile', 'run_benchmark']
+
+
+def percentile(sorted_values, percent):
+    """Return the percentile (nearest rank) of the sorted values or None if
+    there are no values."""
+    if not sorted_values:
+        return None
+    index = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(index, 0)]
+
+
+def _build_mta(port, workers):
+    return PythonMTA('127.0.0.1', port, NullDeliverer, initial_workers=workers,
+                     config=ServerConfig(hostname='localhost'))
+
+
+def _build_message(size):
+    line = b'x' * 76
+    header = b'Subject: pymta benchmark\r\n\r\n'
+    nr_lines = max(size - len(header), 0) // (len(line) + 2) + 1
+    return header + b'\r\n'.join([line] * nr_lines)
+
+
+class _LoadGenerator(object):
+    def __init__(self, port, connections, messages_per_connection, message_size,
+                 recipients, pipelining):
+        self.port = port
+        self.messages_per_connection = messages_per_connection
+        self.pipelining = pipelining
+        self.recipients = ['rcpt%d@example.com' % i for i in range(recipients)]
+        self.message = _build_message(message_size)
+
+        self._remaining_connections = connections
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    def _next_connection(self):
+        with self._lock:
+            if self._remaining_connections <= 0:
+                return False
+            self._remaining_connections -= 1
+            return True
+
+    def _run_connection(self):
+        latencies = []
+        errors = 0
+        try:
+            client = SMTPClient('127.0.0.1', self.port)
+            client.command('EHLO bench.example.com')
+            for i in range(self.messages_per_connection):
+                start = timer()
+                code = client.send_message('sender@example.com', self.recipients,
+                                           self.message, pipelining=self.pipelining)
+                if code == 250:
+                    latencies.append(timer() - start)
+                else:
+                    errors += 1
+            client.quit()
+        except socket.error:
+            errors += self.messages_per_connection - len(latencies)
+        with self._lock:
+            self.latencies.extend(latencies)
+            self.errors += errors
+
+    def client_loop(self):
+        while self._next_connection():
+            self._run_connection()
+
+    def run(self, concurrency):
+        """Run all connections using 'concurrency' client threads and return
+        the duration in seconds."""
+        threads = [threading.Thread(target=self.client_loop) for i in range(concurrency)]
+        start = timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return timer() - start
+
+
+def run_benchmark(concurrency=4, connections=200, messages_per_connection=1,
+                  message_size=1024, recipients=1, pipelining=False, workers=None,
+                  warmup=20):
+    """Start a PythonMTA with 'workers' worker processes (default: one per
+    client thread) and send connections * messages_per_connection messages
+    from 'concurrency' client threads. Return the results as a dict
+    (latencies in milliseconds)."""
+    if workers is None:
+        workers = concurrency
+    settings = dict(concurrency=concurrency, connections=connections,
+                    messages_per_connection=messages_per_connection,
+                    message_size=message_size, recipients=recipients,
+                    pipelining=pipelining, workers=workers, warmup=warmup)
+    load_args = (messages_per_connection, message_size, recipients, pipelining)
+
+    port = free_port()
+    with MTAProcess(functools.partial(_build_mta, port, workers), port):
+        if warmup:
+            _LoadGenerator(port, warmup, *load_args).run(concurrency)
+        load = _LoadGenerator(port, connections, *load_args)
+        duration = load.run(concurrency)
+
+    latencies = sorted(load.latencies)
+    to_ms = lambda seconds: None if (seconds is None) else round(seconds * 1000, 3)
+    return {
+        'settings': settings,
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cpus': multiprocessing.cpu_count(),
+        },
+        'messages': len(latencies),
+        'errors': load.errors,
+        'duration_seconds': round(duration, 3),
+        'messages_per_second': round(len(latencies) / duration, 1) if duration else None,
+        'latency_ms': {
+            'min': to_ms(latencies[0] if latencies else None),
+            'mean': to_ms(sum(latencies) / len(latencies) if latencies else None),
+            'p50': to_ms(percentile(latencies, 50)),
+            'p95': to_ms(percentile(latencies, 95)),
+            'p99': to_ms(percentile(latencies, 99)),
+            'max': to_ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pymta.bench',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='number of concurrent client connections (default: 4)')
+    parser.add_argument('--connections', type=int, default=200,
+                        help='total number of connections (default: 200)')
+    parser.add_argument('--messages', type=int, default=1,
+                        help='messages per connection (default: 1)')
+    parser.add_argument('--size', type=int, default=1024,
+                        help='approximate message size in bytes (default: 1024)')
+    parser.add_argument('--recipients', type=int, default=1,
+                        help='recipients per message (default: 1)')
+    parser.add_argument('--pipelining', action='store_true',
+                        help='send MAIL FROM, RCPT TO and DATA at once (RFC 2920)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='server worker processes (default: same as --concurrency)')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='connections before the measurement starts (default: 20)')
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(concurrency=args.concurrency, connections=args.connections,
+                           messages_per_connection=args.messages, message_size=args.size,
+                           recipients=args.recipients, pipelining=args.pipelining,
+                           workers=args.workers, warmup=args.warmup)
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
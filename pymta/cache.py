@@ -0,0 +1,216 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Caches for expensive policy checks (e.g. DNS blocklists, database lookups)
+and authentication backends which would otherwise be repeated for every
+connection/recipient."""
+
+from __future__ import print_function, unicode_literals
+
+import hashlib
+import hmac
+import os
+import threading
+from collections import Counter, OrderedDict
+
+from pymta.api import IAuthenticator, PolicyDecision
+from pymta.compat import isawaitable, monotonic
+
+
+__all__ = ['CachingAuthenticator', 'CachingPolicy', 'LRUCache']
+
+
+class LRUCache(object):
+    """A mapping with at most max_size items where every item expires after
+    its own time-to-live (seconds). If the cache is full, the least recently
+    used item is removed. All methods are thread-safe."""
+
+    def __init__(self, max_size=10000, clock=monotonic):
+        self.max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expiry time, value), oldest item first
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= self._clock():
+                return default
+            # re-insert to mark the item as most recently used
+            self._items[key] = item
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items.pop(key, None)
+            if ttl <= 0:
+                return
+            self._items[key] = (self._clock() + ttl, value)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_missing = object()
+
+# Random key for the HMAC of cached credentials. It is created once per
+# process (worker processes inherit it) so all CachingAuthenticators can
+# share their cache.
+_credentials_salt = os.urandom(16)
+
+
+class CachingPolicy(object):
+    """CachingPolicy wraps an IMTAPolicy and caches the decisions of the
+    configured policy methods. 'rules' maps a method name to a tuple
+    (key function, ttl): The key function gets the same arguments as the
+    policy method and returns a hashable cache key. Only use arguments which
+    actually determine the policy's decision, e.g.
+
+        CachingPolicy(MyPolicy(), {
+            'accept_new_connection': (lambda peer: peer.remote_ip, 300),
+            'accept_rcpt_to': (lambda recipient, message: recipient.lower(), 60),
+        })
+
+    If ttl is None, default_ttl is used. Only plain boolean results and
+    PolicyDecisions are cached (coroutine methods: the result of the
+    coroutine): Custom replies (tuples) are passed through unchanged (the
+    same as all methods without a rule).
+
+    The cache contains at most max_size decisions (least recently used ones
+    are evicted first). Pass an LRUCache instance as 'cache' to share the
+    cached decisions between policy instances (e.g. all threads of a worker
+    process). 'hits' and 'misses' count cache lookups per method name."""
+
+    def __init__(self, policy, rules, default_ttl=60, max_size=10000, cache=None):
+        self.policy = policy
+        self.cache = cache if (cache is not None) else LRUCache(max_size)
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        for method_name, (key_function, ttl) in rules.items():
+            if ttl is None:
+                ttl = default_ttl
+            method = self._build_caching_method(method_name, key_function, ttl)
+            setattr(self, method_name, method)
+
+    def __getattr__(self, name):
+        # only called for methods without caching rule
+        if name == 'policy':
+            raise AttributeError(name)
+        return getattr(self.policy, name)
+
+    def _build_caching_method(self, method_name, key_function, ttl):
+        policy_method = getattr(self.policy, method_name)
+
+        def caching_method(*args):
+            key = (method_name, key_function(*args))
+            result = self.cache.get(key, _missing)
+            is_hit = (result is not _missing)
+            with self._lock:
+                counter = self.hits if is_hit else self.misses
+                counter[method_name] += 1
+            if is_hit:
+                return result
+
+            def store_result(result):
+                if isinstance(result, (bool, PolicyDecision)):
+                    self.cache.set(key, result, ttl)
+            result = policy_method(*args)
+            if isawaitable(result):
+                return _ResultObserver(result, store_result)
+            store_result(result)
+            return result
+        caching_method.__name__ = str(method_name)
+        return caching_method
+
+
+class _ResultObserver(object):
+    """Awaitable which passes the result of another awaitable to a callback
+    (without 'yield from' so this module can be imported in Python 2)."""
+
+    def __init__(self, awaitable, callback):
+        self._iterator = awaitable.__await__()
+        self._callback = callback
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        try:
+            return self._iterator.send(value)
+        except StopIteration as e:
+            self._callback(e.value)
+            raise
+
+    def throw(self, *args):
+        try:
+            return self._iterator.throw(*args)
+        except StopIteration as e:
+            self._callback(e.value)
+            raise
+
+
+class CachingAuthenticator(IAuthenticator):
+    """CachingAuthenticator wraps an IAuthenticator so clients which log in
+    with the same credentials again (e.g. submission clients which connect
+    for every message) do not hit the (slow) authentication backend every
+    time.
+
+    Successful logins are cached for 'ttl' seconds, failed ones for
+    'negative_ttl' seconds (so a changed password is accepted soon). The
+    cache key is a HMAC of username and password using a random salt which
+    is created once per process, passwords are never stored. The peer is
+    not part of the key.
+
+    The cache contains at most max_size results (see LRUCache), pass an
+    LRUCache instance as 'cache' to share it between several instances.
+    'hits' and 'misses' count the cache lookups."""
+
+    def __init__(self, authenticator, ttl=300, negative_ttl=5, max_size=10000, cache=None):
+        self.authenticator = authenticator
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = cache if (cache is not None) else LRUCache(max_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _cache_key(self, username, password):
+        credentials = '%s\0%s' % (username, password)
+        return hmac.new(_credentials_salt, credentials.encode('utf-8'), hashlib.sha256).digest()
+
+    def authenticate(self, username, password, peer):
+        key = self._cache_key(username, password)
+        is_authenticated = self.cache.get(key)
+        with self._lock:
+            if is_authenticated is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if is_authenticated is not None:
+            return is_authenticated
+
+        def store_result(result):
+            is_authenticated = bool(result)
+            ttl = self.ttl if is_authenticated else self.negative_ttl
+            self.cache.set(key, is_authenticated, ttl)
+        result = self.authenticator.authenticate(username, password, peer)
+        if isawaitable(result):
+            return _ResultObserver(result, store_result)
+        store_result(result)
+        return result
@@ -3,18 +3,120 @@
 
 from __future__ import print_function, unicode_literals
 
+import errno
 import re
 import socket
+import ssl
 
-from pymta.compat import basestring, queue
+from pymta.api import IBatchMessageDeliverer
+from pymta.compat import b64encode, basestring, unicode
+from pymta.config import get_default_config
+from pymta.delivery import BatchingDeliverer, GroupCommit
 from pymta.exceptions import SMTPViolationError
 from pymta.session import SMTPSession
 from pymta.statemachine import StateMachine
+from pymta.wakeup import wait_readable
 
 
 __all__ = ['SMTPCommandParser']
 
 
+# Replies with a constant text (e.g. '250 OK') are only encoded once. Replies
+# which contain client input or configurable text (e.g. the host name) are
+# encoded every time so the cache can not grow.
+_CONSTANT_REPLIES = (
+    (220, 'Ready to start TLS'),
+    (235, 'Authentication successful'),
+    (250, 'OK'),
+    (250, 'Reset OK'),
+    (334, b64encode('Username:')),
+    (334, b64encode('Password:')),
+    (354, 'Enter message, ending with "." on a line by itself'),
+    (451, 'Requested action aborted: error in processing'),
+    (454, 'TLS not available'),
+    (535, 'AUTH not available'),
+    (535, 'Bad username or password'),
+    (550, 'Administrative Prohibition'),
+    (550, 'Message content is not acceptable'),
+    (550, 'relay not permitted'),
+    (552, 'message exceeds fixed maximum message size'),
+    (554, 'SMTP service not available'),
+)
+_encoded_replies = dict([((code, text), ('%s %s\r\n' % (code, text)).encode('ascii'))
+                         for code, text in _CONSTANT_REPLIES])
+
+_leading_dots_regex = re.compile(br'^\.\.', re.MULTILINE)
+_bdat_size_regex = re.compile(r'^(\d+)(?:\s+LAST)?$', re.IGNORECASE)
+
+
+class FrameBuffer(object):
+    """The FrameBuffer collects the raw bytes sent by the client and extracts
+    complete frames (a command line or the message data). Every byte is only
+    scanned once for the terminator (apart from a small overlap in case the
+    terminator was split between two packets) so the cost of receiving a
+    message is linear in its size."""
+
+    LINE_BREAK = b'\r\n'
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scanned_terminator = None
+        self._scan_offset = 0
+        self._line_scan_offset = 1
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def append(self, data):
+        self._buffer += data
+
+    def clear(self):
+        del self._buffer[:]
+        self._scan_offset = 0
+        self._line_scan_offset = 1
+
+    def pop_frame(self, terminator):
+        """Return the data before the first terminator (removing both from the
+        buffer) or None if the buffer does not contain the terminator yet."""
+        if terminator != self._scanned_terminator:
+            self._scanned_terminator = terminator
+            self._scan_offset = 0
+        index = self._buffer.find(terminator, self._scan_offset)
+        if index == -1:
+            # The beginning of the terminator might be at the end of the
+            # buffer so we need to scan these bytes again next time.
+            self._scan_offset = max(len(self._buffer) - len(terminator) + 1, 0)
+            return None
+        frame = bytes(self._buffer[:index])
+        del self._buffer[:index + len(terminator)]
+        self._scan_offset = 0
+        self._line_scan_offset = 1
+        return frame
+
+    def pop_bytes(self, max_size):
+        """Return (and remove) up to max_size bytes from the start of the
+        buffer."""
+        data = bytes(self._buffer[:max_size])
+        del self._buffer[:max_size]
+        self._scan_offset = 0
+        self._line_scan_offset = 1
+        return data
+
+    def pop_complete_lines(self):
+        """Return all data before the last line break in the buffer or None if
+        there is no such line break. The line break itself stays in the buffer
+        because it might be the start of a terminator."""
+        index = self._buffer.rfind(self.LINE_BREAK, self._line_scan_offset)
+        if index == -1:
+            self._line_scan_offset = max(len(self._buffer) - len(self.LINE_BREAK) + 1, 1)
+            return None
+        data = bytes(self._buffer[:index])
+        del self._buffer[:index]
+        self._scan_offset = 0
+        self._line_scan_offset = max(len(self._buffer) - len(self.LINE_BREAK) + 1, 1)
+        return data
+
+
 class ParserImplementation(object):
     """The SMTPCommandParser needs a connected socket to operate. This is very
     inconvenient for testing therefore all 'interesting' functionality is moved
@@ -49,48 +151,88 @@ class SMTPCommandParser(object):
     possible at all in the previous architecture."""
 
     LINE_TERMINATOR = '\r\n'
+    COMMAND_TERMINATOR = b'\r\n'
+    DATA_TERMINATOR = b'\r\n.\r\n'
 
     def __init__(self, channel, remote_ip_string, remote_port, deliverer,
-                 policy=None, authenticator=None):
+                 policy=None, authenticator=None, config=None):
         self._channel = channel
-
-        self.data = ''
-        self.terminator = self.LINE_TERMINATOR
+        if config is None:
+            config = get_default_config()
+        self.config = config
+
+        self._input = FrameBuffer()
+        # Replies are collected and sent at once after all input was processed
+        # (e.g. multiple pipelined commands or multi-line replies).
+        self._output = []
+        # number of message bytes which were passed to the session already
+        self._message_size = 0
+        self._is_closing = False
+        # BDAT: number of bytes remaining for the current chunk
+        self._chunk_remaining = None
+        self._is_last_chunk = False
+        self._discard_chunk = False
+        self._pending_cr = False
+        self._is_tls_active = False
+        # True while the session waits for a coroutine (see wait_for())
+        self._is_suspended = False
+        self._suspended_command = None
+        self.terminator = self.COMMAND_TERMINATOR
         self.state = self._build_state_machine()
+        # phase timing (see pymta.tracing), only if a tracer was configured
+        self._trace = None
+        self._data_start = None
+        if config.tracer is not None:
+            self._trace = config.tracer.start_session(remote_ip_string, remote_port)
 
         self.session = SMTPSession(command_parser=self, deliverer=deliverer,
-                                   policy=policy, authenticator=authenticator)
+                                   policy=policy, authenticator=authenticator,
+                                   metrics=config.session_metrics, trace=self._trace)
         allowed_commands = self.session.get_all_allowed_internal_commands()
-        self._parser = ParserImplementation(allowed_commands)
+        self._parser = self._get_parser_implementation(allowed_commands)
         self.session.new_connection(remote_ip_string, remote_port)
         self._maximum_message_size = None
+        self.flush()
 
-    def _build_state_machine(self):
-        def _command_completed(from_state, to_state, smtp_command):
-            self.data = ''
+    # ParserImplementations do not keep any state so one instance (and thus the
+    # compiled regex) can be shared by all sessions with the same commands.
+    _parser_implementations = {}
+
+    @classmethod
+    def _get_parser_implementation(cls, allowed_commands):
+        key = frozenset(allowed_commands)
+        parser = cls._parser_implementations.get(key)
+        if parser is None:
+            parser = ParserImplementation(key)
+            cls._parser_implementations[key] = parser
+        return parser
 
+    def _build_state_machine(self):
+        # The input buffer is not cleared when switching modes because it may
+        # already contain the next commands (PIPELINING, RFC 2920).
         def _start_receiving_message(from_state, to_state, smtp_command):
-            self.terminator = '%s.%s' % (self.LINE_TERMINATOR, self.LINE_TERMINATOR)
-            self.data = ''
+            self.terminator = self.DATA_TERMINATOR
+            self._message_size = 0
 
         def _finished_receiving_message(from_state, to_state, smtp_command):
-            self.terminator = self.LINE_TERMINATOR
-            self.data = ''
+            self.terminator = self.COMMAND_TERMINATOR
 
         state = StateMachine(initial_state='commands')
-        state.add('commands', 'commands',   'COMMAND', _command_completed)
-        state.add('commands', 'auth_login', 'AUTH_LOGIN', _command_completed)
+        state.add('commands', 'commands',   'COMMAND')
+        state.add('commands', 'auth_login', 'AUTH_LOGIN')
         # switch back to command mode after AUTH LOGIN is completed
-        state.add('auth_login', 'commands', 'COMMAND', _command_completed)
+        state.add('auth_login', 'commands', 'COMMAND')
 
         state.add('commands', 'data',       'DATA', _start_receiving_message)
         state.add('data',     'commands',   'COMMAND', _finished_receiving_message)
+        # BDAT (CHUNKING, RFC 3030)
+        state.add('commands', 'chunk',      'CHUNK')
+        state.add('chunk',    'commands',   'COMMAND')
         return state
 
     @property
     def primary_hostname(self):
-        # TODO: This should go into a config object!
-        return socket.getfqdn()
+        return self.config.hostname
 
     # -------------------------------------------------------------------------
     # Communication helper methods
@@ -98,33 +240,52 @@ class SMTPCommandParser(object):
     def multiline_push(self, code, lines):
         """Send a multi-message to the peer (using the correct SMTP line
         terminators (usually only called from the SMTPSession)."""
-        for line in lines[:-1]:
-            answer = '%s-%s' % (code, line)
-            self.push(answer)
-        self.push(code, lines[-1])
+        reply_lines = ['%s-%s' % (code, line) for line in lines[:-1]]
+        reply_lines.append('%s %s' % (code, lines[-1]))
+        self._output.append(self._encode_reply(reply_lines))
 
     def push(self, code, msg=None):
         """Send a message to the peer (using the correct SMTP line terminators
         (usually only called from the SMTPSession)."""
-        if msg is None:
-            msg = str(code)
-        else:
-            msg = '%s %s' % (code, msg)
-
-        if not msg.endswith(self.LINE_TERMINATOR):
-            msg += self.LINE_TERMINATOR
-        self._channel.write(msg)
+        data = _encoded_replies.get((code, msg))
+        if data is None:
+            if msg is None:
+                msg = str(code)
+            else:
+                msg = '%s %s' % (code, msg)
+            data = self._encode_reply([msg])
+        self._output.append(data)
+
+    def _encode_reply(self, reply_lines):
+        terminator = self.LINE_TERMINATOR
+        reply = ''.join([line if line.endswith(terminator) else (line + terminator)
+                         for line in reply_lines])
+        # replies may echo (UTF-8) input of the client
+        return reply.encode('utf-8')
+
+    def flush(self):
+        """Send all queued replies to the peer with a single write."""
+        if not self._output:
+            return
+        data = b''.join(self._output)
+        del self._output[:]
+        self._channel.write(data)
 
     def input_exceeds_limits(self):
         """Called from the underlying transport layer if the client input
         exceeded the configured maximum message size."""
         self.session.input_exceeds_limits()
         self.switch_to_command_mode()
+        self.flush()
 
     def is_input_too_big(self):
         if self._maximum_message_size is None:
             return False
-        return len(self.data) > self._maximum_message_size
+        input_size = len(self._input)
+        if self.is_in_data_mode():
+            # most of the message was already passed to the session
+            input_size += self._message_size
+        return input_size > self._maximum_message_size
 
     def set_maximum_message_size(self, max_size):
         """Set the maximum allowed size (in bytes) of a command/message in the
@@ -146,55 +307,223 @@ class SMTPCommandParser(object):
         """Called from the SMTPSession when the client should start transfering
         the actual message data."""
         self.state.execute('DATA')
+        if self._trace is not None:
+            self._data_start = self._trace.clock()
+
+    def switch_to_chunk_mode(self, size, first=False, last=False):
+        """Called from the SMTPSession when BDAT was accepted: The next 'size'
+        bytes are passed to the session (see SMTPSession.handle_message_data)
+        without looking for terminators or transparency dots. Afterwards
+        SMTPSession.chunk_received() is called. 'first'/'last' must be True
+        for the first/final chunk of a message."""
+        if first:
+            self._pending_cr = False
+            if self._trace is not None:
+                self._data_start = self._trace.clock()
+        self._start_chunk(size, last=last, discard=False)
+
+    def _start_chunk(self, size, last, discard):
+        self.state.execute('CHUNK')
+        self._chunk_remaining = size
+        self._is_last_chunk = last
+        self._discard_chunk = discard
+
+    def is_tls_available(self):
+        """Return True if the connection can be secured with STARTTLS."""
+        return (self.config.tls_context is not None) and (not self._is_tls_active)
+
+    def is_tls_active(self):
+        return self._is_tls_active
+
+    def start_tls(self):
+        """Called from the SMTPSession after STARTTLS was accepted. All
+        pending replies are sent, then the channel negotiates TLS. Any input
+        the client sent before the TLS handshake must be discarded (RFC 3207,
+        section 4.2) to prevent command injection."""
+        self.flush()
+        self._input.clear()
+        self._is_tls_active = True
+        self._channel.start_tls(self.config.tls_context)
+
+    def can_suspend(self):
+        """Return True if the session may wait for coroutines (only if the
+        channel runs in an event loop)."""
+        return hasattr(self._channel, 'wait_for')
+
+    def wait_for(self, awaitable, callback):
+        """Called from the SMTPSession when a hook returned an awaitable: No
+        more input is processed until it is done. Afterwards
+        callback(result, error) is called and the remaining input is
+        processed."""
+        self._is_suspended = True
+
+        def done(result, error):
+            self._is_suspended = False
+            try:
+                callback(result, error)
+                if self._is_suspended:
+                    # waiting for the next coroutine (e.g. authentication)
+                    return
+                if self._suspended_command is not None:
+                    command, parameter = self._suspended_command
+                    self._suspended_command = None
+                    self._command_processed(command, parameter)
+                self._process_input()
+            finally:
+                self.flush()
+        self._channel.wait_for(awaitable, done)
 
     def _remove_leading_dots_for_smtp_transparency_support(self, input_data):
         """Uses the input data to recover the original payload (includes
         transparency support as specified in RFC 821, Section 4.5.2)."""
-        regex = re.compile(r'^\.\.', re.MULTILINE)
-        data_without_transparency_dots = regex.sub('.', input_data)
-        return re.sub('\r\n', '\n', data_without_transparency_dots)
+        data_without_transparency_dots = _leading_dots_regex.sub(b'.', input_data)
+        return data_without_transparency_dots.replace(b'\r\n', b'\n')
 
     def is_in_command_mode(self):
         state = self.state.state()
-        assert state in ('commands', 'data', 'auth_login')
+        assert state in ('commands', 'data', 'auth_login', 'chunk')
         return (state == 'commands')
 
     def is_in_data_mode(self):
         state = self.state.state()
-        assert state in ('commands', 'data', 'auth_login')
+        assert state in ('commands', 'data', 'auth_login', 'chunk')
         return (state == 'data')
 
     def is_in_auth_login_mode(self):
         state = self.state.state()
-        assert state in ('commands', 'data', 'auth_login')
+        assert state in ('commands', 'data', 'auth_login', 'chunk')
         return (state == 'auth_login')
 
-    def process_new_data(self, data):
-        self.data += data
-        if self.is_input_too_big():
-            self.session.input_exceeds_limits()
-            self.switch_to_command_mode()
-            return
-        if self.terminator not in self.data:
-            return
+    def is_in_chunk_mode(self):
+        state = self.state.state()
+        assert state in ('commands', 'data', 'auth_login', 'chunk')
+        return (state == 'chunk')
 
-        # TODO: actually we should not assume that the terminator is at
-        # the end of the input string
-        input_data_without_terminator = self.data[:-len(self.terminator)]
+    def process_new_data(self, data):
+        """Process the given input from the client (bytes or any object
+        supporting the buffer protocol, e.g. a memoryview). The data may
+        contain multiple commands (PIPELINING) which are processed in order."""
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self._input.append(data)
+        try:
+            self._process_input()
+        finally:
+            self.flush()
+
+    def _process_input(self):
+        while not (self._is_closing or self._is_suspended):
+            if self.is_in_chunk_mode():
+                if not self._process_chunk():
+                    return
+                continue
+            if self.is_input_too_big():
+                self.session.input_exceeds_limits()
+                self._input.clear()
+                self.switch_to_command_mode()
+                return
+            frame = self._input.pop_frame(self.terminator)
+            if frame is None:
+                if self.is_in_data_mode():
+                    self._pass_message_data_to_session(self._input.pop_complete_lines())
+                return
+            self._process_frame(frame)
+
+    def _process_frame(self, frame):
         # REFACT: add property for this
         if self.is_in_command_mode():
-            command, parameter = self._parser.parse(input_data_without_terminator)
+            # Only command lines are decoded, message data stays bytes.
+            # SMTPUTF8 (RFC 6531) allows UTF-8 in addresses.
+            try:
+                command_line = frame.decode('utf-8')
+            except UnicodeDecodeError:
+                self.push(500, 'Syntax error - invalid UTF-8 in command')
+                return
+            command, parameter = self._parser.parse(command_line)
             self.session.handle_input(command, parameter)
-            self.data = ''
+            if self._is_suspended:
+                self._suspended_command = (command, parameter)
+            else:
+                self._command_processed(command, parameter)
         elif self.is_in_auth_login_mode():
-            parameter = input_data_without_terminator
+            # invalid characters are rejected by the base64 validation
+            parameter = frame.decode('utf-8', 'replace')
             self.session.handle_auth_credentials(parameter)
-            self.data = ''
         else:
-            msg_data = self._remove_leading_dots_for_smtp_transparency_support(input_data_without_terminator)  # noqa: E501 (line-too-long)
-            self.session.handle_input('MSGDATA', msg_data)
+            self._pass_message_data_to_session(frame)
+            if self._trace is not None:
+                self._trace.add('data', self._data_start)
+            self.session.handle_input('MSGDATA')
+
+    def _command_processed(self, command, parameter):
+        if (command.upper() == 'BDAT') and self.is_in_command_mode():
+            self._skip_rejected_chunk(parameter)
+
+    def _pass_message_data_to_session(self, data):
+        """Pass the (partial) message data to the session while the client is
+        still sending. 'data' always ends before a line break so that the
+        transparency dots can be removed without looking at the next chunk."""
+        if not data:
+            return
+        self._message_size += len(data)
+        msg_data = self._remove_leading_dots_for_smtp_transparency_support(data)
+        self.session.handle_message_data(msg_data)
+
+    def _skip_rejected_chunk(self, parameter):
+        """The client sends the chunk data even if the BDAT command was
+        rejected so we must ignore the announced number of bytes."""
+        match = _bdat_size_regex.match(parameter or '')
+        if match is not None:
+            self._start_chunk(int(match.group(1)), last=False, discard=True)
+
+    def _process_chunk(self):
+        """Process data for the current BDAT chunk. Returns True if the chunk
+        is complete."""
+        if self._chunk_remaining > 0:
+            data = self._input.pop_bytes(self._chunk_remaining)
+            if not data:
+                return False
+            self._chunk_remaining -= len(data)
+            if not self._discard_chunk:
+                self._pass_chunk_data_to_session(data)
+            if self._chunk_remaining > 0:
+                return False
+        is_discarded = self._discard_chunk
+        if self._is_last_chunk and self._pending_cr:
+            self._pending_cr = False
+            self.session.handle_message_data(b'\r')
+        self._chunk_remaining = None
+        self.switch_to_command_mode()
+        if not is_discarded:
+            if self._is_last_chunk and (self._trace is not None):
+                self._trace.add('data', self._data_start)
+            self.session.chunk_received()
+        return True
+
+    def _pass_chunk_data_to_session(self, data):
+        # The message is passed to the session with '\n' line endings (just
+        # like for DATA). A '\r' at the end of the chunk might be followed by
+        # '\n' in the next chunk.
+        if self._pending_cr:
+            data = b'\r' + data
+        self._pending_cr = data.endswith(b'\r')
+        if self._pending_cr:
+            data = data[:-1]
+        if data:
+            self.session.handle_message_data(data.replace(b'\r\n', b'\n'))
+
+    def connection_closed(self):
+        """Called from the underlying transport layer when the connection to
+        the client was closed."""
+        self.session.connection_closed()
+        if self._trace is not None:
+            trace, self._trace = self._trace, None
+            self.config.tracer.session_closed(trace)
 
     def close_when_done(self):
+        # ignore all remaining (pipelined) input
+        self._is_closing = True
+        self.flush()
         self._channel.close()
 
 
@@ -206,103 +535,162 @@ class ClientDisconnectedError(SMTPViolationError):
 class WorkerProcess(object):
     """The WorkerProcess handles the real communication. with the client. It
     does not know anything about the SMTP protocol (besides the fact that it is
-    a line-based protocol)."""
-
-    def __init__(self, queue, server_socket, deliverer_class, policy_class=None,
-                 authenticator_class=None):
-        self._queue = queue
+    a line-based protocol).
+
+    Data is received into a reusable buffer which grows (up to
+    MAX_RECV_BUFFER_SIZE) while the client sends a lot of data (e.g. a big
+    message) so that fewer system calls are needed.
+
+    Usually all workers share the same server socket and only the worker
+    which holds the accept token (pymta.wakeup.AcceptToken) may accept a new
+    connection. If accept_token is None, the worker has its own listening
+    socket (SO_REUSEPORT).
+
+    Idle workers block in select() until a connection (or the accept token)
+    is available or the stop_signal (pymta.wakeup.WakeupSignal) is set. The
+    PythonMTA sets the stop_signal to shut down or retire the worker (if it
+    was started by an adaptive pool, the worker reports its status via the
+    given scoreboard slot).
+
+    IBatchMessageDeliverers deliver messages via the given GroupCommit which
+    should be shared by all workers (threads) of a process."""
+
+    def __init__(self, accept_token, server_socket, deliverer_class, policy_class=None,
+                 authenticator_class=None, slot=None, config=None, group_commit=None,
+                 stop_signal=None):
+        self._accept_token = accept_token
         self._server_socket = server_socket
+        self._stop_signal = stop_signal
+        self._slot = slot
+        if config is None:
+            config = get_default_config()
+        self._config = config
         self._deliverer = self._get_instance_from_class(deliverer_class)
+        if isinstance(self._deliverer, IBatchMessageDeliverer):
+            if group_commit is None:
+                group_commit = GroupCommit(config.max_batch_size, config.max_batch_delay)
+            self._deliverer = BatchingDeliverer(self._deliverer, group_commit)
         self._policy = self._get_instance_from_class(policy_class)
         self._authenticator = self._get_instance_from_class(authenticator_class)
 
         self._connection = None
         self._chatter = None
         self._ignore_write_operations = False
+        self._recv_buffer = None
+
+    MIN_RECV_BUFFER_SIZE = 4096
+    MAX_RECV_BUFFER_SIZE = 256 * 1024
 
-    def _get_instance_from_class(self, class_reference):
+    @staticmethod
+    def _get_instance_from_class(class_reference):
         instance = None
         if class_reference is not None:
             instance = class_reference()
         return instance
 
+    def _should_retire(self):
+        return (self._slot is not None) and self._slot.should_retire()
+
+    def _should_stop(self):
+        if self._should_retire():
+            return True
+        return (self._stop_signal is not None) and self._stop_signal.is_set()
+
     def _wait_for_connection(self):
+        """Return a tuple (connection, remote address) or None if the worker
+        should stop."""
         while True:
-            # We want to check periodically if we need to abort
             try:
+                readable = wait_readable(self._server_socket, self._stop_signal)
+                if self._stop_signal in readable:
+                    return None
                 connection, remote_address = self._server_socket.accept()
                 break
-            except socket.timeout:
-                try:
-                    new_token = self._queue.get_nowait()
-                    self._queue.put(new_token)
-                    if new_token is None:
-                        return None
-                except queue.Empty:
-                    pass
+            except socket.error as e:
+                # another thread accepted the connection already (the
+                # listening socket is non-blocking)
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
             except KeyboardInterrupt:
                 return None
         connection.settimeout(socket.getdefaulttimeout())
+        # Replies are coalesced already but TLS handshakes consist of several
+        # small writes which would be delayed by Nagle's algorithm.
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         return connection, remote_address
 
-    def _get_token_with_timeout(self, seconds):
-        # wait at max 1 second for the token so that we can abort the whole
-        # process in a reasonable time
-        token = None
-        while True:
-            try:
-                token = self._queue.get(timeout=seconds)
-                break
-            except queue.Empty:
-                pass
-            except KeyboardInterrupt:
-                break
-        return token
+    def _acquire_token(self):
+        try:
+            return self._accept_token.acquire(self._stop_signal)
+        except KeyboardInterrupt:
+            return False
 
     def run(self):
-        token = None
-        def have_token():
-            return (token is not None)
-
+        if self._accept_token is None:
+            self._run_with_own_listener()
+            return
+        has_token = False
         try:
-            while True:
-                token = self._get_token_with_timeout(1)
-                if not have_token():
+            while not self._should_stop():
+                has_token = self._acquire_token()
+                if not has_token:
                     break
-                assert token is True
-
                 connection_info = self._wait_for_connection()
-                self._queue.put(token)
-                token = None
+                self._accept_token.release()
+                has_token = False
                 if connection_info is None:
                     break
                 self.handle_connection(connection_info)
         finally:
-            if have_token():
-                # If we possess the token, put it back in the queue so other can
+            if has_token:
+                # If we possess the token, put it back so other workers can
                 # continue doing stuff.
-                self._queue.put(True)
+                self._accept_token.release()
+
+    def _run_with_own_listener(self):
+        while not self._should_stop():
+            connection_info = self._wait_for_connection()
+            if connection_info is None:
+                break
+            self.handle_connection(connection_info)
 
     def _setup_new_connection(self, connection_info):
         self._connection, (remote_ip_string, remote_port) = connection_info
         self._ignore_write_operations = False
+        self._recv_buffer = bytearray(self.MIN_RECV_BUFFER_SIZE)
         self._chatter = SMTPCommandParser(self, remote_ip_string, remote_port,
-                            self._deliverer, self._policy, self._authenticator)
+                            self._deliverer, self._policy, self._authenticator,
+                            config=self._config)
 
     def handle_connection(self, connection_info):
+        if self._slot is not None:
+            self._slot.mark_busy()
+        try:
+            self._handle_connection(connection_info)
+        finally:
+            if self._slot is not None:
+                self._slot.mark_idle()
+
+    def _handle_connection(self, connection_info):
         self._setup_new_connection(connection_info)
         try:
             while self.is_connected():
+                buffer_ = self._recv_buffer
                 try:
-                    data = self._connection.recv(4096)
+                    nr_bytes = self._connection.recv_into(buffer_)
                 except socket.error:
                     raise ClientDisconnectedError()
-                if not data:
+                if not nr_bytes:
                     raise ClientDisconnectedError()
-                self._chatter.process_new_data(data.decode('ascii'))
+                self._chatter.process_new_data(memoryview(buffer_)[:nr_bytes])
+                if (nr_bytes == len(buffer_)) and (nr_bytes < self.MAX_RECV_BUFFER_SIZE):
+                    # the client sends more data than we can receive at once
+                    self._recv_buffer = bytearray(2 * nr_bytes)
         except ClientDisconnectedError:
             if self.is_connected():
                 self.close()
+        finally:
+            self._chatter.connection_closed()
 
     def is_connected(self):
         return (self._connection is not None)
@@ -313,6 +701,16 @@ class WorkerProcess(object):
             self._connection.close()
             self._connection = None
 
+    def start_tls(self, tls_context):
+        """Performs the (server-side) TLS handshake on the current connection.
+        The connection is closed if the handshake fails."""
+        assert self.is_connected()
+        try:
+            self._connection = tls_context.wrap_socket(self._connection, server_side=True)
+        except (ssl.SSLError, socket.error):
+            self.close()
+            self._ignore_write_operations = True
+
     def write(self, data):
         """Sends some data to the client."""
         # I don't want to add a separate 'Client disconnected' logic for sending.
@@ -323,7 +721,7 @@ class WorkerProcess(object):
             return
         assert self.is_connected()
         try:
-            self._connection.send(data.encode('ascii'))
+            self._connection.sendall(data)
         except socket.error:
             self.close()
             self._ignore_write_operations = True
@@ -13,9 +13,13 @@ except ImportError:
     import Queue as queue
 import base64
 import sys
+import time
 
 
-__all__ = ['queue']
+__all__ = ['isawaitable', 'monotonic', 'queue']
+
+# time.time() may jump (e.g. NTP) so use a monotonic clock if available
+monotonic = getattr(time, 'monotonic', time.time)
 
 
 if sys.version_info < (3, 0):
@@ -38,3 +42,22 @@ def b(x, encoding='iso-8859-1'):
     if isinstance(x, unicode):
         return x.encode(encoding)
     return bytes(x)
+
+
+if sys.version_info < (3, 5):
+    # no coroutines (async def) before Python 3.5
+    isawaitable = lambda obj: False
+else:
+    from inspect import isawaitable
+
+
+def run_coroutine(awaitable):
+    """Run the awaitable to completion in a new event loop and return its
+    result. Must not be called from a thread which runs an event loop
+    already."""
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(awaitable)
+    finally:
+        loop.close()
@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+import socket
+import ssl
+
+from pymta.delivery import DEFAULT_SPOOL_THRESHOLD
+from pymta.metrics import SMTPMetrics
+
+
+__all__ = ['build_tls_context', 'get_default_config', 'ServerConfig']
+
+
+class ServerConfig(object):
+    """The ServerConfig contains settings which are the same for all
+    connections of a server. The PythonMTA passes it to all worker processes
+    and every SMTP session can access it via its command parser.
+
+    hostname is the primary host name of the server which is used in the
+    SMTP greeting and in the replies to HELO/EHLO/QUIT. If you don't specify
+    it, the fully qualified domain name of the machine is determined once
+    (when the ServerConfig is created) so that no DNS lookups are necessary
+    during an SMTP session.
+
+    tls_context is a server-side ssl.SSLContext (see build_tls_context()).
+    If it is set, STARTTLS (RFC 3207) is announced and all connections use
+    the same context. As the context is created before the worker processes
+    are forked, all workers use the same session ticket keys so a client can
+    resume its TLS session even if it reaches a different worker.
+
+    max_batch_size and max_batch_delay (seconds) control how many messages
+    are passed to an IBatchMessageDeliverer at once (see
+    pymta.delivery.GroupCommit). Batches are collected per worker process so
+    they only help with PythonMTA(threads_per_worker > 1), the AsyncPythonMTA
+    always delivers single messages.
+
+    If a pymta.metrics.MetricsRegistry is passed as 'metrics', all sessions
+    record their metrics (see pymta.metrics.SMTPMetrics) in it. Forked worker
+    processes only update their own copy of the registry so metrics require
+    the AsyncPythonMTA or PythonMTA.serve_forever(use_multiprocessing=False).
+
+    tracer (pymta.tracing.SessionTracer) times the phases of every session
+    and passes the result to a callback when the connection is closed.
+
+    Messages bigger than spool_threshold bytes (default: 1 MiB) are written
+    to a temporary file while they are received (see
+    pymta.delivery.SpoolingDeliverer)."""
+
+    def __init__(self, hostname=None, tls_context=None, max_batch_size=100,
+                 max_batch_delay=0, metrics=None, tracer=None, spool_threshold=None):
+        if hostname is None:
+            hostname = socket.getfqdn()
+        self.hostname = hostname
+        self.tls_context = tls_context
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.metrics = metrics
+        self.session_metrics = SMTPMetrics(metrics) if (metrics is not None) else None
+        self.tracer = tracer
+        if spool_threshold is None:
+            spool_threshold = DEFAULT_SPOOL_THRESHOLD
+        self.spool_threshold = spool_threshold
+
+
+_default_config = None
+
+
+def get_default_config():
+    """Return the ServerConfig with default settings which is used if no
+    config was passed. It is created on first use and shared afterwards so
+    the host name is resolved only once per process (and not for every
+    connection)."""
+    global _default_config
+    if _default_config is None:
+        _default_config = ServerConfig()
+    return _default_config
+
+
+def build_tls_context(certfile, keyfile=None, num_tickets=2):
+    """Return a server-side ssl.SSLContext using the given certificate (and
+    private key, if not contained in certfile) with session tickets enabled
+    so that returning clients can skip the full TLS handshake.
+
+    num_tickets is the number of TLS 1.3 session tickets sent after each full
+    handshake (ignored if not supported by your Python version)."""
+    protocol = getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23)
+    context = ssl.SSLContext(protocol)
+    context.load_cert_chain(certfile, keyfile)
+    # Session tickets (RFC 5077/TLS 1.3) avoid a server-side session cache
+    # which could not be shared between worker processes.
+    context.options &= ~getattr(ssl, 'OP_NO_TICKET', 0)
+    if hasattr(context, 'num_tickets'):
+        context.num_tickets = num_tickets
+    return context
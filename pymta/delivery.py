@@ -0,0 +1,194 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Helpers to connect the streaming message transfer in the SMTPSession with
+the different kinds of deliverers."""
+
+from __future__ import print_function, unicode_literals
+
+import threading
+from tempfile import SpooledTemporaryFile
+
+from pymta.api import IMessageDeliverer, IStreamingMessageDeliverer
+from pymta.compat import isawaitable, monotonic, run_coroutine
+from pymta.exceptions import DeliveryError
+
+
+__all__ = ['BatchingDeliverer', 'DEFAULT_SPOOL_THRESHOLD', 'deliver_batch',
+           'GroupCommit', 'SpoolingDeliverer']
+
+# messages bigger than this (in bytes) are written to a temporary file
+DEFAULT_SPOOL_THRESHOLD = 1024 * 1024
+
+
+class SpoolingDeliverer(IStreamingMessageDeliverer):
+    """The SpoolingDeliverer collects the message contents in a
+    SpooledTemporaryFile (small messages are kept in memory, bigger ones are
+    written to disk) and sets 'msg.msg_file' so the policy can read the
+    complete message (via 'msg.msg_data'/'msg.msg_bytes') before it is
+    accepted.
+
+    Plain IMessageDeliverers are called via 'new_message_accepted()' after
+    the message was accepted ('msg.msg_data' contains the complete message
+    as usual, 'msg.msg_bytes' the raw bytes). Streaming deliverers receive
+    all chunks as well and may also use 'msg.msg_file' in
+    'commit_message()'. The spool file is closed afterwards."""
+
+    def __init__(self, deliverer, spool_threshold=None):
+        self.deliverer = deliverer
+        if spool_threshold is None:
+            spool_threshold = DEFAULT_SPOOL_THRESHOLD
+        self.spool_threshold = spool_threshold
+
+    def _is_streaming(self):
+        return isinstance(self.deliverer, IStreamingMessageDeliverer)
+
+    def begin_message(self, msg):
+        # The spool file is only created when the first chunk arrives so no
+        # file is left open if the client never sends any message data.
+        msg.msg_file = None
+        msg.msg_bytes = b''
+        if self._is_streaming():
+            self.deliverer.begin_message(msg)
+
+    def write_chunk(self, msg, chunk):
+        if msg.msg_file is None:
+            msg.msg_file = SpooledTemporaryFile(max_size=self.spool_threshold, mode='w+b')
+            # read from the spool file on demand
+            msg.msg_bytes = None
+        msg.msg_file.write(chunk)
+        if self._is_streaming():
+            self.deliverer.write_chunk(msg, chunk)
+
+    def commit_message(self, msg):
+        # returns the deliverer's result which might be a coroutine
+        if self._is_streaming():
+            if msg.msg_file is not None:
+                msg.msg_file.seek(0)
+            result = None
+            try:
+                result = self.deliverer.commit_message(msg)
+            finally:
+                if not isawaitable(result):
+                    self._close_spool_file(msg)
+                # else: the coroutine might still read from the spool file,
+                # it is closed when the message is garbage collected
+            return result
+        # 'msg_bytes' is read from the spool file, IMessageDeliverers may keep
+        # the message around so the spool file must not be used afterwards.
+        msg.msg_bytes
+        self._close_spool_file(msg)
+        return self.deliverer.new_message_accepted(msg)
+
+    def abort_message(self, msg):
+        self._close_spool_file(msg)
+        if self._is_streaming():
+            self.deliverer.abort_message(msg)
+
+    def _close_spool_file(self, msg):
+        msg_file = msg.msg_file
+        msg.msg_file = None
+        if msg_file is not None:
+            msg_file.close()
+
+
+class _BatchEntry(object):
+    def __init__(self, msg):
+        self.msg = msg
+        self.is_done = False
+        self.error = None
+
+
+def deliver_batch(deliverer, messages):
+    """Pass the messages to the IBatchMessageDeliverer and return a list with
+    the result for each message (None if it was delivered)."""
+    try:
+        results = deliverer.new_messages_accepted(messages)
+        if isawaitable(results):
+            results = run_coroutine(results)
+    except Exception as e:
+        return [e] * len(messages)
+    if results is None:
+        return [None] * len(messages)
+    results = list(results)
+    if len(results) != len(messages):
+        error = DeliveryError('deliverer returned %d results for %d messages' %
+                              (len(results), len(messages)))
+        return [error] * len(messages)
+    return results
+
+
+class GroupCommit(object):
+    """GroupCommit collects messages from concurrent sessions (threads) so an
+    IBatchMessageDeliverer can deliver them at once.
+
+    The first session which finds no running delivery becomes the "leader":
+    It waits up to max_delay seconds for more messages (unless max_batch_size
+    messages are queued already), delivers the batch with its own deliverer
+    instance and wakes up all sessions of the batch. Messages which arrive
+    while a batch is delivered are queued for the next batch.
+
+    A GroupCommit only sees the sessions of a single (worker) process: If
+    there is only one session thread, every batch contains a single message
+    so max_delay should be 0."""
+
+    def __init__(self, max_batch_size=100, max_delay=0):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._condition = threading.Condition()
+        self._pending = []
+        self._is_delivering = False
+
+    def deliver(self, deliverer, msg):
+        """Block until the message was delivered as part of a batch. Raises a
+        DeliveryError if the deliverer reported a failure for this message."""
+        entry = _BatchEntry(msg)
+        with self._condition:
+            self._pending.append(entry)
+            self._condition.notify_all()
+            while not entry.is_done:
+                if self._is_delivering:
+                    self._condition.wait()
+                else:
+                    self._deliver_next_batch(deliverer)
+        if entry.error is not None:
+            raise DeliveryError('delivery failed: %r' % (entry.error,))
+
+    def _deliver_next_batch(self, deliverer):
+        # must be called with the lock held
+        self._is_delivering = True
+        if self.max_delay:
+            deadline = monotonic() + self.max_delay
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+        batch = self._pending[:self.max_batch_size]
+        del self._pending[:self.max_batch_size]
+        results = None
+        self._condition.release()
+        try:
+            results = deliver_batch(deliverer, [entry.msg for entry in batch])
+        finally:
+            self._condition.acquire()
+            self._is_delivering = False
+            if results is None:
+                # e.g. KeyboardInterrupt, the sessions must not wait forever
+                results = [DeliveryError('delivery interrupted')] * len(batch)
+            for entry, error in zip(batch, results):
+                entry.error = error
+                entry.is_done = True
+            self._condition.notify_all()
+
+
+class BatchingDeliverer(IMessageDeliverer):
+    """Adapts an IBatchMessageDeliverer for a single session: Every accepted
+    message is passed to the (shared) GroupCommit which delivers it together
+    with messages from other sessions."""
+
+    def __init__(self, deliverer, group_commit):
+        self.deliverer = deliverer
+        self.group_commit = group_commit
+
+    def new_message_accepted(self, msg):
+        self.group_commit.deliver(self.deliverer, msg)
@@ -6,7 +6,7 @@ from __future__ import print_function, unicode_literals
 from pymta.api import PyMTAException
 
 
-__all__ = ['InvalidParametersError', 'SMTPViolationError']
+__all__ = ['DeliveryError', 'InvalidParametersError', 'SMTPViolationError']
 
 
 class SMTPViolationError(PyMTAException):
@@ -28,3 +28,9 @@ class InvalidParametersError(SMTPViolationError):
     def __init__(self, parameter=None, *args, **kwargs):
         super(InvalidParametersError, self).__init__(*args, **kwargs)
         self.parameter = parameter
+
+
+class DeliveryError(PyMTAException):
+    """Raised by a deliverer if an accepted message could not be delivered
+    (the client gets a temporary error reply)."""
+    pass
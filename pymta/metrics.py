@@ -0,0 +1,251 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""A minimal metrics registry (counters, gauges and histograms with fixed
+buckets) which can be exported in the Prometheus text format. pymta only
+collects metrics if a MetricsRegistry was passed via the ServerConfig so
+there is no overhead otherwise.
+
+Metrics are kept in the memory of the current process and are not
+collected from forked worker processes: The registry of the master process
+stays empty if the PythonMTA runs its sessions in worker processes (the
+default). Metrics only work with the AsyncPythonMTA or with
+PythonMTA.serve_forever(use_multiprocessing=False) (e.g. DebuggingMTA)."""
+
+from __future__ import print_function, unicode_literals
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+
+__all__ = ['MetricsRegistry', 'SMTPMetrics']
+
+# high resolution clock for durations
+timer = getattr(time, 'perf_counter', time.time)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+
+
+class _CounterValue(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class _GaugeValue(_CounterValue):
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class _HistogramValue(object):
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # not cumulative, the last item counts values above the biggest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        total = 0
+        for upper_bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield name + '_bucket', labels + (('le', upper_bound),), total
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, total
+
+
+class _Metric(object):
+    """A metric family: Values are stored per label combination (see
+    labels()). Metrics without labels can be used directly (e.g.
+    'counter.inc()')."""
+
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *labelvalues):
+        value = self._values.get(labelvalues)
+        if value is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError('%s expects labels %r' % (self.name, self.labelnames))
+            with self._lock:
+                value = self._values.setdefault(labelvalues, self._new_value())
+        return value
+
+    def samples(self):
+        for labelvalues, value in sorted(self._values.items()):
+            labels = tuple(zip(self.labelnames, labelvalues))
+            for sample in value.samples(self.name, labels):
+                yield sample
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, help_text, labelnames)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if (value > 0) else '-Inf'
+        return repr(value)
+    return '%d' % value
+
+
+def _format_label(value):
+    if isinstance(value, (int, float)):
+        return _format_value(value)
+    return '%s' % (value,)
+
+
+def _escape(value, escape_quotes=True):
+    value = value.replace('\\', '\\\\').replace('\n', '\\n')
+    if escape_quotes:
+        value = value.replace('"', '\\"')
+    return value
+
+
+class MetricsRegistry(object):
+    """The MetricsRegistry contains all metrics of a process. counter(),
+    gauge() and histogram() return the existing metric if it was created
+    before (with the same type)."""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError('metric %s exists already (%s)' % (name, metric.type_name))
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def export(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in tuple(self._metrics.values()):
+            lines.append('# HELP %s %s' % (metric.name, _escape(metric.help_text, False)))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_str = ','.join(['%s="%s"' % (label, _escape(_format_label(label_value)))
+                                          for label, label_value in labels])
+                    name = '%s{%s}' % (name, label_str)
+                lines.append('%s %s' % (name, _format_value(value)))
+        return ''.join([line + '\n' for line in lines])
+
+
+class SMTPMetrics(object):
+    """The metrics collected by the SMTPSession (created once per
+    MetricsRegistry, see ServerConfig):
+
+     - pymta_sessions_active/pymta_sessions_total
+     - pymta_command_duration_seconds (per SMTP command)
+     - pymta_policy_duration_seconds (per policy method)
+     - pymta_policy_decisions_total (per policy method and decision)
+     - pymta_replies_total (per reply code)
+     - pymta_messages_total (accepted/rejected/failed messages)
+     - pymta_message_size_bytes
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.sessions_active = registry.gauge('pymta_sessions_active',
+            'Number of currently open SMTP sessions')
+        self.sessions = registry.counter('pymta_sessions_total',
+            'Number of SMTP sessions')
+        self.command_duration = registry.histogram('pymta_command_duration_seconds',
+            'Time needed to process an SMTP command', ('command',))
+        self.policy_duration = registry.histogram('pymta_policy_duration_seconds',
+            'Time needed by the policy', ('method',))
+        self.policy_decisions = registry.counter('pymta_policy_decisions_total',
+            'Policy decisions', ('method', 'decision'))
+        self.replies = registry.counter('pymta_replies_total',
+            'Replies sent to clients', ('code',))
+        self.messages = registry.counter('pymta_messages_total',
+            'Messages received completely', ('result',))
+        self.message_size = registry.histogram('pymta_message_size_bytes',
+            'Size of received messages',
+            buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                     16777216, 67108864))
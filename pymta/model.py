@@ -18,10 +18,57 @@ class Message(object):
         elif not isinstance(smtp_to, (list, tuple)):
             smtp_to = [smtp_to]
         self.smtp_to = smtp_to
-        self.msg_data = msg_data
+        self._msg_data = msg_data
+        self._msg_bytes = None
+        # file-like object with the message contents (set by spooling
+        # deliverers), 'msg_bytes'/'msg_data' will be read from this file on
+        # demand.
+        self.msg_file = None
         self.username = username
+        # MAIL FROM used the SMTPUTF8 parameter (RFC 6531)
+        self.smtputf8 = False
         self.unvalidated_input = {}
 
+    @property
+    def msg_bytes(self):
+        """The message contents as received (bytes, line endings converted
+        to '\\n'). Messages may contain 8-bit data (8BITMIME, SMTPUTF8) so
+        this is the authoritative representation."""
+        if self._msg_bytes is None:
+            if self.msg_file is not None:
+                self.msg_file.seek(0)
+                self._msg_bytes = self.msg_file.read()
+                self.msg_file.seek(0)
+            elif self._msg_data is not None:
+                self._msg_bytes = self._msg_data.encode('utf-8')
+        return self._msg_bytes
+
+    @msg_bytes.setter
+    def msg_bytes(self, msg_bytes):
+        self._msg_bytes = msg_bytes
+        self._msg_data = None
+
+    @property
+    def msg_data(self):
+        """The message contents as text. 8-bit data is decoded as UTF-8 if
+        possible (ISO-8859-1 otherwise so no data is lost)."""
+        if self._msg_data is None:
+            msg_bytes = self.msg_bytes
+            if msg_bytes is not None:
+                self._msg_data = _decode_message(msg_bytes)
+        return self._msg_data
+
+    @msg_data.setter
+    def msg_data(self, msg_data):
+        self._msg_data = msg_data
+        self._msg_bytes = None
+
+
+def _decode_message(msg_bytes):
+    try:
+        return msg_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        return msg_bytes.decode('iso-8859-1')
 
 
 class Peer(object):
@@ -3,22 +3,49 @@
 
 from __future__ import print_function, unicode_literals
 
+import functools
 import socket
 import time
-from threading import Event
+import warnings
+from threading import Event, Thread
 
 from pymta.command_parser import WorkerProcess
+from pymta.config import ServerConfig, get_default_config
+from pymta.delivery import GroupCommit
+from pymta.scoreboard import Scoreboard
+from pymta.spool import SpoolDeliverer, run_delivery_worker
+from pymta.wakeup import AcceptToken, Notifier, WakeupSignal
 
 
 __all__ = ['PythonMTA']
 
 
 
-def run_worker(queue, server_socket, deliverer_class, policy_class,
-                 authenticator_class):
-    child = WorkerProcess(queue, server_socket, deliverer_class, policy_class,
-                          authenticator_class)
-    child.run()
+def run_worker(accept_token, server_socket, deliverer_class, policy_class,
+                 authenticator_class, slot=None, threads=1, config=None,
+                 stop_signal=None):
+    if config is None:
+        config = get_default_config()
+    # messages from all threads are delivered together (if the deliverer
+    # supports it)
+    group_commit = GroupCommit(config.max_batch_size, config.max_batch_delay)
+
+    def serve_connections():
+        # Every thread gets its own deliverer/policy/authenticator instances
+        # (created within that thread).
+        child = WorkerProcess(accept_token, server_socket, deliverer_class, policy_class,
+                              authenticator_class, slot=slot, config=config,
+                              group_commit=group_commit, stop_signal=stop_signal)
+        child.run()
+
+    if threads <= 1:
+        serve_connections()
+        return
+    worker_threads = [Thread(target=serve_connections) for i in range(threads)]
+    for thread in worker_threads:
+        thread.start()
+    for thread in worker_threads:
+        thread.join()
 
 
 
@@ -33,19 +60,93 @@ class PythonMTA(object):
     authenticator_class so these classes don't have to be thread-safe. If
     you omit the policy, all syntactically valid SMTP commands are
     accepted. If there is no authenticator specified, authentication will
-    not be available."""
+    not be available.
+
+    By default all worker processes share a single listening socket and pass
+    a token around so that only one of them calls accept() at a time. If
+    reuse_port is True (and the platform supports SO_REUSEPORT, e.g. Linux
+    3.9+), every worker gets its own listening socket instead and the kernel
+    distributes new connections between them. Please note that the kernel
+    does not know if a worker is busy: A new connection might have to wait
+    until the worker serving the listening socket finished its current
+    session even though other workers are idle.
+
+    The PythonMTA starts initial_workers worker processes. If you specify
+    min_spare_workers and max_spare_workers, the pool is adapted to the load
+    (similar to Apache's prefork MPM): New workers are started when less than
+    min_spare_workers are idle (but there will never be more than max_workers
+    processes) and idle workers are retired if there are more than
+    max_spare_workers of them. Idle workers are never retired if they use their
+    own listening sockets (reuse_port): Connections which the kernel already
+    queued for a retiring worker's socket would be reset when it is closed.
+
+    Each worker process serves a single connection at a time unless you set
+    threads_per_worker: Then every worker serves that many connections
+    concurrently from separate threads. Every thread uses its own deliverer,
+    policy and authenticator instances so these still don't have to be
+    thread-safe (unless they share data between instances). A worker counts
+    as idle for the adaptive pool only if none of its threads is busy.
+
+    config is a ServerConfig with settings shared by all connections (e.g.
+    the server's host name). If you don't pass one, a default ServerConfig is
+    created (resolving the host name once).
+
+    If you pass a spool (pymta.spool.MessageSpool), accepted messages are
+    only written to the spool (durably) before the client gets the '250 OK'.
+    delivery_workers background processes pass the queued messages to
+    instances of deliverer_class so slow deliverers do not affect the SMTP
+    sessions. Messages which were queued but not delivered when the server
+    stopped (or crashed) are delivered after the next start."""
 
     def __init__(self, local_address, bind_port, deliverer_class,
-                 policy_class=None, authenticator_class=None):
+                 policy_class=None, authenticator_class=None, reuse_port=False,
+                 initial_workers=5, min_spare_workers=None, max_spare_workers=None,
+                 max_workers=None, threads_per_worker=1, config=None,
+                 spool=None, delivery_workers=2):
         self._local_address = local_address
         self._bind_port = bind_port
         self._deliverer_class = deliverer_class
         self._policy_class = policy_class
         self._authenticator_class = authenticator_class
+        self._reuse_port = reuse_port
+        if config is None:
+            config = ServerConfig()
+        self._config = config
 
-        self._queue = None
-        self._processes = []
+        is_adaptive_pool = (min_spare_workers is not None) or (max_spare_workers is not None)
+        if is_adaptive_pool:
+            min_spare_workers = min_spare_workers if (min_spare_workers is not None) else 1
+            max_spare_workers = max_spare_workers if (max_spare_workers is not None) else \
+                max(min_spare_workers, initial_workers)
+            if max_workers is None:
+                max_workers = max(initial_workers, 50)
+            if min_spare_workers > max_spare_workers:
+                raise ValueError('min_spare_workers must not exceed max_spare_workers')
+        elif max_workers is None:
+            max_workers = initial_workers
+        if initial_workers > max_workers:
+            raise ValueError('initial_workers must not exceed max_workers')
+        self._initial_workers = initial_workers
+        self._min_spare_workers = min_spare_workers
+        self._max_spare_workers = max_spare_workers
+        self._max_workers = max_workers
+        self._threads_per_worker = threads_per_worker
+        self._spool = spool
+        self._delivery_workers = delivery_workers
+
+        self._accept_token = None
+        self._scoreboard = None
+        self._workers = {}
+        # slot index (None: worker in the current process) -> WakeupSignal
+        self._stop_signals = {}
+        self._stop_delivery = None
+        self._delivery_notifier = None
+        self._delivery_processes = []
         self._shutdown_server = Event()
+        self._is_stopped = Event()
+
+    # seconds between checks of an adaptive worker pool
+    POOL_MAINTENANCE_INTERVAL = 1
 
     def _try_to_bind_to_socket(self, server_socket):
         tries = 0
@@ -58,13 +159,17 @@ class PythonMTA(object):
             else:
                 break
 
-    def _build_server_socket(self):
+    def _build_server_socket(self, reuse_port=False):
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # If the server crashed and we restarted it within a very short time
         # frame, prevent 'address already in use' errors.
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # We want to terminate all children within a reasonable time
-        server_socket.settimeout(1)
+        if reuse_port:
+            # all workers bind their own socket to the same address
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # Workers wait in select() so they notice a shutdown. accept() must
+        # not block if another worker (thread) got the connection already.
+        server_socket.setblocking(False)
         self._try_to_bind_to_socket(server_socket)
         # Don't loose connections in the time frame when a new connection was
         # accepted. Python's documentation says the maximum is system dependent
@@ -72,50 +177,179 @@ class PythonMTA(object):
         server_socket.listen(5)
         return server_socket
 
-    def _get_child_args(self, server_socket):
-        return (self._queue, server_socket, self._deliverer_class,
-                self._policy_class, self._authenticator_class)
+    def _get_session_deliverer_class(self):
+        """Return the deliverer class for the SMTP sessions: If a spool is
+        used, sessions only write messages to the spool."""
+        if self._spool is None:
+            return self._deliverer_class
+        return functools.partial(SpoolDeliverer, self._spool, notifier=self._delivery_notifier)
+
+    def _start_delivery_workers(self, use_multiprocessing):
+        if self._spool is None:
+            return
+        self._spool.recover()
+        if use_multiprocessing:
+            from multiprocessing import Process
+        else:
+            Process = Thread
+        self._stop_delivery = WakeupSignal()
+        # the sessions wake up the delivery workers for every queued message
+        self._delivery_notifier = Notifier()
+        for i in range(self._delivery_workers):
+            args = (self._spool, self._deliverer_class, self._stop_delivery,
+                    self._delivery_notifier)
+            process = Process(target=run_delivery_worker, args=args)
+            process.start()
+            self._delivery_processes.append(process)
+
+    def _stop_delivery_workers(self):
+        if self._stop_delivery is None:
+            return
+        self._stop_delivery.set()
+        for process in self._delivery_processes:
+            process.join()
+        self._delivery_processes = []
+        self._stop_delivery.close()
+        self._stop_delivery = None
+        self._delivery_notifier.close()
+        self._delivery_notifier = None
+
+    def _get_child_args(self, server_socket, slot=None, stop_signal=None):
+        return (self._accept_token, server_socket, self._get_session_deliverer_class(),
+                self._policy_class, self._authenticator_class,
+                slot, self._threads_per_worker, self._config, stop_signal)
+
+    def _new_stop_signal(self, key):
+        stop_signal = WakeupSignal()
+        self._stop_signals[key] = stop_signal
+        # shutdown_server() might have been called in the meantime
+        if self._shutdown_server.is_set():
+            stop_signal.set()
+        return stop_signal
+
+    def _close_stop_signal(self, key):
+        stop_signal = self._stop_signals.pop(key, None)
+        if stop_signal is not None:
+            stop_signal.close()
 
     def _start_new_worker_process(self, server_socket):
         """Start a new child worker process which will listen on the given
         socket and return a reference to the new process."""
         from multiprocessing import Process
-        p = Process(target=run_worker, args=self._get_child_args(server_socket))
+        slot = self._scoreboard.allocate_slot()
+        if slot is None:
+            return None
+        if self._accept_token is None:
+            # every worker listens on its own socket
+            server_socket = self._build_server_socket(reuse_port=True)
+        stop_signal = self._new_stop_signal(slot.index)
+        p = Process(target=run_worker,
+                    args=self._get_child_args(server_socket, slot, stop_signal))
         p.start()
+        if self._accept_token is None:
+            # The socket must be closed in the master process as well. Otherwise
+            # the kernel would still pass new connections to it after the
+            # worker exited.
+            server_socket.close()
+        self._workers[slot.index] = (slot, p)
         return p
 
+    def _can_reuse_port(self, use_multiprocessing):
+        return self._reuse_port and use_multiprocessing and hasattr(socket, 'SO_REUSEPORT')
+
+    def _is_adaptive_pool(self):
+        return (self._min_spare_workers is not None)
+
+    def _reap_exited_workers(self):
+        for index, (slot, process) in tuple(self._workers.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            self._scoreboard.release_slot(slot)
+            self._close_stop_signal(index)
+            del self._workers[index]
+
+    def _maintain_pool(self, server_socket):
+        """Start or retire worker processes so that the number of idle workers
+        stays between min_spare_workers and max_spare_workers."""
+        self._reap_exited_workers()
+        scoreboard = self._scoreboard
+        idle_slots = []
+        for index in sorted(self._workers):
+            slot, process = self._workers[index]
+            if not (scoreboard.is_busy(slot) or scoreboard.is_retiring(slot)):
+                idle_slots.append(slot)
+
+        if len(idle_slots) < self._min_spare_workers:
+            missing_workers = self._min_spare_workers - len(idle_slots)
+            nr_new_workers = min(missing_workers, self._max_workers - len(self._workers))
+            for i in range(nr_new_workers):
+                self._start_new_worker_process(server_socket)
+        elif (len(idle_slots) > self._max_spare_workers) and (self._accept_token is not None):
+            # Workers with their own listening socket are not retired (see
+            # class docstring).
+            for slot in idle_slots[self._max_spare_workers:]:
+                scoreboard.request_retirement(slot)
+                self._stop_signals[slot.index].set()
+
+    def _run_worker_pool(self, server_socket):
+        self._scoreboard = Scoreboard(self._max_workers)
+        for i in range(self._initial_workers):
+            self._start_new_worker_process(server_socket)
+        # Only an adaptive pool needs to check its workers periodically.
+        interval = self.POOL_MAINTENANCE_INTERVAL if self._is_adaptive_pool() else None
+        while not self._shutdown_server.is_set():
+            self._shutdown_server.wait(interval)
+            if self._is_adaptive_pool() and not self._shutdown_server.is_set():
+                self._maintain_pool(server_socket)
+        for index, (slot, process) in tuple(self._workers.items()):
+            process.join()
+            self._close_stop_signal(index)
+        self._workers = {}
+        self._scoreboard = None
+
     def serve_forever(self, use_multiprocessing=True):
         if use_multiprocessing:
             try:
-                from multiprocessing import Queue
+                import multiprocessing  # noqa: F401 (unused import)
             except ImportError:
                 use_multiprocessing = False
-        if not use_multiprocessing:
-            from pymta.compat import queue
-            Queue = queue.Queue
+        if use_multiprocessing and (self._config.metrics is not None):
+            warnings.warn('metrics are not collected from worker processes, use '
+                          'serve_forever(use_multiprocessing=False)', RuntimeWarning)
 
         self._shutdown_server.clear()
-        self._queue = Queue()
-        # Put the initial token in the Queue
-        self._queue.put(True)
-        server_socket = self._build_server_socket()
-        if use_multiprocessing:
-            for i in range(5):
-                p = self._start_new_worker_process(server_socket)
-                self._processes.append(p)
-            while not self._shutdown_server.isSet():
-                time.sleep(1)
-            for process in self._processes:
-                process.join()
-        else:
-            run_worker(*self._get_child_args(server_socket))
-        server_socket.close()
-        self._queue = None
+        self._is_stopped.clear()
+        server_socket = None
+        # If every worker listens on its own socket, no token is necessary.
+        if not self._can_reuse_port(use_multiprocessing):
+            self._accept_token = AcceptToken()
+            server_socket = self._build_server_socket()
+        self._start_delivery_workers(use_multiprocessing)
+        try:
+            if use_multiprocessing:
+                self._run_worker_pool(server_socket)
+            else:
+                stop_signal = self._new_stop_signal(None)
+                run_worker(*self._get_child_args(server_socket, stop_signal=stop_signal))
+        finally:
+            self._close_stop_signal(None)
+            self._stop_delivery_workers()
+            if server_socket is not None:
+                server_socket.close()
+            if self._accept_token is not None:
+                self._accept_token.close()
+                self._accept_token = None
+            self._is_stopped.set()
 
     def shutdown_server(self, timeout_seconds=None):
         """This method notifies the server that it should stop listening for
-        new messages and shut down itself. If timeout_seconds was given, the
-        method will block for this many seconds at most."""
-        self._queue.put(None)
+        new messages and shut down itself. Idle workers stop immediately,
+        busy workers after their current connection was closed. If
+        timeout_seconds was given, the method blocks until the server was
+        stopped but for this many seconds at most."""
         self._shutdown_server.set()
-        # TODO: Looks like we're quitting too fast here.
+        for stop_signal in tuple(self._stop_signals.values()):
+            stop_signal.set()
+        if timeout_seconds is not None:
+            self._is_stopped.wait(timeout_seconds)
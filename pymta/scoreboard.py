@@ -0,0 +1,99 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""The Scoreboard keeps track which worker processes are busy (similar to
+Apache's prefork scoreboard) so that the PythonMTA can start or retire workers
+depending on the load."""
+
+from __future__ import print_function, unicode_literals
+
+from threading import Lock
+
+
+__all__ = ['Scoreboard']
+
+
+class Scoreboard(object):
+    """The Scoreboard contains one slot for every possible worker process.
+    Slots are stored in shared memory: The status of a slot (number of busy
+    connections) is only written by the worker process using the slot,
+    retirement requests are only written by the master process. Therefore no
+    inter-process locking is needed."""
+
+    IDLE = 0
+
+    def __init__(self, size):
+        from multiprocessing import Array
+        # number of busy connections for each worker
+        self._status = Array('i', size, lock=False)
+        self._retire = Array('b', size, lock=False)
+        # only used by the master process
+        self._free_slots = list(range(size))
+
+    # --- master process -------------------
+
+    def allocate_slot(self):
+        """Return a WorkerSlot for a new worker process or None if all slots
+        are in use."""
+        if not self._free_slots:
+            return None
+        index = self._free_slots.pop(0)
+        self._status[index] = self.IDLE
+        self._retire[index] = 0
+        return WorkerSlot(self, index)
+
+    def release_slot(self, slot):
+        self._status[slot.index] = self.IDLE
+        self._retire[slot.index] = 0
+        self._free_slots.append(slot.index)
+        self._free_slots.sort()
+
+    def request_retirement(self, slot):
+        self._retire[slot.index] = 1
+
+    def is_busy(self, slot):
+        return (self._status[slot.index] != self.IDLE)
+
+    def is_retiring(self, slot):
+        return bool(self._retire[slot.index])
+
+    # --- worker process -------------------
+
+    def mark_busy(self, index):
+        self._status[index] += 1
+
+    def mark_idle(self, index):
+        self._status[index] -= 1
+
+    def should_retire(self, index):
+        return bool(self._retire[index])
+
+
+class WorkerSlot(object):
+    """A WorkerSlot is passed to a worker process so that it can report its
+    status and check if it should exit. All threads of a worker process share
+    the same slot."""
+
+    def __init__(self, scoreboard, index):
+        self._scoreboard = scoreboard
+        self.index = index
+        self._lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def mark_busy(self):
+        with self._lock:
+            self._scoreboard.mark_busy(self.index)
+
+    def mark_idle(self):
+        with self._lock:
+            self._scoreboard.mark_idle(self.index)
+
+    def should_retire(self):
+        return self._scoreboard.should_retire(self.index)
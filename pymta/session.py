@@ -7,8 +7,11 @@ import sys
 
 from pycerberus import InvalidDataError
 
-from pymta.compat import b64encode, basestring
-from pymta.exceptions import InvalidParametersError, SMTPViolationError
+from pymta.api import IMTAPolicy, IStreamingMessageDeliverer
+from pymta.compat import b64encode, basestring, bytes, isawaitable, run_coroutine
+from pymta.delivery import SpoolingDeliverer
+from pymta.exceptions import DeliveryError, InvalidParametersError, SMTPViolationError
+from pymta.metrics import timer
 from pymta.model import Message, Peer
 from pymta.statemachine import StateMachine, StateMachineError
 
@@ -23,6 +26,17 @@ class PolicyDenial(SMTPViolationError):
     pass
 
 
+class _PendingResult(Exception):
+    """Raised when a hook returned an awaitable and the command parser can
+    suspend the session: 'callback' must be called with the result later."""
+
+    def __init__(self, awaitable, callback, errback=None):
+        super(_PendingResult, self).__init__()
+        self.awaitable = awaitable
+        self.callback = callback
+        self.errback = errback
+
+
 class SMTPSession(object):
     """The SMTPSession processes all input data which were extracted from
     sockets previously. The idea behind this is that this class only knows about
@@ -31,34 +45,94 @@ class SMTPSession(object):
 
     The protocol parser will create a new session instance for every new
     connection so this class does not have to be thread-safe.
+
+    Common command arguments are validated without pycerberus (see
+    pymta.validation.validate_arguments). Set use_fast_validation to False
+    to process all arguments with the pycerberus schemas.
+
+    Policy, authenticator and deliverer methods may be coroutines (async def,
+    Python 3.5+). If the command parser can suspend the session (e.g. in the
+    AsyncPythonMTA), no further input is processed until the coroutine
+    finished. Otherwise the coroutine is run in a private event loop.
+
+    If 'metrics' (pymta.metrics.SMTPMetrics) is given, the session records
+    command/policy durations, replies and received messages. If 'trace'
+    (pymta.tracing.SessionTrace) is given, the session records the duration
+    of its phases (greeting, envelope, policy/authenticator/deliverer calls).
     """
 
+    use_fast_validation = True
+
     def __init__(self, command_parser, deliverer, policy=None,
-                 authenticator=None):
+                 authenticator=None, metrics=None, trace=None):
         self._command_parser = command_parser
-        self._deliverer = deliverer
+        self._metrics = metrics
+        self._trace = trace
         self._policy = policy
+        self._deliverer = self._build_deliverer(deliverer)
         self._authenticator = authenticator
 
         self._command_arguments = None
         self._close_connection_after_response = False
         self._is_connected = True
         self._message = None
-
-        self.state = None
-        self.valid_commands = None
-        self._build_state_machine()
+        self._is_receiving_message = False
+        self._message_size = 0
+        self._chunk_size = None
+        self._is_last_chunk = False
+        self._envelope_start = None
+        # (_PendingResult, result, error) of a completed coroutine hook
+        self._continuation = None
+
+        # The transitions are the same for all sessions so they are only
+        # built once per class, every session just keeps track of its state.
+        state_machine, self.valid_commands, self._allowed_internal_commands = \
+            self._get_state_machine_definition()
+        self.state = state_machine.copy(default_handler=self._dispatch_commands)
+
+    def _build_deliverer(self, deliverer):
+        """Streaming deliverers receive the message data directly unless the
+        policy needs the complete message for accept_msgdata(). All other
+        deliverers get a spooled message."""
+        if isinstance(deliverer, IStreamingMessageDeliverer):
+            if not self._policy_checks_message_data():
+                return deliverer
+        spool_threshold = self._command_parser.config.spool_threshold
+        return SpoolingDeliverer(deliverer, spool_threshold=spool_threshold)
+
+    def _policy_checks_message_data(self):
+        if self._policy is None:
+            return False
+        accept_msgdata = getattr(self._policy.accept_msgdata, '__func__', None)
+        default_implementation = getattr(IMTAPolicy.accept_msgdata, '__func__',
+                                         IMTAPolicy.accept_msgdata)
+        return (accept_msgdata is not default_implementation)
 
     # -------------------------------------------------------------------------
     # State machine building
 
-    def _add_state(self, from_state, to_state, smtp_command, **kwargs):
-        handler_function = self._dispatch_commands
-        self.state.add(from_state, smtp_command, to_state, handler_function, **kwargs)
-
-    def _get_all_commands(self, including_quit=False):
+    @classmethod
+    def _get_state_machine_definition(cls):
+        """Return a tuple (state machine, valid commands, allowed internal
+        commands) for this session class which must not be modified."""
+        definition = cls.__dict__.get('_state_machine_definition')
+        if definition is None:
+            state = cls._build_state_machine()
+            valid_commands = frozenset(state.known_actions())
+            allowed_internal_commands = frozenset(cls._get_all_allowed_internal_commands(state))
+            definition = (state, valid_commands, allowed_internal_commands)
+            cls._state_machine_definition = definition
+        return definition
+
+    @classmethod
+    def _add_state(cls, state, from_state, to_state, smtp_command, **kwargs):
+        # all commands are handled by '_dispatch_commands()' (default handler)
+        state.add(from_state, smtp_command, to_state, **kwargs)
+
+    @classmethod
+    def _get_all_commands(cls, state, including_quit=False):
         commands = set()
-        for actions in self.state._transitions.values():
+        for actions in state._transitions.values():
             for command_name, transition in actions.items():
                 target_state = transition[0]
                 if target_state in ['new']:
@@ -67,6 +141,14 @@ class SMTPSession(object):
                     commands.add(command_name)
         return commands
 
+    @classmethod
+    def _get_all_allowed_internal_commands(cls, state):
+        commands = set()
+        for command_name in cls._get_all_commands(state, including_quit=True):
+            if command_name not in ['GREET', 'MSGDATA', 'CHUNK', 'LAST CHUNK']:
+                commands.add(command_name)
+        return commands
+
     def get_all_allowed_internal_commands(self):
         """Returns an iterable which includes all allowed commands. This does
         not mean that a specific command from the result is executable right now
@@ -76,60 +158,74 @@ class SMTPSession(object):
         Please note that the returned values are /internal/ commands, not SMTP
         commands (use get_all_allowed_smtp_commands for that) so there will be
         'MAIL FROM' instead of 'MAIL'."""
-        states = set()
-        for command_name in self._get_all_commands(including_quit=True):
-            if command_name not in ['GREET', 'MSGDATA']:
-                states.add(command_name)
-        return states
+        return self._allowed_internal_commands
 
     def get_all_allowed_smtp_commands(self):
         states = set()
         for command_name in self.get_all_allowed_internal_commands():
             command_name = command_name.split(' ')[0]
             states.add(command_name)
+        if not self._command_parser.is_tls_available():
+            states.discard('STARTTLS')
         return states
 
-    def _add_rset_transitions(self):
-        for state_name in self.state.known_non_final_states():
+    @classmethod
+    def _add_rset_transitions(cls, state):
+        for state_name in state.known_non_final_states():
             target_state = 'initialized' if (state_name != 'new') else 'new'
-            self._add_state(state_name, 'RSET', target_state)
+            cls._add_state(state, state_name, 'RSET', target_state)
 
-    def _add_help_noop_and_quit_transitions(self):
+    @classmethod
+    def _add_help_noop_and_quit_transitions(cls, state):
         """HELP, NOOP and QUIT should be possible from everywhere so we
         need to add these transitions to all states configured so far."""
         states = set()
-        for state_name in self.state.known_states():
+        for state_name in state.known_states():
             if state_name not in ['new', 'finished']:
                 states.add(state_name)
-        for state in states:
-            self._add_state(state, 'NOOP',  state)
-            self._add_state(state, 'HELP',  state)
-            self._add_state(state, 'QUIT',  'finished')
+        for state_name in states:
+            cls._add_state(state, state_name, 'NOOP',  state_name)
+            cls._add_state(state, state_name, 'HELP',  state_name)
+            cls._add_state(state, state_name, 'QUIT',  'finished')
 
-    def _build_state_machine(self):
-        self.state = StateMachine(initial_state='new')
-        self._add_state('new',             'GREET',      'greeted')
-        self._add_state('greeted',         'HELO',       'initialized')
+    @classmethod
+    def _build_state_machine(cls):
+        state = StateMachine(initial_state='new')
+        cls._add_state(state, 'new',             'GREET',      'greeted')
+        cls._add_state(state, 'greeted',         'HELO',       'initialized')
 
-        self._add_state('greeted',         'EHLO',       'initialized', operations=('set_esmtp',))
+        cls._add_state(state, 'greeted',         'EHLO',       'initialized',
+                       operations=('set_esmtp',))
 
         # ----
-        self._add_state('initialized',     'MAIL FROM',  'sender_known')
-
-        self._add_state('initialized',     'AUTH PLAIN', 'authenticated', condition='if_esmtp')
-        self._add_state('initialized',     'AUTH LOGIN', 'authenticated', condition='if_esmtp')
-        self._add_state('authenticated',   'AUTH LOGIN', 'authenticated')
-        self._add_state('authenticated',   'MAIL FROM',  'sender_known')
+        cls._add_state(state, 'initialized',     'MAIL FROM',  'sender_known')
+
+        # STARTTLS (RFC 3207): the client must start over with EHLO
+        cls._add_state(state, 'initialized',     'STARTTLS',   'greeted', condition='if_esmtp',
+                       operations=('unset_esmtp',))
+
+        cls._add_state(state, 'initialized',     'AUTH PLAIN', 'authenticated',
+                       condition='if_esmtp')
+        cls._add_state(state, 'initialized',     'AUTH LOGIN', 'authenticated',
+                       condition='if_esmtp')
+        cls._add_state(state, 'authenticated',   'AUTH LOGIN', 'authenticated')
+        cls._add_state(state, 'authenticated',   'MAIL FROM',  'sender_known')
         # ----
 
-        self._add_state('sender_known',    'RCPT TO',    'recipient_known')
+        cls._add_state(state, 'sender_known',    'RCPT TO',    'recipient_known')
         # multiple recipients
-        self._add_state('recipient_known', 'RCPT TO',    'recipient_known')
-        self._add_state('recipient_known', 'DATA',       'receiving_message')
-        self._add_state('receiving_message', 'MSGDATA',  'initialized')
-        self._add_help_noop_and_quit_transitions()
-        self._add_rset_transitions()
-        self.valid_commands = self.state.known_actions()
+        cls._add_state(state, 'recipient_known', 'RCPT TO',    'recipient_known')
+        cls._add_state(state, 'recipient_known', 'DATA',       'receiving_message')
+        cls._add_state(state, 'receiving_message', 'MSGDATA',  'initialized')
+        # CHUNKING (RFC 3030)
+        cls._add_state(state, 'recipient_known', 'BDAT',       'receiving_chunk',
+                       condition='if_esmtp')
+        cls._add_state(state, 'receiving_chunk', 'CHUNK',      'chunk_received')
+        cls._add_state(state, 'receiving_chunk', 'LAST CHUNK', 'initialized')
+        cls._add_state(state, 'chunk_received',  'BDAT',       'receiving_chunk')
+        cls._add_help_noop_and_quit_transitions(state)
+        cls._add_rset_transitions(state)
+        return state
 
     # -------------------------------------------------------------------------
 
@@ -141,6 +237,8 @@ class SMTPSession(object):
         elif self._authenticator is not None:
             # fallback to ease testing in case no policy was specified explicitely
             lines.append('AUTH PLAIN')
+        if self._command_parser.is_tls_available():
+            lines.append('STARTTLS')
         lines.append('HELP')
         return lines
 
@@ -165,7 +263,18 @@ class SMTPSession(object):
             # Don't catch InvalidDataError here - else the state would be moved
             # forward. Instead the handle_input will catch it and send out the
             # appropriate reply.
-            handler_method()
+            if self._continuation is not None:
+                # the command was suspended while waiting for a coroutine
+                self._resume_continuation()
+            elif self._metrics is None:
+                handler_method()
+            else:
+                start = timer()
+                try:
+                    handler_method()
+                finally:
+                    duration = timer() - start
+                    self._metrics.command_duration.labels(smtp_command).observe(duration)
 
     def _evaluate_decision(self, decision):
         return (decision in [True, None])
@@ -192,21 +301,109 @@ class SMTPSession(object):
             self.please_close_connection_after_response()
         return decision, response_sent
 
+    def _evaluate_policy_result(self, result):
+        if result in [True, False, None]:
+            return self._evaluate_decision(result), False
+        elif hasattr(result, 'is_command_acceptable'):
+            return self._evaluate_policydecision_result(result)
+        elif len(result) == 2:
+            decision = self._evaluate_decision(result[0])
+            self._send_custom_response(result[1])
+            return decision, True
+        raise ValueError('Unknown policy response')
+
+    def _measure_policy(self, acl_name, callback):
+        """Wrap the callback for a policy decision so the duration of the
+        policy call (including coroutines) and the decision are recorded
+        (metrics and/or trace)."""
+        metrics = self._metrics
+        trace = self._trace
+        start = timer() if (metrics is not None) else None
+        trace_start = trace.clock() if (trace is not None) else None
+
+        def measuring_callback(decision, response_sent):
+            if metrics is not None:
+                metrics.policy_duration.labels(acl_name).observe(timer() - start)
+                decision_label = 'accept' if decision else 'reject'
+                metrics.policy_decisions.labels(acl_name, decision_label).inc()
+            if trace is not None:
+                trace.add('policy:' + acl_name, trace_start)
+            return callback(decision, response_sent)
+        return measuring_callback
+
     def is_allowed(self, acl_name, *args):
+        """Return a tuple (decision, response sent) for the given policy
+        method (coroutines are run until they are complete)."""
         if self._policy is not None:
-            decider = getattr(self._policy, acl_name)
-            result = decider(*args)
-            if result in [True, False, None]:
-                return self._evaluate_decision(result), False
-            elif hasattr(result, 'is_command_acceptable'):
-                return self._evaluate_policydecision_result(result)
-            elif len(result) == 2:
-                decision = self._evaluate_decision(result[0])
-                self._send_custom_response(result[1])
-                return decision, True
-            raise ValueError('Unknown policy response')
+            finish = lambda *decision: decision
+            if (self._metrics is not None) or (self._trace is not None):
+                finish = self._measure_policy(acl_name, finish)
+            result = getattr(self._policy, acl_name)(*args)
+            if isawaitable(result):
+                result = run_coroutine(result)
+            return finish(*self._evaluate_policy_result(result))
         return True, False
 
+    def check_policy(self, callback, acl_name, *args):
+        """Call the given policy method and pass the decision to the callback
+        (callback(decision, response_sent)). The callback might be called
+        later if the policy method is a coroutine."""
+        if self._policy is None:
+            return callback(True, False)
+        if (self._metrics is not None) or (self._trace is not None):
+            callback = self._measure_policy(acl_name, callback)
+        result = getattr(self._policy, acl_name)(*args)
+        return self._with_result(result,
+            lambda result: callback(*self._evaluate_policy_result(result)))
+
+    def _with_result(self, result, callback, errback=None):
+        """Pass the result of a hook (policy/authenticator/deliverer method)
+        to the callback. If the result is awaitable and the command parser can
+        suspend the session, the callback is called once the awaitable is
+        done (see _handle_pending_result()). If the coroutine raised an
+        exception, errback is called with it (default: re-raise)."""
+        if not isawaitable(result):
+            return callback(result)
+        if self._command_parser.can_suspend():
+            raise _PendingResult(result, callback, errback)
+        try:
+            result = run_coroutine(result)
+        except Exception as e:
+            if errback is None:
+                raise
+            return errback(e)
+        return callback(result)
+
+    def _handle_pending_result(self, pending, resume):
+        """Suspend the session until the awaitable is done, then store the
+        continuation and call 'resume' which must call
+        _resume_continuation()."""
+        def on_result(result, error):
+            if not self._is_connected:
+                return
+            self._continuation = (pending, result, error)
+            resume()
+        self._command_parser.wait_for(pending.awaitable, on_result)
+
+    def _resume_continuation(self):
+        pending, result, error = self._continuation
+        self._continuation = None
+        if error is None:
+            pending.callback(result)
+        elif pending.errback is not None:
+            pending.errback(error)
+        else:
+            raise error
+
+    def _run_suspendable(self, function):
+        """Call the function, if it needs to wait for a coroutine the
+        remaining work is done later."""
+        try:
+            function()
+        except _PendingResult as pending:
+            resume = lambda: self._run_suspendable(self._resume_continuation)
+            self._handle_pending_result(pending, resume)
+
     # -------------------------------------------------------------------------
 
     def new_connection(self, remote_ip, remote_port):
@@ -215,17 +412,23 @@ class SMTPSession(object):
         """
         self.state.set_state('new')
         self._message = Message(Peer(remote_ip, remote_port))
-
-        decision, response_sent = self.is_allowed('accept_new_connection',
-                                                  self._message.peer)
-        if decision:
-            if not response_sent:
-                self.handle_input('greet')
-            self._set_size_restrictions()
-        else:
-            if not response_sent:
-                self.reply(554, 'SMTP service not available')
-            self.close_connection()
+        if self._metrics is not None:
+            self._metrics.sessions.inc()
+            self._metrics.sessions_active.inc()
+
+        def decided(decision, response_sent):
+            if decision:
+                if not response_sent:
+                    self.handle_input('greet')
+                self._set_size_restrictions()
+            else:
+                if not response_sent:
+                    self.reply(554, 'SMTP service not available')
+                self.close_connection()
+            if self._trace is not None:
+                self._trace.add('greeting', self._trace.start)
+        self._run_suspendable(lambda: self.check_policy(
+            decided, 'accept_new_connection', self._message.peer))
 
     def handle_input(self, smtp_command, data=None):
         """Processes the given SMTP command with the (optional data).
@@ -268,21 +471,61 @@ class SMTPSession(object):
             e = sys.exc_info()[1]
             if not e.response_sent:
                 self.reply(e.code, e.reply_text)
+        except _PendingResult:
+            # The state was not changed yet, the command is executed again
+            # (calling the continuation instead of the handler) later.
+            pending = sys.exc_info()[1]
+            arguments = self._command_arguments
+            resume = lambda: self.handle_input(smtp_command, arguments)
+            self._handle_pending_result(pending, resume)
+
+    def handle_message_data(self, data):
+        """Processes a part of the message contents (byte string, transparency
+        dots already removed, lines are separated by '\\n') while the client is
+        still sending.
+        [PUBLIC API]
+        """
+        if not self._is_receiving_message:
+            return
+        self._message_size += len(data)
+        self._deliverer.write_chunk(self._message, data)
 
     def input_exceeds_limits(self):
         """Called when the client sent a message that exceeded the maximum
         size."""
+        self._abort_message()
         self.reply(552, 'message exceeds fixed maximum message size')
 
+    def chunk_received(self):
+        """Called when all data announced by a BDAT command was received (and
+        passed to handle_message_data()).
+        [PUBLIC API]
+        """
+        self.handle_input('LAST CHUNK' if self._is_last_chunk else 'CHUNK')
+
+    def connection_closed(self):
+        """Called when the connection to the client was closed (no matter if
+        the session requested that or not).
+        [PUBLIC API]
+        """
+        self._is_connected = False
+        self._abort_message()
+        if self._metrics is not None:
+            self._metrics.sessions_active.dec()
+
     def reply(self, code, text):
         """This method returns a message to the client (actually the session
         object is responsible of actually pushing the bits)."""
+        if self._metrics is not None:
+            self._metrics.replies.labels(code).inc()
         self._command_parser.push(code, text)
 
     def multiline_reply(self, code, responses):
         """This method returns a message with multiple lines to the client
         (actually the session object is responsible of actually pushing the
         bits)."""
+        if self._metrics is not None:
+            self._metrics.replies.labels(code).inc()
         self._command_parser.multiline_push(code, responses)
 
     def please_close_connection_after_response(self, value=None):
@@ -319,7 +562,8 @@ class SMTPSession(object):
 
     def validate(self, schema_class):
         context = dict(esmtp=self.uses_esmtp())
-        return schema_class().process(self.arguments(), context=context)
+        return validate_arguments(schema_class, self.arguments(), context,
+                                  use_fast_path=self.use_fast_validation)
 
     def smtp_quit(self):
         self.validate(SMTPCommandArgumentsSchema)
@@ -349,11 +593,13 @@ class SMTPSession(object):
     def _process_helo_or_ehlo(self, policy_methodname, reply_method):
         validated_data = self.validate(HeloSchema)
         helo_string = validated_data['helo']
-        decision, response_sent = self.is_allowed(policy_methodname, helo_string, self._message)
-        if decision:
-            reply_method(helo_string, response_sent)
-        elif not decision:
-            raise PolicyDenial(response_sent)
+
+        def decided(decision, response_sent):
+            if decision:
+                reply_method(helo_string, response_sent)
+            elif not decision:
+                raise PolicyDenial(response_sent)
+        self.check_policy(decided, policy_methodname, helo_string, self._message)
 
     def smtp_helo(self):
         self._process_helo_or_ehlo('accept_helo', self._reply_to_helo)
@@ -374,13 +620,18 @@ class SMTPSession(object):
             reply_text = 'AUTH not available'
             self.reply(code, reply_text)
             raise InvalidParametersError(response_sent=True, code=code, reply_text=reply_text)
-        credentials_correct = \
-            self._authenticator.authenticate(username, password, self._message.peer)
-        if credentials_correct:
-            self._message.username = username
-            self.reply(235, 'Authentication successful')
-        else:
-            self.reply(535, 'Bad username or password')
+        trace_start = self._trace.clock() if (self._trace is not None) else None
+
+        def authenticated(credentials_correct):
+            if self._trace is not None:
+                self._trace.add('authenticator', trace_start)
+            if credentials_correct:
+                self._message.username = username
+                self.reply(235, 'Authentication successful')
+            else:
+                self.reply(535, 'Bad username or password')
+        result = self._authenticator.authenticate(username, password, self._message.peer)
+        self._with_result(result, authenticated)
 
     def smtp_auth_plain(self):
         if self._authenticator is None:
@@ -390,26 +641,29 @@ class SMTPSession(object):
         username = validated_data['username']
         password = validated_data['password']
 
-        decision, response_sent = self.is_allowed('accept_auth_plain', username, password, self._message)  # noqa: E501 (line-too-long)
-        if not decision:
-            raise PolicyDenial(response_sent)
-        elif not response_sent:
-            self._check_password(username, password)
+        def decided(decision, response_sent):
+            if not decision:
+                raise PolicyDenial(response_sent)
+            elif not response_sent:
+                self._check_password(username, password)
+        self.check_policy(decided, 'accept_auth_plain', username, password, self._message)
 
     def smtp_auth_login(self):
         validated_data = self.validate(AuthLoginSchema) if self.arguments() else {}
         username = validated_data.get('username')
-        decision, response_sent = self.is_allowed('accept_auth_login', username, self._message)
-        if not decision:
-            raise PolicyDenial(response_sent)
-        elif not response_sent:
-            if not username:
-                next_ = 'Username:'
-            else:
-                self._message.unvalidated_input['username'] = username
-                next_ = 'Password:'
-            self._command_parser.switch_to_auth_login_mode()
-            self.reply(334, b64encode(next_))
+
+        def decided(decision, response_sent):
+            if not decision:
+                raise PolicyDenial(response_sent)
+            elif not response_sent:
+                if not username:
+                    next_ = 'Username:'
+                else:
+                    self._message.unvalidated_input['username'] = username
+                    next_ = 'Password:'
+                self._command_parser.switch_to_auth_login_mode()
+                self.reply(334, b64encode(next_))
+        self.check_policy(decided, 'accept_auth_login', username, self._message)
 
     def handle_auth_credentials(self, input_):
         # necessary so "self.validate()" works, usually done via ".handle_input()"
@@ -426,7 +680,7 @@ class SMTPSession(object):
             password = decoded_input
             del self._message.unvalidated_input['username']
             self._command_parser.switch_to_command_mode()
-            self._check_password(username, password)
+            self._run_suspendable(lambda: self._check_password(username, password))
 
     def _check_size_restriction(self, extensions):
         announced_size = extensions.get('size')
@@ -442,36 +696,56 @@ class SMTPSession(object):
     def uses_esmtp(self):
         return self.state.is_set('esmtp')
 
+    def _check_ascii_address(self, email):
+        # RFC 6531, section 3.6.2
+        if is_internationalized_address(email):
+            raise PolicyDenial(False, 553, '5.6.7 Non-ASCII addresses require SMTPUTF8')
+
     def smtp_mail_from(self):
+        if self._trace is not None:
+            self._envelope_start = self._trace.clock()
         validated_data = self.validate(MailFromSchema)
         sender = validated_data['email']
+        smtputf8 = validated_data.get('smtputf8', False)
+        if not smtputf8:
+            self._check_ascii_address(sender)
         self._check_size_restriction(validated_data)
-        decision, response_sent = self.is_allowed('accept_from', sender, self._message)
-        if not decision:
-            raise PolicyDenial(response_sent)
-        self._message.smtp_from = sender
-        if not response_sent:
-            self.reply(250, 'OK')
+
+        def decided(decision, response_sent):
+            if not decision:
+                raise PolicyDenial(response_sent)
+            self._message.smtp_from = sender
+            self._message.smtputf8 = smtputf8
+            if not response_sent:
+                self.reply(250, 'OK')
+        self.check_policy(decided, 'accept_from', sender, self._message)
 
     def smtp_rcpt_to(self):
         validated_data = self.validate(RcptToSchema)
         email_address = validated_data['email']
-        decision, response_sent = self.is_allowed('accept_rcpt_to', email_address, self._message)
-        if decision:
-            self._message.smtp_to.append(email_address)
-            if not response_sent:
-                self.reply(250, 'OK')
-        elif not decision:
-            raise PolicyDenial(response_sent, 550, 'relay not permitted')
+        if not self._message.smtputf8:
+            self._check_ascii_address(email_address)
+
+        def decided(decision, response_sent):
+            if decision:
+                self._message.smtp_to.append(email_address)
+                if not response_sent:
+                    self.reply(250, 'OK')
+            elif not decision:
+                raise PolicyDenial(response_sent, 550, 'relay not permitted')
+        self.check_policy(decided, 'accept_rcpt_to', email_address, self._message)
 
     def smtp_data(self):
         self.validate(SMTPCommandArgumentsSchema)
-        decision, response_sent = self.is_allowed('accept_data', self._message)
-        if decision and not response_sent:
-            self._command_parser.switch_to_data_mode()
-            self.reply(354, 'Enter message, ending with "." on a line by itself')
-        elif not decision:
-            raise PolicyDenial(response_sent)
+
+        def decided(decision, response_sent):
+            if decision and not response_sent:
+                self._command_parser.switch_to_data_mode()
+                self._begin_message()
+                self.reply(354, 'Enter message, ending with "." on a line by itself')
+            elif not decision:
+                raise PolicyDenial(response_sent)
+        self.check_policy(decided, 'accept_data', self._message)
 
     def _max_message_size(self):
         max_message_size = None
@@ -479,11 +753,11 @@ class SMTPSession(object):
             max_message_size = self._policy.max_message_size(self._message.peer)
         return max_message_size
 
-    def _check_size_restrictions(self, msg_data):
+    def _check_size_restrictions(self):
         max_message_size = self._max_message_size()
         if max_message_size is None:
             return
-        msg_too_big = (len(msg_data) > int(max_message_size))
+        msg_too_big = (self._message_size > int(max_message_size))
         if msg_too_big:
             msg = 'message exceeds fixed maximum message size'
             raise PolicyDenial(False, 552, msg)
@@ -495,26 +769,139 @@ class SMTPSession(object):
                               username=self._message.username)
         return new_message
 
+    def _begin_message(self):
+        self._message_size = 0
+        self._is_receiving_message = True
+        if self._trace is not None:
+            self._trace.add('envelope', self._envelope_start)
+        self._deliverer.begin_message(self._message)
+
+    def _abort_message(self):
+        if not self._is_receiving_message:
+            return
+        self._is_receiving_message = False
+        self._deliverer.abort_message(self._message)
+
     def smtp_msgdata(self):
         """This method handles not a real smtp command. It is called when the
-        whole message was received (multi-line DATA command is completed)."""
+        whole message was received (multi-line DATA command is completed).
+        Usually the message contents were passed before via
+        handle_message_data() but the final part of the message may be
+        passed as argument as well."""
         msg_data = self.arguments()
+        if msg_data:
+            if not isinstance(msg_data, bytes):
+                msg_data = msg_data.encode('utf-8')
+            self.handle_message_data(msg_data)
         self._command_parser.switch_to_command_mode()
-        self._check_size_restrictions(msg_data)
-        decision, response_sent = self.is_allowed('accept_msgdata', msg_data, self._message)
-        if decision:
-            self._message.msg_data = msg_data
-            new_message = self._copy_basic_settings(self._message)
-            self._deliverer.new_message_accepted(self._message)
+        self._finish_message()
+
+    def _count_message(self, result):
+        if self._metrics is not None:
+            self._metrics.messages.labels(result).inc()
+
+    def _finish_message(self):
+        if self._metrics is not None:
+            self._metrics.message_size.observe(self._message_size)
+
+        def decided(decision, response_sent):
+            if decision:
+                self._commit_message(response_sent)
+            elif not decision:
+                self._abort_message()
+                self._count_message('rejected')
+                raise PolicyDenial(response_sent, 550, 'Message content is not acceptable')
+        try:
+            try:
+                self._check_size_restrictions()
+            except PolicyDenial:
+                self._count_message('rejected')
+                raise
+            # Decoding the message data means reading a spooled message back
+            # into memory so only do that if the policy actually needs it.
+            msg_data = None
+            if self._policy_checks_message_data():
+                msg_data = self._message.msg_data
+            # accept_msgdata() might be called only later (coroutine)
+            self.check_policy(decided, 'accept_msgdata', msg_data, self._message)
+        except _PendingResult:
+            raise
+        except Exception:
+            self._abort_message()
+            raise
+
+    def _commit_message(self, response_sent):
+        new_message = self._copy_basic_settings(self._message)
+        self._is_receiving_message = False
+        trace_start = self._trace.clock() if (self._trace is not None) else None
+
+        def delivered(result):
+            if self._trace is not None:
+                self._trace.add('deliverer', trace_start)
+            self._count_message('accepted')
             if not response_sent:
                 self.reply(250, 'OK')
                 # Now we must not loose the message anymore!
             self._message = new_message
-        elif not decision:
-            raise PolicyDenial(response_sent, 550, 'Message content is not acceptable')
+
+        def delivery_failed(error):
+            if not isinstance(error, DeliveryError):
+                raise error
+            if self._trace is not None:
+                self._trace.add('deliverer', trace_start)
+            # temporary error, the client may retry in the same session
+            self._count_message('failed')
+            self._message = new_message
+            self.state.set_state('initialized')
+            raise PolicyDenial(False, 451, 'Requested action aborted: error in processing')
+        try:
+            result = self._deliverer.commit_message(self._message)
+        except DeliveryError as e:
+            delivery_failed(e)
+        self._with_result(result, delivered, delivery_failed)
+
+    def smtp_bdat(self):
+        validated_data = self.validate(BdatSchema)
+        is_first_chunk = not self._is_receiving_message
+
+        def decided(decision, response_sent):
+            if not decision:
+                raise PolicyDenial(response_sent)
+            if is_first_chunk:
+                self._begin_message()
+            self._chunk_size = validated_data['size']
+            self._is_last_chunk = validated_data['last']
+            self._command_parser.switch_to_chunk_mode(self._chunk_size,
+                                                      first=is_first_chunk,
+                                                      last=self._is_last_chunk)
+        if is_first_chunk:
+            self.check_policy(decided, 'accept_data', self._message)
+        else:
+            decided(True, False)
+
+    def smtp_chunk(self):
+        """This method handles not a real smtp command. It is called when all
+        data of a BDAT chunk (but not the last one) was received."""
+        self.reply(250, '%d octets received' % self._chunk_size)
+
+    def smtp_last_chunk(self):
+        """This method handles not a real smtp command. It is called when all
+        data of the last BDAT chunk was received."""
+        self._finish_message()
+
+    def smtp_starttls(self):
+        self.validate(SMTPCommandArgumentsSchema)
+        if not self._command_parser.is_tls_available():
+            raise PolicyDenial(False, 454, 'TLS not available')
+        self.reply(220, 'Ready to start TLS')
+        self._command_parser.start_tls()
+        # The client must not rely on any information obtained before the TLS
+        # handshake (and neither should we).
+        self._message = Message(peer=self._message.peer)
 
     def smtp_rset(self):
         self.validate(SMTPCommandArgumentsSchema)
+        self._abort_message()
         self._message = Message(peer=self._message.peer,
                                 smtp_helo=self._message.smtp_helo)
         self.reply(250, 'Reset OK')
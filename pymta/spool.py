@@ -0,0 +1,293 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""A durable on-disk queue for accepted messages so that the SMTP session does
+not have to wait for the (possibly slow) deliverer: A message is written to the
+spool (fsync'd) before the server replies '250 OK', background delivery workers
+pass it to the real deliverer afterwards.
+
+The spool directory uses a maildir-like layout:
+ - tmp: messages which are still being received
+ - new: messages which were accepted and wait for delivery
+ - cur: messages which are currently delivered by a delivery worker
+A message file is never changed after it was moved from 'tmp' to 'new' so
+renaming a file is the only operation which needs to be atomic."""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import logging
+import os
+import time
+import uuid
+
+from pymta.api import IBatchMessageDeliverer, IStreamingMessageDeliverer
+from pymta.compat import isawaitable, range, run_coroutine
+from pymta.delivery import deliver_batch
+from pymta.model import Message, Peer
+from pymta.wakeup import wait_readable
+
+
+__all__ = ['DeliveryWorker', 'MessageSpool', 'run_delivery_worker', 'SpoolDeliverer']
+
+log = logging.getLogger(__name__)
+
+
+class MessageSpool(object):
+    """The MessageSpool stores every message in a single file: The envelope
+    (JSON, one line) followed by the message contents.
+
+    If fsync is True (default), the message file and the directory are synced
+    to disk before a message is considered accepted. Only disable this if
+    losing accepted messages on a power failure is acceptable.
+
+    MessageSpool instances only contain the configuration so they can be
+    passed to other processes."""
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+
+    def _dir(self, name):
+        return os.path.join(self.path, name)
+
+    def create_directories(self):
+        for name in ('tmp', 'new', 'cur'):
+            directory = self._dir(name)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    def recover(self):
+        """Prepare the spool after a (possibly unclean) shutdown: Messages
+        which were not completely received are removed, messages which were
+        claimed by a delivery worker are queued again. Must be called before
+        any delivery workers are started."""
+        self.create_directories()
+        for filename in os.listdir(self._dir('tmp')):
+            os.unlink(os.path.join(self._dir('tmp'), filename))
+        for filename in os.listdir(self._dir('cur')):
+            os.rename(os.path.join(self._dir('cur'), filename),
+                      os.path.join(self._dir('new'), filename))
+
+    # --- storing messages ---------------------
+
+    def open_message(self, msg):
+        """Create a new spool file for the given message (writing the
+        envelope) and return a tuple (filename, file object)."""
+        # file names sort in the order the messages were received
+        filename = '%020d.%s' % (int(time.time() * 1000000), uuid.uuid4().hex)
+        msg_file = open(os.path.join(self._dir('tmp'), filename), 'wb')
+        envelope = {
+            'peer': [msg.peer.remote_ip, msg.peer.remote_port] if msg.peer else None,
+            'helo': msg.smtp_helo,
+            'from': msg.smtp_from,
+            'to': list(msg.smtp_to),
+            'username': msg.username,
+        }
+        msg_file.write(json.dumps(envelope).encode('utf-8') + b'\n')
+        return filename, msg_file
+
+    def commit_message(self, filename, msg_file):
+        """Make the message durable and queue it for delivery."""
+        msg_file.flush()
+        if self.fsync:
+            os.fsync(msg_file.fileno())
+        msg_file.close()
+        os.rename(os.path.join(self._dir('tmp'), filename),
+                  os.path.join(self._dir('new'), filename))
+        if self.fsync:
+            self._fsync_directory(self._dir('new'))
+
+    def discard_message(self, filename, msg_file):
+        msg_file.close()
+        os.unlink(os.path.join(self._dir('tmp'), filename))
+
+    def _fsync_directory(self, directory):
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # --- delivering messages ------------------
+
+    def claim_messages(self, max_messages):
+        """Return the file names of up to max_messages of the oldest queued
+        messages (which are now reserved for the caller). Messages which were
+        deferred are skipped until their retry time. The queue is only listed
+        once so claiming a batch does not depend on the queue length for
+        every message."""
+        now = time.time()
+        filenames = []
+        for filename in sorted(os.listdir(self._dir('new'))):
+            if len(filenames) >= max_messages:
+                break
+            path = os.path.join(self._dir('new'), filename)
+            try:
+                if os.path.getmtime(path) > now:
+                    continue
+                os.rename(path, os.path.join(self._dir('cur'), filename))
+            except OSError:
+                # claimed by another delivery worker
+                continue
+            filenames.append(filename)
+        return filenames
+
+    def claim_next_message(self):
+        """Return the file name of the oldest queued message (which is now
+        reserved for the caller) or None if there is no message to
+        deliver."""
+        filenames = self.claim_messages(1)
+        return filenames[0] if filenames else None
+
+    def load_message(self, filename):
+        with open(os.path.join(self._dir('cur'), filename), 'rb') as msg_file:
+            envelope = json.loads(msg_file.readline().decode('utf-8'))
+            msg_bytes = msg_file.read()
+        peer = Peer(*envelope['peer']) if envelope['peer'] else None
+        msg = Message(peer, smtp_helo=envelope['helo'], smtp_from=envelope['from'],
+                      smtp_to=envelope['to'], username=envelope['username'])
+        msg.msg_bytes = msg_bytes
+        return msg
+
+    def finish_message(self, filename):
+        os.unlink(os.path.join(self._dir('cur'), filename))
+
+    def defer_message(self, filename, seconds):
+        """Queue the message again, it will be delivered after the given
+        number of seconds."""
+        path = os.path.join(self._dir('cur'), filename)
+        retry_at = time.time() + seconds
+        os.utime(path, (retry_at, retry_at))
+        os.rename(path, os.path.join(self._dir('new'), filename))
+
+
+class SpoolDeliverer(IStreamingMessageDeliverer):
+    """The SpoolDeliverer writes the message contents directly into the
+    MessageSpool while the client is still sending. The message is queued
+    for delivery when it was accepted (before the client gets the '250 OK').
+
+    One instance may be used by several concurrent sessions. If a notifier
+    (pymta.wakeup.Notifier) is given, it wakes up the delivery workers after
+    every queued message."""
+
+    def __init__(self, spool, notifier=None):
+        self.spool = spool
+        self.notifier = notifier
+        # id(msg) -> (filename, file object)
+        self._open_messages = {}
+
+    def begin_message(self, msg):
+        self._open_messages[id(msg)] = self.spool.open_message(msg)
+
+    def write_chunk(self, msg, chunk):
+        filename, msg_file = self._open_messages[id(msg)]
+        msg_file.write(chunk)
+
+    def commit_message(self, msg):
+        filename, msg_file = self._open_messages.pop(id(msg))
+        self.spool.commit_message(filename, msg_file)
+        if self.notifier is not None:
+            self.notifier.notify()
+
+    def abort_message(self, msg):
+        filename, msg_file = self._open_messages.pop(id(msg))
+        self.spool.discard_message(filename, msg_file)
+
+
+class DeliveryWorker(object):
+    """The DeliveryWorker takes messages from the spool and passes them to
+    the deliverer (IMessageDeliverer or IStreamingMessageDeliverer). If the
+    deliverer raises an exception, the message is delivered again after
+    retry_interval seconds. Idle workers wait until the notifier
+    (pymta.wakeup.Notifier, see SpoolDeliverer) reports a new message and
+    check for deferred messages every poll_interval seconds.
+
+    IBatchMessageDeliverers get up to batch_size queued messages at once,
+    failed messages are retried individually."""
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, spool, deliverer_class, retry_interval=60, poll_interval=5,
+                 batch_size=100, notifier=None):
+        self.spool = spool
+        self.deliverer = deliverer_class()
+        self.retry_interval = retry_interval
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.notifier = notifier
+
+    def run(self, stop_signal):
+        """Deliver messages until the stop_signal (pymta.wakeup.WakeupSignal)
+        is set."""
+        while not stop_signal.is_set():
+            if self.notifier is not None:
+                # messages queued from now on will wake us up again
+                self.notifier.clear()
+            if not self.deliver_next_message():
+                wait_readable(stop_signal, self.notifier, timeout=self.poll_interval)
+
+    def deliver_next_message(self):
+        """Deliver a single message, returns False if there was no message
+        to deliver."""
+        if isinstance(self.deliverer, IBatchMessageDeliverer):
+            return self._deliver_next_batch()
+        filename = self.spool.claim_next_message()
+        if filename is None:
+            return False
+        try:
+            msg = self.spool.load_message(filename)
+            self._deliver(msg)
+        except Exception:
+            log.exception('delivery of %s failed', filename)
+            self.spool.defer_message(filename, self.retry_interval)
+        else:
+            self.spool.finish_message(filename)
+        return True
+
+    def _deliver_next_batch(self):
+        claimed = self.spool.claim_messages(self.batch_size)
+        if not claimed:
+            return False
+        filenames = []
+        messages = []
+        for filename in claimed:
+            try:
+                messages.append(self.spool.load_message(filename))
+            except Exception:
+                log.exception('can not load %s', filename)
+                self.spool.defer_message(filename, self.retry_interval)
+                continue
+            filenames.append(filename)
+        results = deliver_batch(self.deliverer, messages) if messages else []
+        for filename, error in zip(filenames, results):
+            if error is None:
+                self.spool.finish_message(filename)
+            else:
+                log.error('delivery of %s failed: %r', filename, error)
+                self.spool.defer_message(filename, self.retry_interval)
+        return True
+
+    def _deliver(self, msg):
+        if not isinstance(self.deliverer, IStreamingMessageDeliverer):
+            self._wait_for(self.deliverer.new_message_accepted(msg))
+            return
+        self.deliverer.begin_message(msg)
+        try:
+            msg_bytes = msg.msg_bytes
+            for offset in range(0, len(msg_bytes), self.CHUNK_SIZE):
+                self.deliverer.write_chunk(msg, msg_bytes[offset:offset+self.CHUNK_SIZE])
+        except Exception:
+            self.deliverer.abort_message(msg)
+            raise
+        self._wait_for(self.deliverer.commit_message(msg))
+
+    def _wait_for(self, result):
+        # deliverer methods may be coroutines
+        if isawaitable(result):
+            run_coroutine(result)
+
+
+def run_delivery_worker(spool, deliverer_class, stop_signal, notifier=None, retry_interval=60):
+    worker = DeliveryWorker(spool, deliverer_class, retry_interval=retry_interval,
+                            notifier=notifier)
+    worker.run(stop_signal)
@@ -18,10 +18,66 @@ class StateMachineDefinitionError(StateMachineError):
 
 
 class StateMachine(object):
-    def __init__(self, initial_state=None):
+    """A simple finite state machine. Every transition can have its own
+    handler. Transitions without a handler use the default_handler (if
+    given).
+
+    Before the first transition is executed, all transitions are compiled
+    into lookup tables (known states, allowed actions per state, parsed
+    conditions and operations) so that execute() only needs a few dict
+    lookups. finalize() does this explicitly and prevents any further
+    modifications.
+
+    Building the transitions is relatively expensive so copy() returns a new
+    state machine which shares all (finalized) transitions but not the
+    current state or any flags."""
+
+    def __init__(self, initial_state=None, default_handler=None):
+        self._initial_state = initial_state
         self._state = initial_state
         self._transitions = {}
         self._flags = {}
+        self._default_handler = default_handler
+        # (known states, {state: {action: compiled transition}})
+        self._compiled = None
+        self._is_final = False
+
+    def copy(self, default_handler=None):
+        """Return a new StateMachine in the initial state (without any flags)
+        which shares the transitions with this instance. The transitions are
+        finalized first."""
+        self.finalize()
+        state_machine = self.__class__(initial_state=self._initial_state,
+                                       default_handler=default_handler)
+        state_machine._transitions = self._transitions
+        state_machine._compiled = self._compiled
+        state_machine._is_final = True
+        return state_machine
+
+    def finalize(self):
+        """Compile all transitions. Afterwards no more transitions can be
+        added."""
+        self._compile()
+        self._is_final = True
+
+    def _compile(self):
+        if self._compiled is not None:
+            return self._compiled
+        known_states = frozenset(self.known_states())
+        actions_by_state = {}
+        for from_state, actions in self._transitions.items():
+            compiled_actions = {}
+            for action_name, transition in actions.items():
+                (to_state, handler, operations, condition) = transition
+                compiled_actions[action_name] = (
+                    to_state,
+                    handler,
+                    tuple([self._parse_operation(operation) for operation in operations]),
+                    self._parse_condition(condition),
+                )
+            actions_by_state[from_state] = compiled_actions
+        self._compiled = (known_states, actions_by_state)
+        return self._compiled
 
     # --- states ---------------------------
 
@@ -31,16 +87,20 @@ class StateMachine(object):
         return self._state
 
     def is_impossible_state(self):
-        return (self._state not in self.known_states())
+        known_states = self._compile()[0]
+        return (self._state not in known_states)
 
     def set_state(self, state):
-        if state not in self.known_states():
+        if state not in self._compile()[0]:
             raise StateMachineError
         self._state = state
 
     # --- transitions ----------------------
 
     def add(self, from_state, to_state, action_name, handler=None, operations=(), condition=None):
+        if self._is_final:
+            msg = 'Can not add transition "%s" (state machine was finalized already)' % action_name
+            raise StateMachineDefinitionError(msg)
         self._transitions.setdefault(from_state, {})
         if action_name in self._transitions[from_state]:
             old_to_state = self._transitions[from_state][action_name][0]
@@ -49,20 +109,28 @@ class StateMachine(object):
                 '(-> "%s" already known, can not add transition to "%s")'
             ) % (action_name, from_state, old_to_state, to_state)
             raise StateMachineDefinitionError(msg)
+        # validate operations/conditions early
+        for operation in operations:
+            self._parse_operation(operation)
+        self._parse_condition(condition)
         self._transitions[from_state][action_name] = (to_state, handler, operations, condition)
+        self._compiled = None
 
     def execute(self, action_name):
-        if action_name not in self.allowed_actions():
+        actions_by_state = self._compile()[1]
+        current_state = self._state
+        transition = actions_by_state.get(current_state, {}).get(action_name)
+        if (transition is None) or (not self._is_condition_satisfied(transition[3])):
             msg = 'Invalid action "%s", expected one of %s' % (action_name, self.allowed_actions())
             raise StateMachineError(msg)
 
-        current_state = self.state()
-        current_transitions = self._transitions.get(current_state, {})
-        final_state, handler, operations, condition = current_transitions[action_name]
+        final_state, handler, flag_operations, condition = transition
+        if handler is None:
+            handler = self._default_handler
         if handler is not None:
             handler(current_state, final_state, action_name)
-        for operation in operations:
-            self._execute_operation(operation)
+        for flag_name, value in flag_operations:
+            self._flags[flag_name] = value
         self._state = final_state
 
     # --- flags ----------------------------
@@ -70,21 +138,30 @@ class StateMachine(object):
     def is_set(self, flag):
         return self._flags.get(flag, False)
 
-    def _execute_operation(self, operation):
-        match = re.search(r'^set_(\w+)$', operation)
-        assert match is not None
-        flag_name = match.group(1)
-        self._flags[flag_name] = True
+    def _parse_operation(self, operation):
+        """Return a tuple (flag name, new flag value) for the given operation
+        string ('set_<flag>' or 'unset_<flag>')."""
+        match = re.search(r'^(un)?set_(\w+)$', operation)
+        if match is None:
+            raise StateMachineDefinitionError('Invalid operation "%s"' % operation)
+        return (match.group(2), not match.group(1))
+
+    def _parse_condition(self, condition):
+        """Return a tuple (flag name, expected flag value) for the given
+        condition string (or None if there is no condition)."""
+        if condition is None:
+            return None
+        match = re.search(r'^if_(not_)?(\w+?)$', condition)
+        if match is None:
+            raise StateMachineDefinitionError('Invalid condition "%s"' % condition)
+        flag = match.group(2)
+        return (flag, not match.group(1))
 
     def _is_condition_satisfied(self, condition):
         if condition is None:
             return True
-        match = re.search(r'^if_(not_)?(\w+?)$', condition)
-        assert match is not None
-        flag = match.group(2)
-        if match.group(1):
-            return not self.is_set(flag)
-        return self.is_set(flag)
+        flag, expected_value = condition
+        return (self._flags.get(flag, False) == expected_value)
 
     # --- introspection --------------------
 
@@ -95,9 +172,10 @@ class StateMachine(object):
         return actions
 
     def allowed_actions(self):
-        current_transitions = self._transitions.get(self.state(), {})
+        actions_by_state = self._compile()[1]
+        current_transitions = actions_by_state.get(self.state(), {})
         _allowed_actions = set()
-        for action_name, (to_state, handler, operations, condition) in current_transitions.items():
+        for action_name, (to_state, handler, flags, condition) in current_transitions.items():
             if not self._is_condition_satisfied(condition):
                 continue
             _allowed_actions.add(action_name)
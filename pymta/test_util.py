@@ -7,6 +7,9 @@ tests using pymta:
   interaction with an in-process MTA.
 - DebuggingMTA provides a very simple MTA which just collects all incoming
   messages so that you can examine then afterwards.
+- MTAProcess runs a PythonMTA in a separate process (e.g. for benchmarks).
+- SMTPClient is a minimal blocking SMTP client which adds as little overhead
+  as possible (e.g. for benchmarks).
 """
 
 from __future__ import print_function, unicode_literals
@@ -21,16 +24,24 @@ from unittest import TestCase
 from pycerberus.errors import InvalidDataError
 
 from .api import IAuthenticator, IMessageDeliverer, IMTAPolicy
-from .compat import b64encode, queue
+from .command_parser import SMTPCommandParser
+from .compat import b64encode, monotonic, queue
+from .config import ServerConfig
 from .mta import PythonMTA
 from .session import SMTPSession
 
 
 __all__ = [
     'BlackholeDeliverer',
+    'build_command_parser',
     'CommandParserHelper',
     'DebuggingMTA',
+    'FakeClock',
+    'free_port',
+    'MTAProcess',
     'MTAThread',
+    'NullDeliverer',
+    'SMTPClient',
     'SMTPTestCase',
     'SMTPTestHelper',
 ]
@@ -51,6 +62,13 @@ class BlackholeDeliverer(IMessageDeliverer):
         self.__class__.received_messages.put(msg)
 
 
+class NullDeliverer(IMessageDeliverer):
+    """NullDeliverer discards all messages."""
+
+    def new_message_accepted(self, msg):
+        pass
+
+
 class DebuggingMTA(PythonMTA):
     """DebuggingMTA is a very simple implementation of PythonMTA which just
     collects all incoming messages so that you can examine then afterwards."""
@@ -63,6 +81,19 @@ class DebuggingMTA(PythonMTA):
         return super(DebuggingMTA, self).serve_forever(use_multiprocessing=False)
 
 
+class FakeClock(object):
+    """Callable which can replace time.time()/monotonic() in tests. The time
+    only changes when you set 'now' or if 'tick' is set: Then every call
+    advances the time by 'tick' seconds."""
+    def __init__(self, now=0, tick=0):
+        self.now = now
+        self.tick = tick
+
+    def __call__(self):
+        self.now += self.tick
+        return self.now
+
+
 class MTAThread(threading.Thread):
     """This class runs a PythonMTA in a separate thread which is helpful for
     unit testing.
@@ -92,18 +123,67 @@ class MTAThread(threading.Thread):
             print("WARNING: Thread still alive. Timeout while waiting for termination!")
 
 
+def _serve_in_process(mta_factory, stop_event, serve_kwargs):
+    mta = mta_factory()
+    waiter = threading.Thread(target=lambda: (stop_event.wait(), mta.shutdown_server()))
+    waiter.daemon = True
+    waiter.start()
+    mta.serve_forever(**serve_kwargs)
+
+
+class MTAProcess(object):
+    """Context manager which runs the PythonMTA returned by 'mta_factory' in a
+    separate process (so clients in the current process do not compete with
+    the server for the GIL) and waits until it accepts connections on 'port'.
+    mta_factory must be picklable, serve_kwargs are passed to serve_forever()."""
+
+    def __init__(self, mta_factory, port, **serve_kwargs):
+        from multiprocessing import Event, Process
+        self.port = port
+        self._stop_event = Event()
+        self._process = Process(target=_serve_in_process,
+                                args=(mta_factory, self._stop_event, serve_kwargs))
+
+    def __enter__(self):
+        self._process.start()
+        try:
+            self._wait_until_ready()
+        except Exception:
+            self.__exit__()
+            raise
+        return self
+
+    def _wait_until_ready(self, timeout=10):
+        deadline = monotonic() + timeout
+        while True:
+            try:
+                SMTPClient('127.0.0.1', self.port).quit()
+                return
+            except socket.error:
+                if monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def __exit__(self, *exc_info):
+        self._stop_event.set()
+        self._process.join(10)
+        if self._process.is_alive():
+            self._process.terminate()
+
 
 class SMTPTestHelper(object):
-    def __init__(self, policy_class=IMTAPolicy, authenticator_class=None):
+    def __init__(self, policy_class=IMTAPolicy, authenticator_class=None,
+                 mta_class=DebuggingMTA, **mta_kwargs):
         self.hostname = 'localhost'
         self.listen_port = random.randint(8000, 40000)
         self.deliverer = BlackholeDeliverer
-        self.mta = DebuggingMTA(
+        self.mta = mta_class(
             self.hostname,
             self.listen_port,
             deliverer_class     = self.deliverer,
             policy_class        = policy_class,
             authenticator_class = authenticator_class,
+            **mta_kwargs
         )
         self.mta_thread = None
 
@@ -183,6 +263,7 @@ class SMTPTestCase(TestCase):
 
 class MockCommandParser(object):
     primary_hostname = 'localhost'
+    config = ServerConfig(hostname=primary_hostname)
 
     def __init__(self):
         self.replies = []
@@ -192,6 +273,12 @@ class MockCommandParser(object):
     def set_maximum_message_size(self, max_size):
         pass
 
+    def is_tls_available(self):
+        return False
+
+    def can_suspend(self):
+        return False
+
     def push(self, code, text):
         assert self.open
         self.replies.append((code, text))
@@ -219,10 +306,17 @@ class MockCommandParser(object):
 
 class MockChannel(object):
     def __init__(self):
+        # every reply line as a separate (unicode) string
         self.replies = []
+        self.nr_writes = 0
+        self.tls_context = None
 
     def write(self, data):
-        self.replies.append(data)
+        self.nr_writes += 1
+        self.replies.extend(data.decode('utf-8').splitlines(True))
+
+    def start_tls(self, tls_context):
+        self.tls_context = tls_context
 
     def close(self):
         pass
@@ -233,6 +327,24 @@ class DummyAuthenticator(IAuthenticator):
         return username == password
 
 
+def build_command_parser(deliverer=None, policy=None, authenticator=None, config=None,
+                         channel=None):
+    """Return a SMTPCommandParser for a new connection from 127.0.0.1:4567.
+    All replies are written to a MockChannel unless you pass another channel.
+    Without an explicit config the server hostname is 'localhost' so there is
+    no FQDN lookup."""
+    if config is None:
+        config = ServerConfig(hostname='localhost')
+    return SMTPCommandParser(
+        channel if channel is not None else MockChannel(),
+        '127.0.0.1', 4567,
+        deliverer if deliverer is not None else BlackholeDeliverer(),
+        policy=policy,
+        authenticator=authenticator,
+        config=config,
+    )
+
+
 class CommandParserHelper(object):
     def __init__(self, policy=None, authenticator=None):
         self.deliverer = None
@@ -328,3 +440,74 @@ class CommandParserHelper(object):
         assert code == 221
         assert reply_text == 'localhost closing connection'
         assert not self.command_parser.open
+
+
+def free_port():
+    """Return a TCP port on 127.0.0.1 which is not in use right now."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class SMTPClient(object):
+    """Minimal blocking SMTP client (no parsing except for the reply codes)
+    so the client side adds as little overhead as possible."""
+
+    def __init__(self, host, port, timeout=30):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._buffer = b''
+        self.greeting = self.read_reply()
+
+    def read_reply(self):
+        """Read a (possibly multi-line) reply and return its code."""
+        while True:
+            while b'\r\n' not in self._buffer:
+                data = self._sock.recv(65536)
+                if not data:
+                    raise socket.error('connection closed')
+                self._buffer += data
+            line, self._buffer = self._buffer.split(b'\r\n', 1)
+            if line[3:4] != b'-':
+                return int(line[:3])
+
+    def command(self, line):
+        self._sock.sendall(line.encode('ascii') + b'\r\n')
+        return self.read_reply()
+
+    def send_message(self, sender, recipients, body, pipelining=False):
+        """Send a single message and return the code of the final reply. 'body'
+        must be a bytes object using CRLF line endings.
+        If pipelining is True, MAIL FROM, RCPT TO and DATA are sent at once
+        (RFC 2920)."""
+        commands = ['MAIL FROM:<%s>' % sender]
+        commands.extend(['RCPT TO:<%s>' % recipient for recipient in recipients])
+        commands.append('DATA')
+        if pipelining:
+            self._sock.sendall(''.join([c + '\r\n' for c in commands]).encode('ascii'))
+            for command in commands:
+                self.read_reply()
+        else:
+            for command in commands:
+                self.command(command)
+        self._sock.sendall(body + b'\r\n.\r\n')
+        return self.read_reply()
+
+    def starttls(self, context, session=None):
+        """Send STARTTLS and perform the TLS handshake. Pass the 'session' of
+        a previous connection to resume that TLS session."""
+        code = self.command('STARTTLS')
+        assert code == 220
+        self._sock = context.wrap_socket(self._sock, server_hostname='localhost',
+                                         session=session)
+        return self._sock
+
+    def quit(self):
+        try:
+            self.command('QUIT')
+        finally:
+            self.close()
+
+    def close(self):
+        self._sock.close()
@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Per-session timing of the different SMTP phases (greeting, envelope,
+message data, policy checks, authentication, delivery) to find out where
+slow sessions spend their time. Sessions are only traced if a SessionTracer
+was passed via the ServerConfig so there is no overhead otherwise."""
+
+from __future__ import print_function, unicode_literals
+
+from collections import OrderedDict
+
+from pymta.compat import monotonic
+
+
+__all__ = ['SessionTrace', 'SessionTracer']
+
+
+class SessionTrace(object):
+    """Timing record of a single SMTP session. 'start' and 'end' are the
+    timestamps (tracer clock) when the connection was opened/closed,
+    'phases' is a list of (phase, start, end) tuples in the order the phases
+    were completed:
+
+     - greeting: until the greeting (or rejection) was sent, including the
+       accept_new_connection() policy check
+     - envelope: from MAIL FROM until the client may send the message data
+     - data: receiving the message data (DATA or all BDAT chunks)
+     - policy:<method name>: a single policy call (e.g.
+       'policy:accept_rcpt_to')
+     - authenticator: a single authenticate() call
+     - deliverer: delivering a message (commit_message())
+
+    Coroutines are timed until they are done. A session may contain several
+    envelope/data/deliverer phases (one for every message)."""
+
+    __slots__ = ('remote_ip', 'remote_port', 'start', 'end', 'phases', 'clock')
+
+    def __init__(self, remote_ip, remote_port, clock=monotonic):
+        self.remote_ip = remote_ip
+        self.remote_port = remote_port
+        self.clock = clock
+        self.start = clock()
+        self.end = None
+        self.phases = []
+
+    def add(self, phase, start):
+        """Record a phase which began at 'start' and ends now."""
+        self.phases.append((phase, start, self.clock()))
+
+    def durations(self):
+        """Return an OrderedDict with the total duration (seconds) per
+        phase."""
+        durations = OrderedDict()
+        for phase, start, end in self.phases:
+            durations[phase] = durations.get(phase, 0) + (end - start)
+        return durations
+
+    def __repr__(self):
+        return '<SessionTrace %s:%s %r>' % (self.remote_ip, self.remote_port, self.phases)
+
+
+class SessionTracer(object):
+    """Pass a SessionTracer as ServerConfig(tracer=...) to trace all SMTP
+    sessions. The callback is called with the SessionTrace when the
+    connection was closed (in the process/thread which served the
+    connection so it should return quickly, e.g. only log slow sessions).
+
+    'clock' must return monotonic timestamps in seconds (default:
+    time.monotonic)."""
+
+    def __init__(self, callback, clock=monotonic):
+        self.callback = callback
+        self.clock = clock
+
+    def start_session(self, remote_ip, remote_port):
+        return SessionTrace(remote_ip, remote_port, clock=self.clock)
+
+    def session_closed(self, trace):
+        trace.end = self.clock()
+        self.callback(trace)
@@ -16,11 +16,17 @@ __all__ = [
     'HeloSchema',
     'AuthPlainSchema',
     'AuthLoginSchema',
+    'BdatSchema',
     'MailFromSchema',
     'RcptToSchema',
     'SMTPCommandArgumentsSchema',
+    'get_schema',
+    'is_internationalized_address',
+    'validate_arguments',
 ]
 
+_non_ascii_regex = re.compile(r'[^\x00-\x7f]')
+
 # ------------------------------------------------------------------------------
 # General infrastructure
 
@@ -49,6 +55,21 @@ class SMTPEmailValidator(EmailAddressValidator):
             string_value = match.group(1)
         return string_value
 
+    def validate(self, value, context):
+        # Internationalized email addresses (SMTPUTF8, RFC 6531) may contain
+        # UTF-8 characters in the local part and in the domain. pycerberus
+        # only knows about ASCII addresses so we validate the structure of the
+        # address with all non-ASCII characters replaced. The SMTPSession
+        # rejects these addresses unless the client used SMTPUTF8.
+        ascii_value = _non_ascii_regex.sub('x', value)
+        super(SMTPEmailValidator, self).validate(ascii_value, context)
+
+
+def is_internationalized_address(email):
+    """Return True if the email address contains non-ASCII characters
+    (only allowed with SMTPUTF8, RFC 6531)."""
+    return _non_ascii_regex.search(email) is not None
+
 # ------------------------------------------------------------------------------
 # MAIL FROM
 
@@ -62,11 +83,48 @@ class SizeExtensionValidator(IntegerValidator):
         return {'too_low': _('Invalid size: Must be %(min)s or greater.')}
 
 
+class BodyExtensionValidator(StringValidator):
+    """BODY parameter of the 8BITMIME extension (RFC 6152)."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.update({'required': False, 'default': None})
+        super(BodyExtensionValidator, self).__init__(*args, **kwargs)
+
+    def messages(self):
+        return {'invalid_body': _('Invalid body type: "%(body)s"')}
+
+    def convert(self, value, context):
+        string_value = super(BodyExtensionValidator, self).convert(value, context)
+        body_type = string_value.upper()
+        if body_type not in ('7BIT', '8BITMIME'):
+            self.raise_error('invalid_body', string_value, context, body=string_value)
+        return body_type
+
+
+class FlagExtensionValidator(StringValidator):
+    """Validator for parameters without a value (e.g. SMTPUTF8, RFC 6531).
+    The MailFromSchema passes the parameter name as value."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.update({'required': False, 'default': False})
+        super(FlagExtensionValidator, self).__init__(*args, **kwargs)
+
+    def convert(self, value, context):
+        if value is False:
+            return False
+        super(FlagExtensionValidator, self).convert(value, context)
+        return True
+
+
 class MailFromSchema(SMTPCommandArgumentsSchema):
     email = SMTPEmailValidator()
     size  = SizeExtensionValidator()
+    body  = BodyExtensionValidator()
+    smtputf8 = FlagExtensionValidator()
 
     parameter_order = ('email',)
+    # extensions which are used without a value ('SMTPUTF8' vs. 'SIZE=1000')
+    flag_extensions = ('smtputf8',)
 
     def messages(self):
         return {
@@ -85,14 +143,16 @@ class MailFromSchema(SMTPCommandArgumentsSchema):
         for option in key_value_pairs:
             if len(option) == 2:
                 continue
+            if option[0].lower() in self.flag_extensions:
+                continue
             value = ''.join(option)
             self.raise_error('invalid_smtp_arguments', value, context, smtp_arguments=input_string)
 
     def _assert_only_known_extensions(self, key_value_pairs, input_string, context):
-        for key, value in key_value_pairs:
-            if key.lower() in self.fieldvalidators():
+        for option in key_value_pairs:
+            if option[0].lower() in self.fieldvalidators():
                 continue
-            value = '='.join((key, value))
+            value = '='.join(option)
             self.raise_error('invalid_extension', value, context, smtp_extension=input_string)
 
     def _validate_extension_arguments(self, key_value_pairs, input_string, context):
@@ -105,6 +165,8 @@ class MailFromSchema(SMTPCommandArgumentsSchema):
         key_value_pairs = [re.split('=', option, 1) for option in arguments[1:]]
 
         self._validate_extension_arguments(key_value_pairs, ' '.join(arguments[1:]), context)
+        # flags (e.g. 'SMTPUTF8') use their name as value
+        key_value_pairs = [(option * 2)[:2] for option in key_value_pairs]
         lower_case_key_value_pairs = [(item[0].lower(), item[1]) for item in key_value_pairs]
         options = dict(lower_case_key_value_pairs)
 
@@ -139,6 +201,28 @@ class RcptToSchema(SMTPCommandArgumentsSchema):
 
     parameter_order = ('email',)
 
+class LastChunkValidator(StringValidator):
+
+    def __init__(self, *args, **kwargs):
+        kwargs.update({'required': False, 'default': False})
+        super(LastChunkValidator, self).__init__(*args, **kwargs)
+
+    def messages(self):
+        return {'invalid_last': _("Syntactically invalid argument(s) '%(additional_item)s'")}
+
+    def convert(self, value, context):
+        string_value = super(LastChunkValidator, self).convert(value, context)
+        if string_value.upper() != 'LAST':
+            self.raise_error('invalid_last', string_value, context, additional_item=string_value)
+        return True
+
+
+class BdatSchema(SMTPCommandArgumentsSchema):
+    size = IntegerValidator(min=0)
+    last = LastChunkValidator()
+
+    parameter_order = ('size', 'last')
+
 # ------------------------------------------------------------------------------
 # AUTH PLAIN
 
@@ -204,3 +288,101 @@ class AuthLoginSchema(SMTPCommandArgumentsSchema):
             return b64decode(value)
         except Exception:
             self.raise_error('invalid_base64', value, context)
+
+# ------------------------------------------------------------------------------
+# Fast path
+#
+# Instantiating a pycerberus schema and running its generic argument parsing
+# is relatively expensive. The functions below handle the most common valid
+# inputs with a single (precompiled) regex. They return None for everything
+# else so the (cached) pycerberus schema can take care of it (including
+# generating the error message).
+
+# pycerberus' EmailAddressValidator/DomainNameValidator accept a superset of
+# these patterns
+_email_pattern = r'[a-zA-Z0-9\._\+\-]+@[a-zA-Z0-9\-]+(?:\.[a-zA-Z0-9\-]+)*'
+_email_argument_pattern = r'(?:<(%s)>|(%s))' % (_email_pattern, _email_pattern)
+_helo_regex = re.compile(r'^(\S+)$')
+_rcpt_to_regex = re.compile(r'^%s$' % _email_argument_pattern)
+# Other orders of the MAIL FROM parameters are handled by pycerberus.
+_mail_from_regex = re.compile(
+    r'^%s(?: SIZE=([1-9][0-9]*))?(?: BODY=(7BIT|8BITMIME))?( SMTPUTF8)?$' % _email_argument_pattern,
+    re.IGNORECASE)
+
+
+def _validate_no_arguments(value, context):
+    if value == '':
+        return {}
+    return None
+
+
+def _validate_helo(value, context):
+    match = _helo_regex.match(value)
+    if match is None:
+        return None
+    return {'helo': match.group(1)}
+
+
+def _validate_rcpt_to(value, context):
+    match = _rcpt_to_regex.match(value)
+    if match is None:
+        return None
+    return {'email': match.group(1) or match.group(2)}
+
+
+def _validate_mail_from(value, context):
+    match = _mail_from_regex.match(value)
+    if match is None:
+        return None
+    size, body, smtputf8 = match.group(3, 4, 5)
+    has_extensions = (size, body, smtputf8) != (None, None, None)
+    if has_extensions and not context.get('esmtp', False):
+        return None
+    if size is not None:
+        size = int(size)
+    if body is not None:
+        body = body.upper()
+    return {
+        'email': match.group(1) or match.group(2),
+        'size': size,
+        'body': body,
+        'smtputf8': (smtputf8 is not None),
+    }
+
+
+_fast_validators = {
+    SMTPCommandArgumentsSchema: _validate_no_arguments,
+    HeloSchema: _validate_helo,
+    RcptToSchema: _validate_rcpt_to,
+    MailFromSchema: _validate_mail_from,
+}
+
+_schemas = {}
+
+
+def get_schema(schema_class):
+    """Return a (shared) instance of the given schema class. pycerberus
+    schemas do not keep any state between calls to 'process()' so there is no
+    need to create a new instance for every command."""
+    schema = _schemas.get(schema_class)
+    if schema is None:
+        schema = schema_class()
+        _schemas[schema_class] = schema
+    return schema
+
+
+def validate_arguments(schema_class, value, context, use_fast_path=True):
+    """Validate the given SMTP command arguments and return the validated
+    values (or raise an InvalidDataError) just like
+    'schema_class().process(value, context=context)' would.
+
+    If use_fast_path is True, common inputs for the built-in schemas are
+    validated without pycerberus (subclasses of these schemas always use
+    pycerberus)."""
+    if use_fast_path:
+        fast_validator = _fast_validators.get(schema_class)
+        if fast_validator is not None:
+            result = fast_validator(value, context)
+            if result is not None:
+                return result
+    return get_schema(schema_class).process(value, context=context)
@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"""Primitives which let the PythonMTA's worker processes/threads block in
+select() until something happens (new connection, accept token available,
+new message in the spool, shutdown requested) instead of polling
+periodically. Both are based on
+socketpairs so they can be inherited by (forked) worker processes and work
+on all platforms which support select() on sockets."""
+
+from __future__ import print_function, unicode_literals
+
+import errno
+import select
+import socket
+
+
+__all__ = ['AcceptToken', 'Notifier', 'WakeupSignal', 'wait_readable']
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+
+def wait_readable(*objects, **kwargs):
+    """Block until at least one of the given objects (sockets or objects
+    with a fileno() method, None is ignored) is readable and return the
+    readable ones. If 'timeout' (seconds) is given, an empty list is returned
+    if nothing became readable in time."""
+    timeout = kwargs.pop('timeout', None)
+    objects = [obj for obj in objects if obj is not None]
+    while True:
+        try:
+            return select.select(objects, [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            # Python 2 does not retry select() after a signal (PEP 475)
+            if e.args[0] != errno.EINTR:
+                raise
+
+
+class WakeupSignal(object):
+    """A flag which can be waited for via select() (self-pipe trick): set()
+    writes a byte which is never read so the signal stays readable and wakes
+    up any number of processes/threads. A WakeupSignal can not be reset."""
+
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair()
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def set(self):
+        try:
+            self._writer.send(b'x')
+        except socket.error:
+            # already closed, nobody is waiting anymore
+            pass
+
+    def is_set(self):
+        return bool(select.select([self._reader], [], [], 0)[0])
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+
+
+class AcceptToken(object):
+    """Only the worker which holds the accept token may accept a new
+    connection so that not all idle workers are woken up by every new
+    connection. The token is a single byte in a socketpair: release() writes
+    it, acquire() reads it."""
+
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair()
+        # several workers may wait for the token, only one of them gets it
+        self._reader.setblocking(False)
+        self.release()
+
+    def acquire(self, stop_signal=None):
+        """Block until the token was acquired (returns True) or the
+        stop_signal (WakeupSignal) was set (returns False)."""
+        while True:
+            readable = wait_readable(self._reader, stop_signal)
+            if stop_signal in readable:
+                return False
+            try:
+                # no data: the token was closed (server stopped)
+                return bool(self._reader.recv(1))
+            except socket.error as e:
+                if e.args[0] not in _WOULD_BLOCK:
+                    raise
+
+    def release(self):
+        self._writer.send(b't')
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+
+
+class Notifier(object):
+    """Wakes up waiting processes/threads whenever notify() was called (e.g.
+    a new message was queued). Unlike the WakeupSignal, a waiter consumes the
+    pending notifications via clear() before it looks for new work so no
+    notification is lost."""
+
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair()
+        self._reader.setblocking(False)
+        self._writer.setblocking(False)
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def notify(self):
+        try:
+            self._writer.send(b'n')
+        except socket.error:
+            # buffer full (the waiters have to wake up anyway) or closed
+            pass
+
+    def clear(self):
+        try:
+            while self._reader.recv(4096):
+                pass
+        except socket.error as e:
+            if e.args[0] not in _WOULD_BLOCK:
+                raise
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
@@ -0,0 +1,191 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+"Tests for policies/authenticators/deliverers with coroutine methods."
+
+from __future__ import print_function, unicode_literals
+
+import asyncio
+import smtplib
+import threading
+import time
+
+from pymta.api import IAuthenticator, IMessageDeliverer, IMTAPolicy
+from pymta.async_mta import AsyncPythonMTA
+from pymta.cache import CachingAuthenticator, CachingPolicy
+from pymta.compat import b64encode, run_coroutine
+from pymta.exceptions import DeliveryError
+from pymta.test_util import MockChannel, SMTPTestHelper, build_command_parser
+
+
+rfc822_msg = 'Subject: Test\n\nJust testing...'
+
+
+class AsyncPolicy(IMTAPolicy):
+    delay = 0
+
+    async def accept_new_connection(self, peer):
+        await asyncio.sleep(0)
+        return True
+
+    async def accept_rcpt_to(self, new_recipient, message):
+        await asyncio.sleep(self.delay)
+        return not new_recipient.startswith('unknown')
+
+    async def accept_data(self, message):
+        await asyncio.sleep(0)
+        return True
+
+
+class AsyncAuthenticator(IAuthenticator):
+    async def authenticate(self, username, password, peer):
+        await asyncio.sleep(0)
+        return username == password
+
+
+class AsyncDeliverer(IMessageDeliverer):
+    messages = []
+
+    async def new_message_accepted(self, msg):
+        await asyncio.sleep(0)
+        if 'fail@example.com' in msg.smtp_to:
+            raise DeliveryError('mailbox not available')
+        self.messages.append(msg)
+
+
+class SuspendingChannel(MockChannel):
+    """Runs coroutines only when 'run_pending()' is called so tests can check
+    that no input is processed in the meantime."""
+
+    def __init__(self):
+        super(SuspendingChannel, self).__init__()
+        self.pending = []
+
+    def wait_for(self, awaitable, callback):
+        self.pending.append((awaitable, callback))
+
+    def run_pending(self):
+        while self.pending:
+            awaitable, callback = self.pending.pop(0)
+            callback(run_coroutine(awaitable), None)
+
+
+def _send_message(parser, recipient):
+    parser.process_new_data(b'MAIL FROM:<foo@example.com>\r\n')
+    parser.process_new_data(('RCPT TO:<%s>\r\n' % recipient).encode('ascii'))
+    parser.process_new_data(b'DATA\r\nSubject: Test\r\n\r\nJust testing\r\n.\r\n')
+
+
+def test_runs_coroutines_synchronously_without_event_loop():
+    AsyncDeliverer.messages = []
+    channel = MockChannel()
+    parser = build_command_parser(AsyncDeliverer(), policy=AsyncPolicy(),
+                                  authenticator=AsyncAuthenticator(), channel=channel)
+    assert channel.replies[0].startswith('220 ')
+    parser.process_new_data(b'EHLO foo\r\n')
+    parser.process_new_data(('AUTH PLAIN %s\r\n' % b64encode('\x00foo\x00foo')).encode('ascii'))
+    assert channel.replies[-1] == '235 Authentication successful\r\n'
+    parser.process_new_data(b'MAIL FROM:<foo@example.com>\r\n')
+    parser.process_new_data(b'RCPT TO:<unknown@example.com>\r\n')
+    assert channel.replies[-1].startswith('550 ')
+
+    _send_message(parser, 'bar@example.com')
+    assert channel.replies[-1] == '250 OK\r\n'
+    msg, = AsyncDeliverer.messages
+    assert msg.username == 'foo'
+
+
+def test_caching_authenticator_supports_coroutines():
+    caching_authenticator = CachingAuthenticator(AsyncAuthenticator())
+    assert run_coroutine(caching_authenticator.authenticate('foo', 'foo', None)) is True
+    # cached results are returned directly
+    assert caching_authenticator.authenticate('foo', 'foo', None) is True
+    assert not run_coroutine(caching_authenticator.authenticate('foo', 'bar', None))
+    assert (caching_authenticator.hits, caching_authenticator.misses) == (1, 2)
+
+
+def test_caching_policy_supports_coroutines():
+    caching_policy = CachingPolicy(AsyncPolicy(), {
+        'accept_rcpt_to': (lambda recipient, message: recipient, 60),
+    })
+    assert run_coroutine(caching_policy.accept_rcpt_to('foo@example.com', None)) is True
+    # cached results are returned directly
+    assert caching_policy.accept_rcpt_to('foo@example.com', None) is True
+    assert run_coroutine(caching_policy.accept_rcpt_to('unknown@example.com', None)) is False
+    assert caching_policy.accept_rcpt_to('unknown@example.com', None) is False
+    assert caching_policy.hits['accept_rcpt_to'] == 2
+    assert caching_policy.misses['accept_rcpt_to'] == 2
+
+
+def test_failed_coroutine_delivery_is_a_temporary_error():
+    AsyncDeliverer.messages = []
+    channel = MockChannel()
+    parser = build_command_parser(AsyncDeliverer(), policy=AsyncPolicy(), channel=channel)
+    parser.process_new_data(b'HELO foo\r\n')
+    _send_message(parser, 'fail@example.com')
+    assert channel.replies[-1].startswith('451 ')
+    _send_message(parser, 'bar@example.com')
+    assert channel.replies[-1] == '250 OK\r\n'
+
+
+def test_suspends_session_while_waiting_for_coroutine():
+    AsyncDeliverer.messages = []
+    channel = SuspendingChannel()
+    parser = build_command_parser(AsyncDeliverer(), policy=AsyncPolicy(),
+                                  authenticator=AsyncAuthenticator(), channel=channel)
+    # accept_new_connection
+    assert channel.replies == []
+    channel.run_pending()
+    assert channel.replies[-1].startswith('220 ')
+
+    del channel.replies[:]
+    parser.process_new_data(b'HELO foo\r\nMAIL FROM:<foo@example.com>\r\n'
+                            b'RCPT TO:<unknown@example.com>\r\nRCPT TO:<bar@example.com>\r\n'
+                            b'DATA\r\nSubject: Test\r\n\r\nJust testing\r\n.\r\nQUIT\r\n')
+    # commands after the first RCPT TO wait for the policy
+    assert channel.replies == ['250 localhost\r\n', '250 OK\r\n']
+    channel.run_pending()
+    assert [reply[:4] for reply in channel.replies] == \
+        ['250 ', '250 ', '550 ', '250 ', '354 ', '250 ', '221 ']
+    msg, = AsyncDeliverer.messages
+    assert msg.smtp_to == ['bar@example.com']
+
+
+def test_skips_chunk_if_suspended_bdat_was_rejected():
+    class RejectingPolicy(AsyncPolicy):
+        async def accept_data(self, message):
+            return False
+    channel = SuspendingChannel()
+    parser = build_command_parser(policy=RejectingPolicy(), channel=channel)
+    channel.run_pending()
+    parser.process_new_data(b'EHLO foo\r\nMAIL FROM:<foo@example.com>\r\n')
+    parser.process_new_data(b'RCPT TO:<bar@example.com>\r\n')
+    channel.run_pending()
+    del channel.replies[:]
+    parser.process_new_data(b'BDAT 6 LAST\r\nHELO\r\nNOOP\r\n')
+    channel.run_pending()
+    assert [reply[:4] for reply in channel.replies] == ['550 ', '250 ']
+
+
+def test_async_mta_serves_other_sessions_while_waiting():
+    AsyncPolicy.delay = 0.5
+    mta_helper = SMTPTestHelper(mta_class=AsyncPythonMTA, policy_class=AsyncPolicy)
+    mta_helper.start_mta()
+    try:
+        def send_message():
+            connection = smtplib.SMTP(mta_helper.hostname, mta_helper.listen_port)
+            connection.sendmail('from@example.com', 'to@example.com', rfc822_msg)
+            connection.quit()
+        threads = [threading.Thread(target=send_message) for i in range(5)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        duration = time.time() - start
+    finally:
+        AsyncPolicy.delay = 0
+        mta_helper.stop_mta()
+
+    assert mta_helper.get_received_messages().qsize() == 5
+    # sequential processing would take at least 2.5 seconds
+    assert duration < 2
@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+import smtplib
+import socket
+import time
+
+import pytest
+from pymta.test_util import BlackholeDeliverer, DummyAuthenticator, SMTPTestHelper
+
+
+pytest.importorskip('asyncio')
+from pymta.async_mta import AsyncPythonMTA
+
+
+rfc822_msg = 'Subject: Test\n\nJust testing...'
+
+
+@pytest.fixture
+def mta():
+    mta_helper = SMTPTestHelper(authenticator_class=DummyAuthenticator,
+                                mta_class=AsyncPythonMTA)
+    mta_helper.start_mta()
+    try:
+        yield mta_helper
+    finally:
+        mta_helper.stop_mta()
+
+
+def _connect(mta):
+    smtp_connection = smtplib.SMTP()
+    smtp_connection.connect(mta.hostname, mta.listen_port)
+    return smtp_connection
+
+
+def test_can_send_message(mta):
+    connection = _connect(mta)
+    connection.login('foo', 'foo')
+    connection.sendmail('from@example.com', 'to@example.com', rfc822_msg)
+    connection.quit()
+
+    queue = mta.get_received_messages()
+    assert queue.qsize() == 1
+    msg = queue.get()
+    assert msg.smtp_from == 'from@example.com'
+    assert msg.smtp_to == ['to@example.com']
+    assert msg.msg_data == rfc822_msg
+    assert msg.username == 'foo'
+
+
+def test_serves_many_concurrent_connections(mta):
+    # The prefork MTA only uses 5 worker processes so no more than 5 clients
+    # can be served at the same time.
+    connections = [_connect(mta) for i in range(20)]
+    for i, connection in enumerate(connections):
+        code, replytext = connection.helo('foo%d' % i)
+        assert code == 250
+    for i, connection in enumerate(connections):
+        recipient = 'to%d@example.com' % i
+        connection.sendmail('from@example.com', recipient, rfc822_msg)
+    for connection in connections:
+        connection.quit()
+
+    queue = mta.get_received_messages()
+    assert queue.qsize() == len(connections)
+    recipients = set()
+    while not queue.empty():
+        recipients.update(queue.get().smtp_to)
+    assert len(recipients) == len(connections)
+
+
+def test_connection_close_without_quit_is_handled(mta):
+    connection = _connect(mta)
+    connection.helo('foo')
+    connection.close()
+
+    connection = _connect(mta)
+    code, replytext = connection.helo('foo')
+    assert code == 250
+    connection.quit()
+
+
+def test_shutdown_server_waits_until_server_stopped():
+    mta_helper = SMTPTestHelper(mta_class=AsyncPythonMTA)
+    mta_helper.start_mta()
+    connection = _connect(mta_helper)
+    connection.helo('foo')
+    start = time.time()
+    mta_helper.mta.shutdown_server(timeout_seconds=5)
+    assert time.time() - start < 0.5
+    # the server socket was closed before shutdown_server() returned
+    with pytest.raises(socket.error):
+        socket.create_connection((mta_helper.hostname, mta_helper.listen_port)).close()
+    mta_helper.mta_thread.join(0.5)
+    assert not mta_helper.mta_thread.is_alive()
+    connection.close()
+
+
+def test_rejects_options_of_worker_processes():
+    with pytest.raises(ValueError):
+        AsyncPythonMTA('localhost', 0, BlackholeDeliverer, threads_per_worker=4)
@@ -32,6 +32,17 @@ def test_send_helo():
     _cp.close_connection()
 
 
+def test_sessions_share_state_machine_definition():
+    first = CommandParserHelper()
+    second = CommandParserHelper()
+    first.send('helo', 'foo.example.com')
+    assert first.session.state._transitions is second.session.state._transitions
+    assert first.session.state.state() == 'initialized'
+    assert second.session.state.state() == 'greeted'
+    first.close_connection()
+    second.close_connection()
+
+
 def test_reject_duplicated_helo():
     _cp = CommandParserHelper()
     _cp.send('helo', 'foo.example.com')
@@ -103,7 +114,7 @@ def test_help_is_supported():
     code, reply_text = _cp.send('HELP')
     assert code == 214
     supported_commands = set(reply_text[1].split(' '))
-    expected_commands = set(['AUTH', 'DATA', 'EHLO', 'HELO', 'HELP', 'MAIL',
+    expected_commands = set(['AUTH', 'BDAT', 'DATA', 'EHLO', 'HELO', 'HELP', 'MAIL',
                                 'NOOP', 'QUIT', 'RCPT', 'RSET'])
     assert supported_commands == expected_commands
 
@@ -236,6 +247,12 @@ def test_size_restrictions_are_announced_in_ehlo_reply():
     code, reply_texts = _cp.last_reply()
     assert 'SIZE 100' in reply_texts
 
+def test_pipelining_is_announced_in_ehlo_reply():
+    _cp = CommandParserHelper(policy=IMTAPolicy())
+    _cp.send('EHLO', 'foo.example.com')
+    code, reply_texts = _cp.last_reply()
+    assert 'PIPELINING' in reply_texts
+
 def test_early_rejection_if_size_verb_indicates_big_message():
     class RestrictedSizePolicy(IMTAPolicy):
         def max_message_size(self, peer):
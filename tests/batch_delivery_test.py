@@ -0,0 +1,147 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+import threading
+import time
+
+import pytest
+from pymta.api import IBatchMessageDeliverer
+from pymta.command_parser import SMTPCommandParser
+from pymta.delivery import BatchingDeliverer, GroupCommit, deliver_batch
+from pymta.exceptions import DeliveryError
+from pymta.model import Message
+from pymta.spool import DeliveryWorker, MessageSpool, SpoolDeliverer
+from pymta.test_util import MockChannel
+
+
+class RecordingBatchDeliverer(IBatchMessageDeliverer):
+    def __init__(self, delay=0, failing_recipients=()):
+        self.delay = delay
+        self.failing_recipients = failing_recipients
+        self.batches = []
+
+    def new_messages_accepted(self, batch):
+        time.sleep(self.delay)
+        self.batches.append(list(batch))
+        results = []
+        for msg in batch:
+            is_failing = set(msg.smtp_to) & set(self.failing_recipients)
+            results.append(IOError('disk full') if is_failing else None)
+        return results
+
+
+def _message(recipient):
+    return Message(None, smtp_from='foo@example.com', smtp_to=[recipient])
+
+
+def _deliver_concurrently(group_commit, deliverer, messages):
+    errors = {}
+    def deliver(msg):
+        try:
+            group_commit.deliver(deliverer, msg)
+        except DeliveryError as e:
+            errors[msg.smtp_to[0]] = e
+    threads = [threading.Thread(target=deliver, args=(msg,)) for msg in messages]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return errors
+
+
+def test_group_commit_delivers_concurrent_messages_together():
+    deliverer = RecordingBatchDeliverer(delay=0.2)
+    messages = [_message('%d@example.com' % i) for i in range(10)]
+    errors = _deliver_concurrently(GroupCommit(max_batch_size=100), deliverer, messages)
+
+    assert errors == {}
+    delivered = [msg for batch in deliverer.batches for msg in batch]
+    assert sorted(delivered, key=id) == sorted(messages, key=id)
+    # the first message is delivered immediately, all others arrive while the
+    # first batch is being delivered
+    assert len(deliverer.batches) < len(messages)
+
+
+def test_group_commit_respects_max_batch_size():
+    deliverer = RecordingBatchDeliverer(delay=0.1)
+    messages = [_message('%d@example.com' % i) for i in range(10)]
+    _deliver_concurrently(GroupCommit(max_batch_size=3, max_delay=0.5), deliverer, messages)
+
+    assert sum(len(batch) for batch in deliverer.batches) == 10
+    assert max(len(batch) for batch in deliverer.batches) == 3
+
+
+def test_group_commit_reports_failures_per_message():
+    deliverer = RecordingBatchDeliverer(delay=0.1, failing_recipients=('3@example.com',))
+    messages = [_message('%d@example.com' % i) for i in range(5)]
+    errors = _deliver_concurrently(GroupCommit(), deliverer, messages)
+    assert list(errors) == ['3@example.com']
+
+
+def test_wrong_number_of_results_fails_every_message():
+    class ShortBatchDeliverer(IBatchMessageDeliverer):
+        def new_messages_accepted(self, batch):
+            return [None]
+
+    messages = [_message('%d@example.com' % i) for i in range(3)]
+    results = deliver_batch(ShortBatchDeliverer(), messages)
+    assert len(results) == 3
+    assert all(isinstance(error, DeliveryError) for error in results)
+
+
+def test_failed_batch_delivery_is_a_temporary_error():
+    deliverer = RecordingBatchDeliverer(failing_recipients=('bar@example.com',))
+    channel = MockChannel()
+    parser = SMTPCommandParser(channel, '127.0.0.1', 12345,
+                               BatchingDeliverer(deliverer, GroupCommit()))
+    parser.process_new_data(b'HELO foo\r\nMAIL FROM:<foo@example.com>\r\n')
+    parser.process_new_data(b'RCPT TO:<bar@example.com>\r\nDATA\r\n')
+    parser.process_new_data(b'Subject: Test\r\n\r\nJust testing\r\n.\r\n')
+    assert channel.replies[-1] == '451 Requested action aborted: error in processing\r\n'
+
+    parser.process_new_data(b'MAIL FROM:<foo@example.com>\r\n')
+    parser.process_new_data(b'RCPT TO:<baz@example.com>\r\nDATA\r\n')
+    parser.process_new_data(b'Subject: Test\r\n\r\nJust testing\r\n.\r\n')
+    assert channel.replies[-1] == '250 OK\r\n'
+    assert len(deliverer.batches) == 2
+
+
+def test_delivery_worker_delivers_spooled_messages_in_batches(tmpdir):
+    spool = MessageSpool(str(tmpdir), fsync=False)
+    spool.recover()
+    spool_deliverer = SpoolDeliverer(spool)
+    for recipient in ('foo@example.com', 'bar@example.com', 'baz@example.com'):
+        msg = _message(recipient)
+        spool_deliverer.begin_message(msg)
+        spool_deliverer.write_chunk(msg, b'Subject: Test\n\nJust testing')
+        spool_deliverer.commit_message(msg)
+
+    deliverer = RecordingBatchDeliverer(failing_recipients=('bar@example.com',))
+    worker = DeliveryWorker(spool, lambda: deliverer, retry_interval=3600)
+    assert worker.deliver_next_message()
+    assert not worker.deliver_next_message()
+
+    batch, = deliverer.batches
+    assert [msg.smtp_to for msg in batch] == \
+        [['foo@example.com'], ['bar@example.com'], ['baz@example.com']]
+    # the failed message was deferred
+    assert spool.claim_next_message() is None
+    assert len(tmpdir.join('new').listdir()) == 1
+
+
+@pytest.mark.parametrize('results', [None, [None]])
+def test_batch_deliverer_can_deliver_single_messages(results):
+    class Deliverer(IBatchMessageDeliverer):
+        def new_messages_accepted(self, batch):
+            return results
+    Deliverer().new_message_accepted(_message('foo@example.com'))
+
+
+def test_batch_deliverer_raises_delivery_error_for_failed_single_message():
+    class Deliverer(IBatchMessageDeliverer):
+        def new_messages_accepted(self, batch):
+            return ['mailbox full']
+    with pytest.raises(DeliveryError):
+        Deliverer().new_message_accepted(_message('foo@example.com'))
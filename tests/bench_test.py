@@ -0,0 +1,26 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+from pymta.bench import percentile, run_benchmark
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([3], 95) == 3
+    assert percentile([], 50) is None
+
+
+def test_can_run_benchmark():
+    result = run_benchmark(concurrency=2, connections=4, messages_per_connection=2,
+                           recipients=2, pipelining=True, warmup=0)
+    assert result['messages'] == 8
+    assert result['errors'] == 0
+    assert result['messages_per_second'] > 0
+    latency = result['latency_ms']
+    assert latency['min'] <= latency['p50'] <= latency['p95'] <= latency['p99'] <= latency['max']
+    assert result['settings']['workers'] == 2
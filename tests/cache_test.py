@@ -0,0 +1,169 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+from pymta.api import IAuthenticator, IMTAPolicy, PolicyDecision
+from pymta.cache import CachingAuthenticator, CachingPolicy, LRUCache
+from pymta.model import Peer
+from pymta.test_util import CommandParserHelper, FakeClock
+
+
+class CountingPolicy(IMTAPolicy):
+    def __init__(self, blocked_ips=()):
+        self.blocked_ips = blocked_ips
+        self.calls = []
+
+    def accept_new_connection(self, peer):
+        self.calls.append(('accept_new_connection', peer.remote_ip))
+        return PolicyDecision(peer.remote_ip not in self.blocked_ips)
+
+    def accept_rcpt_to(self, new_recipient, message):
+        self.calls.append(('accept_rcpt_to', new_recipient))
+        if new_recipient.startswith('custom'):
+            return (False, (550, 'custom reply'))
+        return (not new_recipient.startswith('unknown'))
+
+
+RULES = {
+    'accept_new_connection': (lambda peer: peer.remote_ip, None),
+    'accept_rcpt_to': (lambda new_recipient, message: new_recipient, 60),
+}
+
+
+def test_lru_cache_evicts_least_recently_used_items():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1, ttl=10)
+    cache.set('b', 2, ttl=10)
+    assert cache.get('a') == 1
+    cache.set('c', 3, ttl=10)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_lru_cache_items_expire():
+    clock = FakeClock(now=1000.0)
+    cache = LRUCache(clock=clock)
+    cache.set('a', 1, ttl=10)
+    cache.set('b', 2, ttl=30)
+    clock.now += 20
+    assert cache.get('a', 'expired') == 'expired'
+    assert cache.get('b') == 2
+
+
+def test_caches_decisions_per_declared_key():
+    policy = CountingPolicy()
+    caching_policy = CachingPolicy(policy, RULES)
+    for i in range(3):
+        _cp = CommandParserHelper(policy=caching_policy)
+        _cp.send('HELO', 'localhost')
+        _cp.send('MAIL FROM', '<foo@example.com>')
+        _cp.send('RCPT TO', '<bar@example.com>')
+        _cp.send('RCPT TO', '<unknown@example.com>', expected_first_digit=5)
+
+    assert policy.calls == [
+        ('accept_new_connection', '127.0.0.1'),
+        ('accept_rcpt_to', 'bar@example.com'),
+        ('accept_rcpt_to', 'unknown@example.com'),
+    ]
+    assert caching_policy.hits == {'accept_new_connection': 2, 'accept_rcpt_to': 4}
+    assert caching_policy.misses == {'accept_new_connection': 1, 'accept_rcpt_to': 2}
+
+
+def test_cached_policy_decision_can_reject_connection():
+    caching_policy = CachingPolicy(CountingPolicy(blocked_ips=('127.0.0.1',)), RULES)
+    for i in range(2):
+        _cp = CommandParserHelper(policy=caching_policy)
+        assert not _cp.command_parser.open
+    assert caching_policy.hits['accept_new_connection'] == 1
+
+
+def test_does_not_cache_custom_replies():
+    policy = CountingPolicy()
+    caching_policy = CachingPolicy(policy, RULES)
+    for i in range(2):
+        _cp = CommandParserHelper(policy=caching_policy)
+        _cp.send('HELO', 'localhost')
+        _cp.send('MAIL FROM', '<foo@example.com>')
+        _cp.send('RCPT TO', '<custom@example.com>', expected_first_digit=5)
+        assert _cp.command_parser.replies[-1] == (550, 'custom reply')
+    assert policy.calls.count(('accept_rcpt_to', 'custom@example.com')) == 2
+
+
+def test_decisions_expire_after_ttl():
+    clock = FakeClock(now=1000.0)
+    policy = CountingPolicy()
+    caching_policy = CachingPolicy(policy, RULES, default_ttl=300, cache=LRUCache(clock=clock))
+    peer = Peer('127.0.0.1', 4567)
+
+    caching_policy.accept_new_connection(peer)
+    clock.now += 100
+    caching_policy.accept_rcpt_to('bar@example.com', None)
+    caching_policy.accept_new_connection(peer)
+    assert len(policy.calls) == 2
+    # rcpt to: 60 seconds, new connection: 300 seconds (default ttl)
+    clock.now += 100
+    caching_policy.accept_rcpt_to('bar@example.com', None)
+    caching_policy.accept_new_connection(peer)
+    assert policy.calls[2:] == [('accept_rcpt_to', 'bar@example.com')]
+
+
+def test_delegates_methods_without_rule():
+    class Policy(IMTAPolicy):
+        def max_message_size(self, peer):
+            return 1000
+    caching_policy = CachingPolicy(Policy(), {})
+    assert caching_policy.max_message_size(None) == 1000
+    assert 'SIZE 1000' in caching_policy.ehlo_lines(None)
+
+
+class CountingAuthenticator(IAuthenticator):
+    def __init__(self):
+        self.calls = 0
+
+    def authenticate(self, username, password, peer):
+        self.calls += 1
+        return username == password
+
+
+def test_caches_successful_and_failed_logins_with_different_ttl():
+    clock = FakeClock(now=1000.0)
+    authenticator = CountingAuthenticator()
+    caching_authenticator = CachingAuthenticator(authenticator, ttl=300, negative_ttl=5,
+                                                 cache=LRUCache(clock=clock))
+    for i in range(2):
+        assert caching_authenticator.authenticate('foo', 'foo', None)
+        assert not caching_authenticator.authenticate('foo', 'bar', None)
+    assert authenticator.calls == 2
+    assert (caching_authenticator.hits, caching_authenticator.misses) == (2, 2)
+
+    clock.now += 10
+    assert caching_authenticator.authenticate('foo', 'foo', None)
+    assert not caching_authenticator.authenticate('foo', 'bar', None)
+    assert authenticator.calls == 3
+
+
+def test_authentication_cache_does_not_store_plaintext_passwords():
+    caching_authenticator = CachingAuthenticator(CountingAuthenticator())
+    password = 'secret-%d' % id(caching_authenticator)
+    caching_authenticator.authenticate(password, password, None)
+    caching_authenticator.authenticate('foo', password + 'x', None)
+    items = list(caching_authenticator.cache._items.items())
+    assert len(items) == 2
+    for key, (expires_at, is_authenticated) in items:
+        assert len(key) == 32
+        assert password.encode('utf-8') not in key
+    assert password not in repr(vars(caching_authenticator))
+
+
+def test_authenticators_can_share_a_cache():
+    authenticator = CountingAuthenticator()
+    cache = LRUCache()
+    first = CachingAuthenticator(authenticator, cache=cache)
+    second = CachingAuthenticator(authenticator, cache=cache)
+    assert first.authenticate('foo', 'foo', None)
+    assert second.authenticate('foo', 'foo', None)
+    assert authenticator.calls == 1
+    assert (second.hits, second.misses) == (1, 0)
+    assert len(cache) == 1
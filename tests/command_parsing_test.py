@@ -6,7 +6,7 @@ from __future__ import print_function, unicode_literals
 from unittest import TestCase
 
 from pymta.api import IMTAPolicy
-from pymta.command_parser import SMTPCommandParser
+from pymta.command_parser import FrameBuffer, SMTPCommandParser, _encoded_replies
 from pymta.compat import b64encode, basestring
 from pymta.test_util import BlackholeDeliverer, DummyAuthenticator, MockChannel
 
@@ -86,6 +86,72 @@ class CommandParsingTest(TestCase):
         assert self.parser.is_in_command_mode()
         assert self.deliverer.received_messages.qsize() == 1
 
+    def test_processes_pipelined_commands(self):
+        self.send('EHLO foo\r\n')
+        self.send('MAIL FROM: foo@example.com\r\nRCPT TO: bar@example.com\r\n'
+                  'RCPT TO: baz@example.com\r\nDATA\r\n')
+        codes = [reply[:3] for reply in self.replies()[-4:]]
+        assert codes == ['250', '250', '250', '354']
+        assert self.parser.is_in_data_mode()
+
+        self.send('Subject: Foo\r\n\r\nbar\r\n.\r\nMAIL FROM: foo@example.com\r\nQUIT\r\nNOOP\r\n')
+        msg = self.received_message()
+        assert msg.msg_data == 'Subject: Foo\n\nbar'
+        assert msg.smtp_to == ['bar@example.com', 'baz@example.com']
+        codes = [reply[:3] for reply in self.replies()[-3:]]
+        # no reply for NOOP because the connection was closed after QUIT
+        assert codes == ['250', '250', '221']
+
+    def test_replies_are_sent_with_a_single_write(self):
+        channel = self.parser._channel
+        self.send('EHLO foo\r\n')
+        assert channel.nr_writes == 2
+        assert len(self.replies()) > 2
+
+        self.send('MAIL FROM: foo@example.com\r\nRCPT TO: bar@example.com\r\nDATA\r\n')
+        assert channel.nr_writes == 3
+        codes = [reply[:3] for reply in self.replies()[-3:]]
+        assert codes == ['250', '250', '354']
+
+    def _send_ehlo_mail_from_and_rcpt_to(self):
+        self.send('EHLO foo\r\nMAIL FROM: foo@example.com\r\nRCPT TO: bar@example.com\r\n')
+
+    def test_can_receive_message_via_bdat(self):
+        self._send_ehlo_mail_from_and_rcpt_to()
+        self.send(['BDAT 22\r\nSubject: Foo\r', '\n\r\n.foo\r\n'])
+        assert self.last_reply() == '250 22 octets received\r\n'
+        self.assert_no_messages_received()
+        # no terminator/transparency handling for BDAT
+        self.send('BDAT 7 LAST\r\n.\r\nbar\r')
+        assert self.last_reply() == '250 OK\r\n'
+        assert self.received_message().msg_data == 'Subject: Foo\n\n.foo\n.\nbar\r'
+        assert self.parser.is_in_command_mode()
+
+    def test_skips_chunk_data_if_bdat_was_rejected(self):
+        self.send('HELO foo\r\nMAIL FROM: foo@example.com\r\nRCPT TO: bar@example.com\r\n')
+        # BDAT requires ESMTP
+        self.send('BDAT 6 LAST\r\nNOOP\r\nNOOP\r\n')
+        codes = [reply[:3] for reply in self.replies()[-2:]]
+        assert codes == ['503', '250']
+        self.assert_no_messages_received()
+
+    def test_rset_aborts_bdat_transfer(self):
+        self._send_ehlo_mail_from_and_rcpt_to()
+        self.send('BDAT 3\r\nfooRSET\r\n')
+        assert self.last_reply() == '250 Reset OK\r\n'
+        self.send('BDAT 3 LAST\r\nbar')
+        assert self.last_reply().startswith('503 ')
+        self.assert_no_messages_received()
+
+    def test_does_not_cache_replies_with_client_input(self):
+        nr_cached_replies = len(_encoded_replies)
+        for i in range(3):
+            self.send('JUNK%d %s\r\n' % (i, 'x' * 100))
+            assert self.replies()[-1].startswith('500 unrecognized command "JUNK%d' % i)
+        self.send('NOOP\r\n')
+        assert self.replies()[-1] == '250 OK\r\n'
+        assert len(_encoded_replies) == nr_cached_replies
+
     def received_message(self):
         messages = self.deliverer.received_messages
         assert messages.qsize() == 1
@@ -110,6 +176,48 @@ class CommandParsingTest(TestCase):
         self.send(['HELO foo', '\r', '\n'])
         assert len(self.replies()) == 2
 
+    def test_accepts_bytes_and_memoryviews(self):
+        self.parser.process_new_data(b'HELO foo\r\n')
+        self.parser.process_new_data(memoryview(b'MAIL FROM: foo@example.com\r\n'))
+        assert self.last_reply() == '250 OK\r\n'
+
+    def test_can_receive_8bit_message_data(self):
+        self._send_helo_mail_from_and_rcpt_to()
+        body = 'Subject: Grüße\r\n\r\nÄpfel'
+        self.send([b'DATA\r\n', body.encode('utf-8') + b'\xff\r\n.\r\n'])
+        msg = self.received_message()
+        assert msg.msg_bytes == 'Subject: Grüße\n\nÄpfel'.encode('utf-8') + b'\xff'
+        assert self.last_reply() == '250 OK\r\n'
+
+    def test_accepts_utf8_addresses_with_smtputf8(self):
+        self.parser = self.init_command_parser(policy=IMTAPolicy())
+        self.send('EHLO foo\r\n')
+        assert '250-8BITMIME\r\n' in self.replies()
+        assert '250-SMTPUTF8\r\n' in self.replies()
+        self.send('MAIL FROM: <jörg@exämple.de> BODY=8BITMIME SMTPUTF8\r\n'
+                  'RCPT TO: <用户@例子.广告>\r\n')
+        codes = [reply[:3] for reply in self.replies()[-2:]]
+        assert codes == ['250', '250']
+
+    def test_rejects_utf8_addresses_without_smtputf8(self):
+        self.send('HELO foo\r\n')
+        self.send('MAIL FROM: <jörg@exämple.de>\r\n')
+        assert self.last_reply() == '553 5.6.7 Non-ASCII addresses require SMTPUTF8\r\n'
+
+        self.send('EHLO foo\r\n')
+        self.send('MAIL FROM: <jörg@exämple.de>\r\n')
+        assert self.last_reply().startswith('553 5.6.7 ')
+        self.send('MAIL FROM: <foo@example.com>\r\n')
+        assert self.last_reply() == '250 OK\r\n'
+        self.send('RCPT TO: <用户@例子.广告>\r\n')
+        assert self.last_reply().startswith('553 5.6.7 ')
+
+    def test_rejects_command_with_invalid_utf8(self):
+        self.send([b'HELO f\xffoo\r\n'])
+        assert self.last_reply() == '500 Syntax error - invalid UTF-8 in command\r\n'
+        self.send('HELO foo\r\n')
+        assert self.last_reply().startswith('250 ')
+
     def test_supports_transparency_for_lines_starting_with_a_dot(self):
         """SMTP transparency support - see RFC 821, section 4.5.2"""
         self._send_helo_mail_from_and_rcpt_to()
@@ -132,3 +240,21 @@ class CommandParsingTest(TestCase):
         self.send('\r\n.\r\n')
         self.assert_no_messages_received()
         assert self.last_reply().startswith('552 ')
+
+
+def test_framebuffer_returns_frame_without_terminator():
+    buffer_ = FrameBuffer()
+    buffer_.append(b'HELO foo\r\nNOOP')
+    assert buffer_.pop_frame(b'\r\n') == b'HELO foo'
+    assert buffer_.pop_frame(b'\r\n') is None
+    assert len(buffer_) == len(b'NOOP')
+
+def test_framebuffer_detects_terminator_split_over_several_packets():
+    buffer_ = FrameBuffer()
+    terminator = b'\r\n.\r\n'
+    for data in (b'Subject: Foo\r\n', b'\r\nbar\r', b'\n.', b'\r'):
+        buffer_.append(data)
+        assert buffer_.pop_frame(terminator) is None
+    buffer_.append(b'\n')
+    assert buffer_.pop_frame(terminator) == b'Subject: Foo\r\n\r\nbar'
+    assert len(buffer_) == 0
@@ -0,0 +1,51 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+import socket
+
+from pymta import config as config_module
+from pymta.command_parser import SMTPCommandParser
+from pymta.config import ServerConfig
+from pymta.test_util import BlackholeDeliverer, MockChannel
+
+
+def test_can_pin_hostname():
+    assert ServerConfig(hostname='mx.example.com').hostname == 'mx.example.com'
+
+
+def test_resolves_hostname_only_once(monkeypatch):
+    lookups = []
+    def fake_getfqdn(*args):
+        lookups.append(args)
+        return 'host.example.com'
+    monkeypatch.setattr(socket, 'getfqdn', fake_getfqdn)
+
+    config = ServerConfig()
+    channel = MockChannel()
+    parser = SMTPCommandParser(channel, '127.0.0.1', 12345, BlackholeDeliverer(),
+                               config=config)
+    parser.process_new_data(b'HELO foo\r\n')
+    parser.process_new_data(b'QUIT\r\n')
+
+    assert len(lookups) == 1
+    assert channel.replies == [
+        '220 host.example.com Hello 127.0.0.1\r\n',
+        '250 host.example.com\r\n',
+        '221 host.example.com closing connection\r\n',
+    ]
+
+
+def test_parsers_without_config_share_the_default_config(monkeypatch):
+    lookups = []
+    def fake_getfqdn(*args):
+        lookups.append(args)
+        return 'host.example.com'
+    monkeypatch.setattr(socket, 'getfqdn', fake_getfqdn)
+    monkeypatch.setattr(config_module, '_default_config', None)
+
+    parsers = [SMTPCommandParser(MockChannel(), '127.0.0.1', 12345, BlackholeDeliverer())
+               for i in range(3)]
+    assert len(lookups) == 1
+    assert parsers[0].config is parsers[1].config is parsers[2].config
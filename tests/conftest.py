@@ -0,0 +1,11 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+import sys
+
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # uses "async def"
+    collect_ignore.append('async_hooks_test.py')
+    collect_ignore.append('async_mta_test.py')
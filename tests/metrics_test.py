@@ -0,0 +1,138 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+import smtplib
+import sys
+import warnings
+
+import pytest
+from pymta.api import IMTAPolicy
+from pymta.command_parser import SMTPCommandParser
+from pymta.config import ServerConfig
+from pymta.metrics import MetricsRegistry
+from pymta.mta import PythonMTA
+from pymta.test_util import BlackholeDeliverer, DebuggingMTA, MockChannel, SMTPTestHelper
+
+
+def _sample_values(registry):
+    values = {}
+    for line in registry.export().splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            values[name] = value
+    return values
+
+
+def test_can_export_metrics_in_prometheus_format():
+    registry = MetricsRegistry()
+    registry.counter('requests_total', 'Number of requests', ('code',)).labels(250).inc(2)
+    registry.gauge('active', 'Active "things"').set(3)
+    histogram = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert registry.export() == '\n'.join([
+        '# HELP requests_total Number of requests',
+        '# TYPE requests_total counter',
+        'requests_total{code="250"} 2',
+        '# HELP active Active "things"',
+        '# TYPE active gauge',
+        'active 3',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3',
+    ]) + '\n'
+
+
+def test_returns_existing_metrics():
+    registry = MetricsRegistry()
+    counter = registry.counter('foo_total', 'Foo')
+    assert registry.counter('foo_total', 'Foo') is counter
+    with pytest.raises(ValueError):
+        registry.gauge('foo_total', 'Foo')
+    with pytest.raises(ValueError):
+        counter.labels('bar')
+
+
+def test_escapes_label_values():
+    registry = MetricsRegistry()
+    registry.counter('foo_total', 'Foo', ('name',)).labels('a"b\\c\n').inc()
+    assert 'foo_total{name="a\\"b\\\\c\\n"} 1\n' in registry.export()
+
+
+def test_sessions_record_metrics():
+    class Policy(IMTAPolicy):
+        def max_message_size(self, peer):
+            return 20
+
+        def accept_rcpt_to(self, new_recipient, message):
+            return not new_recipient.startswith('unknown')
+
+    registry = MetricsRegistry()
+    config = ServerConfig(hostname='localhost', metrics=registry)
+    parser = SMTPCommandParser(MockChannel(), '127.0.0.1', 4567, BlackholeDeliverer(),
+                               policy=Policy(), config=config)
+    parser.process_new_data(b'HELO foo\r\nMAIL FROM:<foo@example.com>\r\n')
+    parser.process_new_data(b'RCPT TO:<unknown@example.com>\r\nRCPT TO:<bar@example.com>\r\n')
+    parser.process_new_data(b'DATA\r\nSubject: Test\r\n\r\nfoo\r\n.\r\n')
+    parser.process_new_data(b'MAIL FROM:<foo@example.com>\r\nRCPT TO:<bar@example.com>\r\n')
+    parser.process_new_data(b'DATA\r\nSubject: Test\r\n\r\n' + b'x' * 100 + b'\r\n.\r\n')
+    assert _sample_values(registry)['pymta_sessions_active'] == '1'
+    parser.connection_closed()
+
+    values = _sample_values(registry)
+    assert values['pymta_sessions_active'] == '0'
+    assert values['pymta_sessions_total'] == '1'
+    assert values['pymta_command_duration_seconds_count{command="RCPT TO"}'] == '3'
+    assert values['pymta_policy_duration_seconds_count{method="accept_rcpt_to"}'] == '3'
+    assert values['pymta_policy_decisions_total{method="accept_rcpt_to",decision="reject"}'] == '1'
+    assert values['pymta_replies_total{code="550"}'] == '1'
+    assert values['pymta_replies_total{code="552"}'] == '1'
+    assert values['pymta_messages_total{result="accepted"}'] == '1'
+    assert values['pymta_messages_total{result="rejected"}'] == '1'
+    assert values['pymta_message_size_bytes_count'] == '2'
+
+
+def _send_message_via(mta_class):
+    registry = MetricsRegistry()
+    mta_helper = SMTPTestHelper(mta_class=mta_class,
+                                config=ServerConfig(hostname='localhost', metrics=registry))
+    host, port = mta_helper.start_mta()
+    try:
+        connection = smtplib.SMTP(host, port)
+        connection.sendmail('from@example.com', 'to@example.com', 'Subject: Test\n\nfoo')
+        connection.quit()
+    finally:
+        mta_helper.stop_mta()
+    return _sample_values(registry)
+
+
+def test_collects_metrics_without_worker_processes():
+    values = _send_message_via(DebuggingMTA)
+    # one additional session when the helper checks if the MTA is ready
+    assert values['pymta_sessions_total'] == '2'
+    assert values['pymta_messages_total{result="accepted"}'] == '1'
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason='AsyncPythonMTA uses "async def"')
+def test_collects_metrics_with_async_mta():
+    from pymta.async_mta import AsyncPythonMTA
+    values = _send_message_via(AsyncPythonMTA)
+    assert values['pymta_sessions_total'] == '2'
+    assert values['pymta_messages_total{result="accepted"}'] == '1'
+
+
+def test_warns_if_metrics_are_used_with_worker_processes():
+    config = ServerConfig(hostname='localhost', metrics=MetricsRegistry())
+    mta = PythonMTA('localhost', 0, BlackholeDeliverer, config=config)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with pytest.raises(RuntimeWarning):
+            mta.serve_forever()
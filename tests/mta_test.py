@@ -0,0 +1,152 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+import multiprocessing
+import os
+import smtplib
+import socket
+import threading
+import time
+
+import pytest
+from pymta import PythonMTA
+from pymta.api import IMTAPolicy, PolicyDecision
+from pymta.scoreboard import Scoreboard
+from pymta.test_util import BlackholeDeliverer, SMTPTestHelper, free_port
+
+
+class PidPolicy(IMTAPolicy):
+    "Reply to HELO with the PID of the worker process serving the connection."
+    def accept_helo(self, helo_string, message):
+        return PolicyDecision(True, (250, 'pid %d' % os.getpid()))
+
+
+def _serve(mta_kwargs, port, stop_event):
+    mta = PythonMTA('localhost', port, BlackholeDeliverer, **mta_kwargs)
+    def wait_for_shutdown():
+        stop_event.wait()
+        mta.shutdown_server()
+    waiter = threading.Thread(target=wait_for_shutdown)
+    waiter.daemon = True
+    waiter.start()
+    mta.serve_forever()
+
+
+def _connect(port):
+    for i in range(50):
+        try:
+            return smtplib.SMTP('localhost', port, timeout=5)
+        except socket.error:
+            time.sleep(0.1)
+    raise AssertionError('MTA not reachable on port %d' % port)
+
+
+def _start_mta(**mta_kwargs):
+    port = free_port()
+    stop_event = multiprocessing.Event()
+    process = multiprocessing.Process(target=_serve, args=(mta_kwargs, port, stop_event))
+    process.start()
+    return port, stop_event, process
+
+
+def _stop_mta(stop_event, process):
+    stop_event.set()
+    process.join(10)
+    if process.is_alive():
+        process.terminate()
+        raise AssertionError('MTA did not shut down in time')
+
+
+@pytest.mark.skipif(not hasattr(socket, 'SO_REUSEPORT'), reason='SO_REUSEPORT not available')
+def test_workers_can_use_their_own_listening_sockets():
+    port, stop_event, process = _start_mta(reuse_port=True, policy_class=PidPolicy)
+    worker_pids = set()
+    try:
+        # The kernel distributes the connections between all listening
+        # sockets (based on a hash) so several workers should see some of
+        # these (all of them are idle and there are 5 workers by default).
+        for i in range(50):
+            connection = _connect(port)
+            code, replytext = connection.helo('foo')
+            assert code == 250
+            worker_pids.add(replytext)
+            connection.quit()
+            if len(worker_pids) > 1:
+                break
+    finally:
+        _stop_mta(stop_event, process)
+    assert len(worker_pids) > 1
+
+
+class FakeProcess(object):
+    def is_alive(self):
+        return True
+
+
+def test_workers_with_own_listening_sockets_are_not_retired():
+    mta = PythonMTA('localhost', free_port(), BlackholeDeliverer, reuse_port=True,
+                    initial_workers=3, min_spare_workers=1, max_spare_workers=1)
+    mta._scoreboard = Scoreboard(3)
+    slots = [mta._scoreboard.allocate_slot() for i in range(3)]
+    mta._workers = dict((slot.index, (slot, FakeProcess())) for slot in slots)
+    assert mta._accept_token is None
+
+    mta._maintain_pool(None)
+    assert not any(mta._scoreboard.is_retiring(slot) for slot in slots)
+
+
+def test_adaptive_pool_starts_new_workers_when_busy():
+    port, stop_event, process = _start_mta(initial_workers=1, min_spare_workers=1,
+                                           max_spare_workers=1, max_workers=4)
+    try:
+        # Only one worker is running initially. The pool must start new
+        # workers as the existing ones become busy so that all of these
+        # connections are served at the same time eventually.
+        connections = [_connect(port) for i in range(3)]
+        for connection in connections:
+            code, replytext = connection.helo('foo')
+            assert code == 250
+        for connection in connections:
+            connection.quit()
+    finally:
+        _stop_mta(stop_event, process)
+
+
+def test_worker_threads_serve_connections_concurrently():
+    mta_helper = SMTPTestHelper(threads_per_worker=3)
+    mta_helper.start_mta()
+    try:
+        connections = [_connect(mta_helper.listen_port) for i in range(3)]
+        for connection in connections:
+            code, replytext = connection.helo('foo')
+            assert code == 250
+        for i, connection in enumerate(connections):
+            connection.sendmail('from@example.com', 'to%d@example.com' % i, 'Subject: Test\n\n')
+            connection.quit()
+        assert mta_helper.get_received_messages().qsize() == 3
+    finally:
+        mta_helper.stop_mta()
+
+
+def test_shutdown_stops_idle_workers_immediately():
+    port, stop_event, process = _start_mta(initial_workers=3)
+    try:
+        connection = _connect(port)
+        connection.helo('foo')
+        connection.quit()
+    finally:
+        start = time.time()
+        _stop_mta(stop_event, process)
+    assert time.time() - start < 0.5
+
+
+def test_shutdown_server_waits_until_server_stopped():
+    mta_helper = SMTPTestHelper(threads_per_worker=2)
+    mta_helper.start_mta()
+    start = time.time()
+    mta_helper.mta.shutdown_server(timeout_seconds=5)
+    assert time.time() - start < 0.5
+    mta_helper.mta_thread.join(0.5)
+    assert not mta_helper.mta_thread.is_alive()
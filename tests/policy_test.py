@@ -116,6 +116,22 @@ def test_size_limit_messages_can_be_rejected():
     assert code == 552
     assert reply_text == 'message exceeds fixed maximum message size'
 
+def test_is_allowed_returns_decision_and_response_sent():
+    class Policy(IMTAPolicy):
+        def accept_from(self, sender, message):
+            return sender == 'foo@example.com'
+
+        def accept_rcpt_to(self, new_recipient, message):
+            return PolicyDecision(False, (553, 'no such user'))
+    _cp = CommandParserHelper(policy=Policy())
+    session = _cp.session
+    assert session.is_allowed('accept_from', 'foo@example.com', None) == (True, False)
+    assert session.is_allowed('accept_from', 'bar@example.com', None) == (False, False)
+    assert session.is_allowed('accept_rcpt_to', 'foo@example.com', None) == (False, True)
+    assert _cp.last_reply() == (553, 'no such user')
+    assert CommandParserHelper().session.is_allowed('accept_data', None) == (True, False)
+
+
 def test_server_deals_gracefully_with_double_close_because_of_faulty_policy():
     class DoubleCloseConnectionPolicy(IMTAPolicy):
         def accept_helo(self, helo_string, message):
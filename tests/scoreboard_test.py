@@ -0,0 +1,38 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+from pymta.scoreboard import Scoreboard
+
+
+def test_can_allocate_slots_until_full():
+    scoreboard = Scoreboard(2)
+    first = scoreboard.allocate_slot()
+    second = scoreboard.allocate_slot()
+    assert (first.index, second.index) == (0, 1)
+    assert scoreboard.allocate_slot() is None
+
+    scoreboard.release_slot(first)
+    assert scoreboard.allocate_slot().index == 0
+
+def test_workers_report_their_status():
+    scoreboard = Scoreboard(1)
+    slot = scoreboard.allocate_slot()
+    assert not scoreboard.is_busy(slot)
+    slot.mark_busy()
+    assert scoreboard.is_busy(slot)
+    slot.mark_idle()
+    assert not scoreboard.is_busy(slot)
+
+def test_can_request_retirement():
+    scoreboard = Scoreboard(1)
+    slot = scoreboard.allocate_slot()
+    assert not slot.should_retire()
+    scoreboard.request_retirement(slot)
+    assert slot.should_retire()
+    assert scoreboard.is_retiring(slot)
+
+    scoreboard.release_slot(slot)
+    new_slot = scoreboard.allocate_slot()
+    assert not new_slot.should_retire()
@@ -0,0 +1,156 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+import os
+import smtplib
+import threading
+import time
+
+from pymta.api import IMessageDeliverer
+from pymta.model import Message, Peer
+from pymta.spool import DeliveryWorker, MessageSpool, SpoolDeliverer
+from pymta.test_util import SMTPTestHelper
+from pymta.wakeup import Notifier, WakeupSignal
+
+
+rfc822_msg = 'Subject: Test\n\nJust testing...'
+
+
+class CollectingDeliverer(IMessageDeliverer):
+    failures = 0
+    messages = []
+
+    def new_message_accepted(self, msg):
+        if self.__class__.failures > 0:
+            self.__class__.failures -= 1
+            raise IOError('downstream not available')
+        self.__class__.messages.append(msg)
+
+
+def _spool(tmpdir):
+    spool = MessageSpool(str(tmpdir))
+    spool.recover()
+    return spool
+
+
+def _store_message(spool, data=b'Subject: Foo\n\nbar', commit=True, notifier=None):
+    msg = Message(Peer('127.0.0.1', 4567), smtp_helo='client.example.com',
+                  smtp_from='foo@example.com', smtp_to=['bar@example.com'])
+    deliverer = SpoolDeliverer(spool, notifier=notifier)
+    deliverer.begin_message(msg)
+    deliverer.write_chunk(msg, data)
+    if commit:
+        deliverer.commit_message(msg)
+    return deliverer, msg
+
+
+def _files(spool, name):
+    return os.listdir(os.path.join(spool.path, name))
+
+
+def test_delivers_spooled_messages(tmpdir):
+    spool = _spool(tmpdir)
+    _store_message(spool, data='Grüße'.encode('utf-8'))
+    assert len(_files(spool, 'new')) == 1
+
+    CollectingDeliverer.messages = []
+    worker = DeliveryWorker(spool, CollectingDeliverer)
+    assert worker.deliver_next_message()
+    assert not worker.deliver_next_message()
+
+    msg, = CollectingDeliverer.messages
+    assert (msg.smtp_from, msg.smtp_to) == ('foo@example.com', ['bar@example.com'])
+    assert (msg.peer.remote_ip, msg.smtp_helo) == ('127.0.0.1', 'client.example.com')
+    assert msg.msg_data == 'Grüße'
+    assert _files(spool, 'new') == []
+    assert _files(spool, 'cur') == []
+
+
+def test_aborted_messages_are_discarded(tmpdir):
+    spool = _spool(tmpdir)
+    deliverer, msg = _store_message(spool, commit=False)
+    deliverer.abort_message(msg)
+    assert _files(spool, 'tmp') == []
+    assert _files(spool, 'new') == []
+
+
+def test_defers_message_if_delivery_fails(tmpdir):
+    spool = _spool(tmpdir)
+    _store_message(spool)
+    CollectingDeliverer.messages = []
+    CollectingDeliverer.failures = 1
+
+    worker = DeliveryWorker(spool, CollectingDeliverer, retry_interval=0)
+    assert worker.deliver_next_message()
+    assert CollectingDeliverer.messages == []
+    assert len(_files(spool, 'new')) == 1
+    assert worker.deliver_next_message()
+    assert len(CollectingDeliverer.messages) == 1
+
+
+def test_claims_batch_of_oldest_messages(tmpdir):
+    spool = _spool(tmpdir)
+    for i in range(3):
+        _store_message(spool)
+    deferred = spool.claim_next_message()
+    spool.defer_message(deferred, 3600)
+
+    filenames = spool.claim_messages(10)
+    assert len(filenames) == 2
+    assert filenames == sorted(filenames)
+    assert deferred not in filenames
+    assert spool.claim_messages(10) == []
+
+
+def test_idle_worker_is_woken_up_by_new_message(tmpdir):
+    spool = _spool(tmpdir)
+    CollectingDeliverer.messages = []
+    notifier = Notifier()
+    stop_signal = WakeupSignal()
+    worker = DeliveryWorker(spool, CollectingDeliverer, poll_interval=60, notifier=notifier)
+    thread = threading.Thread(target=worker.run, args=(stop_signal,))
+    thread.start()
+    try:
+        _store_message(spool, notifier=notifier)
+        for i in range(50):
+            if CollectingDeliverer.messages:
+                break
+            time.sleep(0.1)
+        assert len(CollectingDeliverer.messages) == 1
+    finally:
+        stop_signal.set()
+        thread.join(5)
+    assert not thread.is_alive()
+    notifier.close()
+    stop_signal.close()
+
+
+def test_recovers_after_crash(tmpdir):
+    spool = _spool(tmpdir)
+    _store_message(spool)
+    deliverer, msg = _store_message(spool, commit=False)
+    # crash while receiving the second message/delivering the first one
+    deliverer._open_messages[id(msg)][1].close()
+    assert spool.claim_next_message() is not None
+
+    spool.recover()
+    assert _files(spool, 'tmp') == []
+    assert _files(spool, 'cur') == []
+    assert len(_files(spool, 'new')) == 1
+
+
+def test_mta_delivers_spooled_messages_in_background(tmpdir):
+    mta_helper = SMTPTestHelper(spool=MessageSpool(str(tmpdir)), delivery_workers=1)
+    mta_helper.start_mta()
+    try:
+        connection = smtplib.SMTP(mta_helper.hostname, mta_helper.listen_port)
+        connection.sendmail('from@example.com', 'to@example.com', rfc822_msg)
+        connection.quit()
+        # the BlackholeDeliverer is used by the delivery worker
+        msg = mta_helper.get_received_messages().get(timeout=5)
+    finally:
+        mta_helper.stop_mta()
+    assert msg.msg_data == rfc822_msg
+    assert msg.smtp_to == ['to@example.com']
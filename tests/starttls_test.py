@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+import os
+import smtplib
+import ssl
+
+import pytest
+from pymta.api import IMTAPolicy
+from pymta.config import ServerConfig, build_tls_context
+from pymta.test_util import SMTPTestHelper, build_command_parser
+
+
+CERTFILE = os.path.join(os.path.dirname(__file__), 'tls_cert.pem')
+rfc822_msg = 'Subject: Test\n\nJust testing...'
+
+
+def _config(tls_context):
+    return ServerConfig(hostname='localhost', tls_context=tls_context)
+
+
+def test_announces_starttls_only_if_tls_is_configured():
+    parser = build_command_parser(policy=IMTAPolicy(), config=_config(None))
+    parser.process_new_data(b'EHLO foo\r\n')
+    assert '250-STARTTLS\r\n' not in parser._channel.replies
+    parser.process_new_data(b'STARTTLS\r\n')
+    assert parser._channel.replies[-1] == '454 TLS not available\r\n'
+
+    parser = build_command_parser(policy=IMTAPolicy(), config=_config(object()))
+    parser.process_new_data(b'EHLO foo\r\n')
+    assert '250-STARTTLS\r\n' in parser._channel.replies
+
+
+def test_help_lists_starttls_only_if_tls_is_configured():
+    parser = build_command_parser(policy=IMTAPolicy(), config=_config(None))
+    parser.process_new_data(b'HELP\r\n')
+    assert 'STARTTLS' not in parser._channel.replies[-1].split()
+
+    parser = build_command_parser(policy=IMTAPolicy(), config=_config(object()))
+    parser.process_new_data(b'HELP\r\n')
+    assert 'STARTTLS' in parser._channel.replies[-1].split()
+
+
+def test_starttls_resets_session_and_discards_pipelined_input():
+    tls_context = object()
+    parser = build_command_parser(policy=IMTAPolicy(), config=_config(tls_context))
+    channel = parser._channel
+    parser.process_new_data(b'EHLO foo\r\nSTARTTLS\r\nMAIL FROM:<foo@example.com>\r\n')
+    assert channel.replies[-1] == '220 Ready to start TLS\r\n'
+    assert channel.tls_context is tls_context
+
+    parser.process_new_data(b'MAIL FROM:<foo@example.com>\r\n')
+    assert channel.replies[-1].startswith('503 ')
+    del channel.replies[:]
+    parser.process_new_data(b'EHLO foo\r\n')
+    assert '250-STARTTLS\r\n' not in channel.replies
+    parser.process_new_data(b'MAIL FROM:<foo@example.com>\r\n')
+    assert channel.replies[-1] == '250 OK\r\n'
+
+
+def _mta_classes():
+    mta_classes = ['pymta.test_util.DebuggingMTA']
+    try:
+        import asyncio  # noqa: F401 (imported but unused)
+        mta_classes.append('pymta.async_mta.AsyncPythonMTA')
+    except ImportError:
+        pass
+    return mta_classes
+
+
+@pytest.mark.parametrize('mta_class_name', _mta_classes())
+def test_can_send_message_via_starttls(mta_class_name):
+    module_name, class_name = mta_class_name.rsplit('.', 1)
+    mta_class = getattr(__import__(module_name, fromlist=[class_name]), class_name)
+    config = ServerConfig(hostname='localhost', tls_context=build_tls_context(CERTFILE))
+    mta_helper = SMTPTestHelper(mta_class=mta_class, config=config)
+    mta_helper.start_mta()
+    try:
+        client_context = ssl.create_default_context(cafile=CERTFILE)
+        connection = smtplib.SMTP(mta_helper.hostname, mta_helper.listen_port)
+        try:
+            connection.ehlo()
+            assert connection.has_extn('starttls')
+            code, reply_text = connection.starttls(context=client_context)
+            assert code == 220
+            connection.ehlo()
+            assert not connection.has_extn('starttls')
+            connection.sendmail('from@example.com', 'to@example.com', rfc822_msg)
+        finally:
+            connection.quit()
+    finally:
+        mta_helper.stop_mta()
+
+    queue = mta_helper.get_received_messages()
+    assert queue.qsize() == 1
+    assert queue.get().msg_data == rfc822_msg
@@ -140,6 +140,15 @@ def test_transition_can_also_set_flags():
     state.execute('process')
     assert state.is_set('foo')
 
+def test_transition_can_unset_flags():
+    state = StateMachine(initial_state='new')
+    state.add('new', 'processed', 'process', operations=('set_foo',))
+    state.add('processed', 'new', 'reset', operations=('unset_foo',))
+
+    state.execute('process')
+    state.execute('reset')
+    assert not state.is_set('foo')
+
 def test_can_add_conditional_transition():
     state = StateMachine(initial_state='new')
     state.add('new', 'authenticated', 'authenticate', condition='if_tls')
@@ -175,3 +184,61 @@ def test_can_also_specify_negative_flag_checks_for_transitions():
     with pytest.raises(StateMachineError):
         state.execute('use_tls')
     state.execute('authenticate')
+
+# --- copies -------------------------------------------------------------
+
+def test_copy_shares_transitions_but_not_state_or_flags():
+    state = StateMachine(initial_state='new')
+    state.add('new', 'new', 'use_tls', operations=('set_tls',))
+    state.add('new', 'processed', 'process')
+
+    first = state.copy()
+    second = state.copy()
+    first.execute('use_tls')
+    first.execute('process')
+    assert first.state() == 'processed'
+    assert first.is_set('tls')
+    assert second.state() == 'new'
+    assert not second.is_set('tls')
+    assert state.state() == 'new'
+
+def test_copy_uses_default_handler_for_transitions_without_handler():
+    calls = []
+    state = StateMachine(initial_state='new')
+    state.add('new', 'processed', 'process')
+    state.add('processed', 'new', 'reset', handler=lambda *args: calls.append(('reset', args)))
+
+    copy = state.copy(default_handler=lambda *args: calls.append(('default', args)))
+    copy.execute('process')
+    copy.execute('reset')
+    assert calls == [
+        ('default', ('new', 'processed', 'process')),
+        ('reset', ('processed', 'new', 'reset')),
+    ]
+
+# --- finalization -------------------------------------------------------
+
+def test_can_not_add_transitions_after_finalization():
+    state = StateMachine(initial_state='new')
+    state.add('new', 'processed', 'process')
+    state.finalize()
+    with pytest.raises(StateMachineDefinitionError):
+        state.add('processed', 'new', 'reset')
+    state.execute('process')
+    assert state.state() == 'processed'
+
+def test_transitions_added_after_execution_are_recognized():
+    state = StateMachine(initial_state='new')
+    state.add('new', 'processed', 'process')
+    state.execute('process')
+    state.add('processed', 'done', 'finish')
+    assert state.allowed_actions() == set(('finish',))
+    state.execute('finish')
+    assert state.state() == 'done'
+
+def test_reject_invalid_operations_and_conditions():
+    state = StateMachine(initial_state='new')
+    with pytest.raises(StateMachineDefinitionError):
+        state.add('new', 'new', 'use_tls', operations=('tls',))
+    with pytest.raises(StateMachineDefinitionError):
+        state.add('new', 'new', 'use_tls', condition='tls')
@@ -0,0 +1,136 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+from pymta.api import IMTAPolicy, IStreamingMessageDeliverer
+from pymta.config import ServerConfig
+from pymta.delivery import SpoolingDeliverer
+from pymta.model import Message, Peer
+from pymta.test_util import BlackholeDeliverer, build_command_parser
+
+
+class RecordingDeliverer(IStreamingMessageDeliverer):
+    def __init__(self):
+        self.events = []
+
+    def begin_message(self, msg):
+        self.events.append(('begin', None))
+
+    def write_chunk(self, msg, chunk):
+        self.events.append(('chunk', chunk))
+
+    def commit_message(self, msg):
+        self.events.append(('commit', msg.msg_data))
+
+    def abort_message(self, msg):
+        self.events.append(('abort', None))
+
+    def received_data(self):
+        return b''.join([data for (event, data) in self.events if event == 'chunk'])
+
+    def event_names(self):
+        return [event for (event, data) in self.events]
+
+
+def _build_parser(deliverer, policy=None, config=None):
+    parser = build_command_parser(deliverer, policy=policy, config=config)
+    for command in ('HELO foo', 'MAIL FROM: foo@example.com', 'RCPT TO: bar@example.com', 'DATA'):
+        parser.process_new_data(command + '\r\n')
+    return parser
+
+
+def test_streaming_deliverer_receives_message_in_chunks():
+    deliverer = RecordingDeliverer()
+    parser = _build_parser(deliverer)
+    parser.process_new_data(b'Subject: foo\r\n\r\n')
+    parser.process_new_data(b'..bar\r\nbaz')
+    parser.process_new_data(b'\r\n.\r\n')
+
+    assert deliverer.event_names()[0] == 'begin'
+    assert deliverer.event_names()[-1] == 'commit'
+    assert deliverer.event_names().count('chunk') > 1
+    assert deliverer.received_data() == b'Subject: foo\n\n.bar\nbaz'
+    assert parser._channel.replies[-1] == '250 OK\r\n'
+    assert parser.is_in_command_mode()
+
+
+def test_streaming_deliverer_is_notified_when_client_disconnects():
+    deliverer = RecordingDeliverer()
+    parser = _build_parser(deliverer)
+    parser.process_new_data(b'Subject: foo\r\n')
+    parser.connection_closed()
+
+    assert deliverer.event_names() == ['begin', 'chunk', 'abort']
+
+
+def test_message_is_spooled_if_policy_checks_message_data():
+    class ContentPolicy(IMTAPolicy):
+        def accept_msgdata(self, msgdata, message):
+            return ('spam' not in msgdata)
+
+    deliverer = RecordingDeliverer()
+    parser = _build_parser(deliverer, policy=ContentPolicy())
+    parser.process_new_data(b'Subject: spam\r\n.\r\n')
+
+    assert deliverer.event_names() == ['begin', 'chunk', 'abort']
+    assert parser._channel.replies[-1].startswith('550 ')
+
+
+def test_plain_deliverers_still_get_complete_message():
+    deliverer = BlackholeDeliverer()
+    parser = _build_parser(deliverer)
+    parser.process_new_data(b'Subject: foo\r\n')
+    parser.process_new_data(b'\r\nbar\r\n.\r\n')
+
+    msg = deliverer.received_messages.get(block=False)
+    assert msg.msg_data == 'Subject: foo\n\nbar'
+    assert msg.msg_file is None
+
+
+def test_message_data_is_not_decoded_if_policy_does_not_check_it():
+    class RecipientPolicy(IMTAPolicy):
+        def accept_rcpt_to(self, new_recipient, message):
+            return True
+
+    class DecodeCheckingDeliverer(BlackholeDeliverer):
+        def new_message_accepted(self, msg):
+            # only the raw bytes were read from the spool file
+            assert msg._msg_data is None
+            super(DecodeCheckingDeliverer, self).new_message_accepted(msg)
+
+    deliverer = DecodeCheckingDeliverer()
+    parser = _build_parser(deliverer, policy=RecipientPolicy())
+    parser.process_new_data(b'Subject: foo\r\n\r\nbar\r\n.\r\n')
+
+    assert parser._channel.replies[-1] == '250 OK\r\n'
+    assert deliverer.received_messages.get(block=False).msg_bytes == b'Subject: foo\n\nbar'
+
+
+def test_spooling_deliverer_writes_big_messages_to_disk():
+    msg = Message(Peer('127.0.0.1', 12345))
+    deliverer = SpoolingDeliverer(BlackholeDeliverer(), spool_threshold=10)
+    deliverer.begin_message(msg)
+    deliverer.write_chunk(msg, b'x' * 20)
+    assert msg.msg_file._rolled
+    assert msg.msg_data == 'x' * 20
+
+    deliverer.abort_message(msg)
+    assert msg.msg_file is None
+
+
+def test_spool_threshold_can_be_configured():
+    class ContentPolicy(IMTAPolicy):
+        def accept_msgdata(self, msgdata, message):
+            return True
+
+    class SpoolCheckingDeliverer(RecordingDeliverer):
+        def commit_message(self, msg):
+            self.events.append(('commit', msg.msg_file._rolled))
+
+    deliverer = SpoolCheckingDeliverer()
+    config = ServerConfig(hostname='localhost', spool_threshold=10)
+    parser = _build_parser(deliverer, policy=ContentPolicy(), config=config)
+    parser.process_new_data(b'Subject: foo\r\n\r\n' + b'x' * 20 + b'\r\n.\r\n')
+
+    assert deliverer.events[-1] == ('commit', True)
@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+from pymta.api import IAuthenticator, IMTAPolicy
+from pymta.compat import b64encode
+from pymta.config import ServerConfig
+from pymta.test_util import FakeClock, build_command_parser
+from pymta.tracing import SessionTracer
+
+
+class Policy(IMTAPolicy):
+    def accept_rcpt_to(self, new_recipient, message):
+        return not new_recipient.startswith('unknown')
+
+
+class Authenticator(IAuthenticator):
+    def authenticate(self, username, password, peer):
+        return username == password
+
+
+def _parser(traces, policy=None, clock=None):
+    # by default every clock call advances the time by one second
+    tracer = SessionTracer(traces.append, clock=clock or FakeClock(tick=1))
+    config = ServerConfig(hostname='localhost', tracer=tracer)
+    return build_command_parser(policy=policy, authenticator=Authenticator(), config=config)
+
+
+def test_passes_trace_to_callback_when_connection_is_closed():
+    traces = []
+    parser = _parser(traces, policy=Policy())
+    parser.process_new_data(b'EHLO foo\r\n')
+    parser.process_new_data(('AUTH PLAIN %s\r\n' % b64encode('\x00foo\x00foo')).encode('ascii'))
+    parser.process_new_data(b'MAIL FROM:<foo@example.com>\r\nRCPT TO:<unknown@example.com>\r\n')
+    parser.process_new_data(b'RCPT TO:<bar@example.com>\r\nDATA\r\n')
+    parser.process_new_data(b'Subject: Test\r\n\r\nfoo\r\n.\r\n')
+    assert traces == []
+    parser.connection_closed()
+    parser.connection_closed()
+
+    trace, = traces
+    assert (trace.remote_ip, trace.remote_port) == ('127.0.0.1', 4567)
+    assert [phase for phase, start, end in trace.phases] == [
+        'policy:accept_new_connection', 'greeting',
+        'policy:accept_ehlo', 'policy:accept_auth_plain', 'authenticator',
+        'policy:accept_from', 'policy:accept_rcpt_to', 'policy:accept_rcpt_to',
+        'policy:accept_data', 'envelope',
+        'data', 'policy:accept_msgdata', 'deliverer',
+    ]
+    for phase, start, end in trace.phases:
+        assert trace.start <= start < end <= trace.end
+    durations = trace.durations()
+    assert durations['policy:accept_rcpt_to'] == 2
+    assert list(durations)[:2] == ['policy:accept_new_connection', 'greeting']
+
+
+def test_traces_bdat_without_policy():
+    traces = []
+    clock = FakeClock()
+    parser = _parser(traces, clock=clock)
+    clock.now = 1
+    parser.process_new_data(b'EHLO foo\r\nMAIL FROM:<foo@example.com>\r\n')
+    clock.now = 3
+    parser.process_new_data(b'RCPT TO:<bar@example.com>\r\nBDAT 3\r\nfoo')
+    clock.now = 10
+    parser.process_new_data(b'BDAT 3 LAST\r\nbar')
+    clock.now = 11
+    parser.connection_closed()
+
+    trace, = traces
+    assert (trace.start, trace.end) == (0, 11)
+    # all chunks are part of the data phase
+    assert trace.phases == [
+        ('greeting', 0, 0),
+        ('envelope', 1, 3),
+        ('data', 3, 10),
+        ('deliverer', 10, 10),
+    ]
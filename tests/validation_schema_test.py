@@ -9,7 +9,14 @@ import pytest
 from pycerberus.errors import InvalidDataError
 from pycerberus.validators import StringValidator
 from pymta.compat import b64encode
-from pymta.validation import AuthPlainSchema, MailFromSchema, SMTPCommandArgumentsSchema
+from pymta.validation import (
+    AuthPlainSchema,
+    HeloSchema,
+    MailFromSchema,
+    RcptToSchema,
+    SMTPCommandArgumentsSchema,
+    validate_arguments,
+)
 
 
 class CommandWithoutParametersTest(TestCase):
@@ -156,6 +163,28 @@ class MailFromSchemaTest(TestCase):
         e = exc_ctx.value
         assert e.msg() == 'Invalid size: Must be 1 or greater.'
 
+    # --------------------------------------------------------------------------
+    # 8BITMIME/SMTPUTF8 extensions
+
+    def test_can_extract_body_parameter(self):
+        cmd_parameters = self.process('foo@example.com BODY=8bitmime', esmtp=True)
+        assert _subdict(cmd_parameters, {'body'}) == {'body': '8BITMIME'}
+
+    def test_reject_unknown_body_type(self):
+        with pytest.raises(InvalidDataError) as exc_ctx:
+            self.process('foo@example.com BODY=BINARYMIME', esmtp=True)
+        assert exc_ctx.value.msg() == 'Invalid body type: "BINARYMIME"'
+
+    def test_accepts_smtputf8_parameter_without_value(self):
+        cmd_parameters = self.process('foo@example.com SMTPUTF8', esmtp=True)
+        assert _subdict(cmd_parameters, {'smtputf8'}) == {'smtputf8': True}
+        cmd_parameters = self.process('foo@example.com', esmtp=True)
+        assert _subdict(cmd_parameters, {'smtputf8'}) == {'smtputf8': False}
+
+    def test_accepts_internationalized_email_addresses(self):
+        cmd_parameters = self.process('<jörg@exämple.de> SMTPUTF8', esmtp=True)
+        assert _subdict(cmd_parameters, {'email'}) == {'email': 'jörg@exämple.de'}
+
     def test_reject_non_numeric_size_parameter(self):
         input_command = 'foo@example.com SIZE=fnord'
         with pytest.raises(InvalidDataError):
@@ -206,3 +235,42 @@ def _subdict(src_dict, keys):
         if key in src_dict:
             subdict[key] = src_dict[key]
     return subdict
+
+
+@pytest.mark.parametrize('schema_class, value', [
+    (SMTPCommandArgumentsSchema, ''),
+    (SMTPCommandArgumentsSchema, 'fnord'),
+    (HeloSchema, 'foo.example.com'),
+    (HeloSchema, ''),
+    (HeloSchema, 'foo bar'),
+    (RcptToSchema, 'foo@example.com'),
+    (RcptToSchema, '<foo.bar+baz@mail.example.com>'),
+    (RcptToSchema, '<foo@example.com'),
+    (RcptToSchema, 'foo@example..com'),
+    (RcptToSchema, '<>'),
+    (MailFromSchema, '<foo@example.com>'),
+    (MailFromSchema, '<foo@example.com> SIZE=1000'),
+    (MailFromSchema, '<foo@example.com> size=1000'),
+    (MailFromSchema, '<foo@example.com> SIZE=0'),
+    (MailFromSchema, '<foo@example.com> FOO=bar'),
+    (MailFromSchema, '<foo@example.com> SIZE=1000 BODY=8BITMIME SMTPUTF8'),
+    (MailFromSchema, '<foo@example.com> body=7bit'),
+    (MailFromSchema, '<foo@example.com> SMTPUTF8 BODY=8BITMIME'),
+    (MailFromSchema, '<foo@example.com> BODY=BINARYMIME'),
+    (MailFromSchema, '<jörg@exämple.de> SMTPUTF8'),
+    (MailFromSchema, 'foo@@example.com'),
+])
+@pytest.mark.parametrize('esmtp', [True, False])
+def test_fast_path_returns_same_results_as_pycerberus(schema_class, value, esmtp):
+    def _validate(validator):
+        try:
+            return validator(value, dict(esmtp=esmtp))
+        except InvalidDataError as e:
+            return ('error', e.msg())
+
+    expected = _validate(lambda value, context: schema_class().process(value, context=context))
+    fast_path = lambda value, context: validate_arguments(schema_class, value, context)
+    cached_schema = lambda value, context: validate_arguments(schema_class, value, context,
+                                                              use_fast_path=False)
+    assert _validate(fast_path) == expected
+    assert _validate(cached_schema) == expected
@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+# SPDX-License-Identifier: MIT
+
+from __future__ import print_function, unicode_literals
+
+import threading
+
+from pymta.wakeup import AcceptToken, Notifier, WakeupSignal, wait_readable
+
+
+def test_wakeup_signal_wakes_up_all_waiters():
+    signal = WakeupSignal()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(wait_readable(signal)))
+               for i in range(3)]
+    for thread in threads:
+        thread.start()
+    assert not signal.is_set()
+    signal.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [[signal]] * 3
+    # the signal stays set
+    assert signal.is_set()
+    signal.close()
+
+
+def test_accept_token_can_be_held_by_one_worker_only():
+    token = AcceptToken()
+    stop_signal = WakeupSignal()
+    assert token.acquire(stop_signal)
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(token.acquire(stop_signal)))
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    token.release()
+    waiter.join(5)
+    assert results == [True]
+
+    # waiting for the token stops if the stop signal was set
+    stop_signal.set()
+    assert not token.acquire(stop_signal)
+    token.close()
+    stop_signal.close()
+
+
+def test_notifier_is_reset_by_waiter():
+    notifier = Notifier()
+    assert wait_readable(notifier, timeout=0) == []
+    notifier.notify()
+    notifier.notify()
+    assert wait_readable(notifier, timeout=0) == [notifier]
+    notifier.clear()
+    assert wait_readable(notifier, timeout=0) == []
+    notifier.close()